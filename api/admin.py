@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, ServiceProviderProfile, ServiceCategory, Service, Booking, Rating, Payment, ChatMessage
+from .models import User, ServiceProviderProfile, ServiceCategory, Service, Booking, Rating, Payment, ChatMessage, BookingRollup
 
 # This is the custom admin configuration for our Custom User Model
 class CustomUserAdmin(UserAdmin):
@@ -31,4 +31,5 @@ admin.site.register(Service)
 admin.site.register(Booking)
 admin.site.register(Rating)
 admin.site.register(Payment)
-admin.site.register(ChatMessage)
\ No newline at end of file
+admin.site.register(ChatMessage)
+admin.site.register(BookingRollup)
\ No newline at end of file
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Connect the query hooks before the first database connection opens
+        from . import metrics, profiling  # noqa: F401
+        # Signal receivers: user state publishing, the rollups and heatmap cells of deleted services
+        from . import heatmap, rollups, user_state  # noqa: F401
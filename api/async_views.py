@@ -0,0 +1,255 @@
+# In api/async_views.py
+"""
+Native async handlers for the hottest endpoints: provider location pings and
+duty toggles, the booking list and detail, and the M-Pesa callback.
+
+They answer on the same URLs and with the same bodies as their sync
+counterparts in api/views.py (routed ahead of them when ASYNC_VIEWS is on, see
+api/urls.py), but run on the event loop and query through Django's async ORM,
+so a request waiting on the database or the cache does not hold a worker
+thread. Work that has no async form yet (the heatmap recount, the revenue
+rollups, booking writes) runs in sync_to_async.
+
+Authentication and permissions reuse StatelessJWTAuthentication and the DRF
+permission classes; errors keep DRF's response shapes.
+"""
+import logging
+from io import BytesIO
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, QueryDict
+from django.http.multipartparser import MultiPartParserError
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import permissions, status
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import fastjson, heatmap, rollups
+from .authentication import StatelessJWTAuthentication
+from .logs import log_event
+from .models import Payment, ServiceProviderProfile, User
+from .permissions import IsProviderUser
+from .serializers import BookingSerializer, ProviderLocationSerializer, ProviderStatusSerializer
+from .views import BookingViewSet, bookings_for
+
+logger = logging.getLogger(__name__)
+
+NOT_AUTHENTICATED = 'Authentication credentials were not provided.'
+PERMISSION_DENIED = 'You do not have permission to perform this action.'
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    return HttpResponse(fastjson.dumps(data), status=status, content_type='application/json')
+
+
+class AsyncAPIView(View):
+    """
+    Base class of the async views: authenticates the JWT, checks
+    `permission_classes` and dispatches to the async handler of the method.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    authentication = StatelessJWTAuthentication()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token authentication only, like the DRF views
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            result = await self.authentication.aauthenticate(request)
+        except AuthenticationFailed as exc:
+            response = json_response(exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail},
+                                     status.HTTP_401_UNAUTHORIZED)
+            response['WWW-Authenticate'] = self.authentication.authenticate_header(request)
+            return response
+        request.user, request.auth = result if result is not None else (AnonymousUser(), None)
+
+        for permission in (permission_class() for permission_class in self.permission_classes):
+            if not permission.has_permission(request, self):
+                if request.auth is None:
+                    response = json_response({'detail': NOT_AUTHENTICATED}, status.HTTP_401_UNAUTHORIZED)
+                    response['WWW-Authenticate'] = self.authentication.authenticate_header(request)
+                    return response
+                return json_response({'detail': PERMISSION_DENIED}, status.HTTP_403_FORBIDDEN)
+        return await super().dispatch(request, *args, **kwargs)
+
+    @staticmethod
+    def parse(request):
+        """
+        The body of the request as (data, None), or (None, error response): a
+        JSON object, or the fields of a form, which DRF's FormParser and
+        MultiPartParser accept on the sync views. Django only parses form
+        bodies of POST requests itself.
+        """
+        if request.content_type == 'application/x-www-form-urlencoded':
+            return QueryDict(request.body, encoding=request.encoding), None
+        if request.content_type == 'multipart/form-data':
+            try:
+                return request.parse_file_upload(request.META, BytesIO(request.body))[0], None
+            except MultiPartParserError as exc:
+                return None, json_response({'detail': f'Multipart form parse error - {exc}'}, status.HTTP_400_BAD_REQUEST)
+        if not request.body:
+            return {}, None
+        try:
+            data = fastjson.loads(request.body)
+        except (ValueError, fastjson.JSONDecodeError) as exc:
+            return None, json_response({'detail': f'JSON parse error - {exc}'}, status.HTTP_400_BAD_REQUEST)
+        # The handlers read fields with .get()
+        if not isinstance(data, dict):
+            return None, json_response({'detail': 'Expected a JSON object.'}, status.HTTP_400_BAD_REQUEST)
+        return data, None
+
+
+async def provider_profile(user):
+    """
+    The provider profile of the request user: built from the token claims by
+    StatelessJWTAuthentication, loaded only for tokens predating the claims.
+    """
+    if User.provider_profile.related.is_cached(user):
+        return user.provider_profile
+    return await ServiceProviderProfile.objects.aget(pk=user.pk)
+
+
+# --- Provider ---
+
+class ProviderLocationView(AsyncAPIView):
+    """
+    Async api.views.ProviderLocationView: a single UPDATE while the provider
+    stays in the same heatmap cell.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsProviderUser]
+
+    async def post(self, request, *args, **kwargs):
+        data, error = self.parse(request)
+        if error is not None:
+            return error
+        serializer = ProviderLocationSerializer(data=data)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+        # The profile shares the user's primary key
+        await heatmap.aupdate_provider_location(
+            request.user.pk, serializer.validated_data['latitude'], serializer.validated_data['longitude']
+        )
+        log_event(logger, 'location.ping', provider_id=request.user.pk, source='rest')
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+class ProviderStatusView(AsyncAPIView):
+    """
+    Async api.views.ProviderStatusView.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsProviderUser]
+
+    async def patch(self, request, *args, **kwargs):
+        data, error = self.parse(request)
+        if error is not None:
+            return error
+        profile = await provider_profile(request.user)
+
+        # Enforce admin approval gate: Only verified providers can go on duty
+        if data.get('is_on_duty', False) and not profile.is_verified:
+            return json_response(
+                {'detail': 'Your account must be approved by an administrator before you can go on duty.'},
+                status.HTTP_403_FORBIDDEN,
+            )
+
+        serializer = ProviderStatusSerializer(data=data)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+        on_duty = serializer.validated_data['on_duty']
+        await ServiceProviderProfile.objects.filter(pk=profile.pk).aupdate(on_duty=on_duty)
+        await sync_to_async(heatmap.sync_provider)(profile.pk)
+        return json_response({'is_on_duty': on_duty})
+
+
+# --- Bookings ---
+
+class BookingListView(AsyncAPIView):
+    """
+    GET /api/bookings/ on the event loop; creating a booking (matching,
+    notifications) stays in BookingViewSet.
+    """
+    create = staticmethod(BookingViewSet.as_view({'post': 'create'}))
+
+    async def get(self, request, *args, **kwargs):
+        bookings = [booking async for booking in bookings_for(request.user)]
+        return json_response(BookingSerializer(bookings, many=True).data)
+
+    async def post(self, request, *args, **kwargs):
+        return await sync_to_async(self.create)(request, *args, **kwargs)
+
+
+class BookingDetailView(AsyncAPIView):
+    """
+    GET /api/bookings/{id}/ on the event loop; updates and deletes stay in
+    BookingViewSet.
+    """
+    change = staticmethod(BookingViewSet.as_view({'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}))
+
+    async def get(self, request, pk, *args, **kwargs):
+        try:
+            booking = await bookings_for(request.user).filter(pk=pk).afirst()
+        except (ValueError, ValidationError):
+            booking = None
+        if booking is None:
+            return json_response({'detail': 'Not found.'}, status.HTTP_404_NOT_FOUND)
+        return json_response(BookingSerializer(booking).data)
+
+    async def put(self, request, *args, **kwargs):
+        return await sync_to_async(self.change)(request, *args, **kwargs)
+
+    patch = put
+    delete = put
+
+
+# --- Payments ---
+
+class MpesaCallbackView(AsyncAPIView):
+    """
+    Async api.views.MpesaCallbackView, public like it.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    async def post(self, request, *args, **kwargs):
+        data, error = self.parse(request)
+        if error is not None:
+            return error
+        stk_callback = data.get('Body', {}).get('stkCallback', {})
+        result_code = stk_callback.get('ResultCode')
+        checkout_request_id = stk_callback.get('CheckoutRequestID')
+        log_event(
+            logger, 'mpesa.callback.received', checkout_request_id=checkout_request_id,
+            result_code=result_code, result_desc=stk_callback.get('ResultDesc'),
+        )
+        # The whole body only at DEBUG, with the phone number and receipt redacted
+        log_event(logger, 'mpesa.callback.body', level=logging.DEBUG, body=data)
+
+        try:
+            payment = await Payment.objects.select_related('booking').aget(external_transaction_id=checkout_request_id)
+        except Payment.DoesNotExist:
+            log_event(logger, 'mpesa.callback.unknown', level=logging.WARNING, checkout_request_id=checkout_request_id)
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+
+        # M-Pesa retries callbacks, only count the payment towards revenue once
+        newly_paid = result_code == 0 and payment.status != 'SUCCESS'
+
+        if result_code == 0:
+            payment.status = 'SUCCESS'
+            log_event(logger, 'payment.succeeded', payment_id=payment.id, booking_id=payment.booking_id, retry=not newly_paid)
+        else:
+            payment.status = 'FAILED'
+            log_event(
+                logger, 'payment.failed', level=logging.WARNING, payment_id=payment.id, booking_id=payment.booking_id,
+                result_code=result_code, result_desc=stk_callback.get('ResultDesc'),
+            )
+
+        await payment.asave()
+        if newly_paid:
+            await sync_to_async(rollups.record_payment)(payment.booking, payment.amount)
+
+        # We must return a success response to M-Pesa's server
+        return json_response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
@@ -1,6 +1,13 @@
 # In api/authentication.py
+from asgiref.sync import sync_to_async
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth import get_user_model
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .user_state import aget_user_state, get_user_state, user_from_state
 
 User = get_user_model()
 
@@ -25,3 +32,54 @@ class AllowInactiveUserBackend(ModelBackend):
             if user.check_password(password):
                 # Return user regardless of is_active status
                 return user
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that builds request.user from the token claims instead of
+    looking the user up on every request.
+    The claims (user_type, is_active, is_verified, profile id) are embedded by
+    CustomTokenObtainPairSerializer. When an admin suspends, activates or verifies
+    a user, the new state is published to the cache and takes precedence over the
+    claims of already issued tokens.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        state = get_user_state(user_id, validated_token)
+        if state is None:
+            # Token issued before the state claims existed, use the regular lookup
+            return super().get_user(validated_token)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not state['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return user_from_state(user_id, state)
+
+    async def aauthenticate(self, request):
+        """
+        Async variant of authenticate(), for the async views (api/async_views.py).
+        Only tokens predating the state claims cost a database lookup.
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        state = await aget_user_state(user_id, validated_token)
+        if state is None:
+            return await sync_to_async(JWTAuthentication.get_user)(self, validated_token), validated_token
+        if api_settings.CHECK_USER_IS_ACTIVE and not state['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user_from_state(user_id, state), validated_token
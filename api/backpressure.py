@@ -0,0 +1,135 @@
+# In api/backpressure.py
+"""
+Bounded per-connection outbound queues for the websocket consumers.
+
+Group events are put on the connection's queue and a writer task sends them, so a
+client on a slow link only ever holds a bounded backlog in the server process:
+
+- DROP_OLDEST keeps the newest items (location: only the latest fix matters)
+- DISCONNECT closes the connection once the backlog is full (chat: the client
+  reconnects and reloads the history instead of silently losing messages)
+
+A writer that fails logs the error and closes the connection, rather than
+leaving a socket that still accepts events but never sends them.
+"""
+import asyncio
+import logging
+import weakref
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+DISCONNECT = 'disconnect'
+
+# Close code sent to a client that fell too far behind
+OVERFLOW_CLOSE_CODE = 4008
+# Close code sent when the writer failed (1011: internal error)
+WRITER_FAILED_CLOSE_CODE = 1011
+
+_queues = weakref.WeakSet()
+# Cumulative counters per consumer class, they outlive the connections
+_totals = {}
+
+
+class OutboundQueue:
+    def __init__(self, maxsize, policy, name=''):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.name = name
+        self.overflowed = False
+        self._items = deque()
+        self._ready = asyncio.Event()
+        self._totals = _totals.setdefault(name, {'dropped': 0, 'overflowed': 0})
+        _queues.add(self)
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        """
+        Queue an item. Returns False when the queue overflowed under the
+        DISCONNECT policy; the connection should then be closed.
+        """
+        if self.overflowed:
+            return False
+        if self.maxsize and len(self._items) >= self.maxsize:
+            if self.policy == DISCONNECT:
+                self.overflowed = True
+                self._totals['overflowed'] += 1
+                self._items.clear()
+                return False
+            self._items.popleft()
+            self._totals['dropped'] += 1
+        self._items.append(item)
+        self._ready.set()
+        return True
+
+    async def get(self):
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._items.popleft()
+
+
+def outbound_stats():
+    """
+    Queue metrics per consumer class: open connections, queued items (total and
+    deepest queue), plus the items dropped and the connections closed for
+    overflowing since the process started.
+    """
+    stats = {
+        name: {'connections': 0, 'depth': 0, 'max_depth': 0, **totals}
+        for name, totals in _totals.items()
+    }
+    for queue in list(_queues):
+        entry = stats[queue.name]
+        depth = len(queue)
+        entry['connections'] += 1
+        entry['depth'] += depth
+        entry['max_depth'] = max(entry['max_depth'], depth)
+    return stats
+
+
+class BoundedSendMixin:
+    """
+    Mixin for AsyncWebsocketConsumer. Call start_outbound() once accepted and
+    stop_outbound() on disconnect, queue items with enqueue() and implement
+    send_outbound(item) to actually write one to the socket.
+    """
+    outbound_maxsize = 64
+    outbound_policy = DROP_OLDEST
+    _outbound_writer = None
+
+    def start_outbound(self):
+        self.outbound = OutboundQueue(self.outbound_maxsize, self.outbound_policy, name=type(self).__name__)
+        self._outbound_writer = asyncio.ensure_future(self._drain_outbound())
+
+    async def stop_outbound(self):
+        writer = self._outbound_writer
+        if writer is not None:
+            writer.cancel()
+            self._outbound_writer = None
+            _queues.discard(self.outbound)
+
+    async def enqueue(self, item):
+        if self._outbound_writer is None:
+            return # Not accepted yet, or already closed
+        if not self.outbound.put(item):
+            await self.stop_outbound()
+            await self.close(code=OVERFLOW_CLOSE_CODE)
+
+    async def _drain_outbound(self):
+        try:
+            while True:
+                item = await self.outbound.get()
+                await self.send_outbound(item)
+        except Exception:
+            logger.exception('socket.writer_failed', extra={'event_fields': {'consumer': type(self).__name__}})
+            # Stop queueing for a writer that is gone; this task is the writer, so it is not cancelled
+            self._outbound_writer = None
+            _queues.discard(self.outbound)
+            await self.close(code=WRITER_FAILED_CLOSE_CODE)
+
+    async def send_outbound(self, item):
+        raise NotImplementedError
@@ -0,0 +1,502 @@
+# In api/benchmarks.py
+"""
+Micro-benchmarks for the hot paths, run with `manage.py run_benchmarks`.
+
+Each benchmark has an optional setup (returning a state object passed to the
+timed function) and teardown. Fixtures that only the benchmarking thread uses
+live in a transaction that is rolled back afterwards; the consumer benchmarks
+commit theirs (the consumers query from another thread) and delete them.
+
+Results are appended to a history file, and a run can be compared against the
+recent history of the same machine to catch regressions.
+"""
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+import uuid
+from decimal import Decimal
+from types import ModuleType, SimpleNamespace
+
+from asgiref.testing import ApplicationCommunicator
+from channels.routing import URLRouter
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.db import transaction
+from django.test.utils import override_settings
+from django.urls import include, path
+from django.utils import timezone
+
+from .eta import HaversineSpeedModel
+from .loadtest import AsgiClient, LatencyRecorder
+from .models import Booking, ChatMessage, Payment, Rating, Service, ServiceCategory, ServiceProviderProfile, User
+from .routing import websocket_urlpatterns
+from .serializers import AdminUserSerializer, BookingSerializer, CustomTokenObtainPairSerializer, ProviderProfileSerializer
+from .utils import haversine
+from .views import AdminUserViewSet
+
+# Fixture users are created with this username prefix
+PREFIX = 'bench-'
+
+BENCHMARKS = {}
+
+
+class Benchmark:
+
+    def __init__(self, name, func, setup=None, teardown=None, rounds=20):
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.teardown = teardown
+        self.rounds = rounds
+
+    def run(self, rounds=None):
+        """
+        Time `rounds` calls (after one warm-up call) and return the statistics in seconds.
+        """
+        state = self.setup() if self.setup else None
+        try:
+            self.func(state)
+            timings = []
+            for _ in range(rounds or self.rounds):
+                start = time.perf_counter()
+                self.func(state)
+                timings.append(time.perf_counter() - start)
+        finally:
+            if self.teardown:
+                self.teardown(state)
+        return {
+            'rounds': len(timings),
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'mean': statistics.fmean(timings),
+        }
+
+
+def benchmark(name, setup=None, teardown=None, rounds=20):
+    def register(func):
+        BENCHMARKS[name] = Benchmark(name, func, setup, teardown, rounds)
+        return func
+    return register
+
+
+# --- Fixtures ---
+
+def rollback_fixtures(build):
+    """
+    setup/teardown pair running `build()` inside a transaction that the
+    teardown rolls back.
+    """
+    def setup():
+        atomic = transaction.atomic()
+        atomic.__enter__()
+        try:
+            state = build()
+        except BaseException:
+            atomic.__exit__(None, None, None)
+            raise
+        return SimpleNamespace(atomic=atomic, **state)
+
+    def teardown(state):
+        transaction.set_rollback(True)
+        state.atomic.__exit__(None, None, None)
+
+    return setup, teardown
+
+
+def create_service():
+    category = ServiceCategory.objects.create(name=f'{PREFIX}{uuid.uuid4().hex[:8]}')
+    return Service.objects.create(
+        category=category, name='Pipe repair', description='Fix leaking pipes', estimated_base_price=Decimal('1500.00'),
+    )
+
+
+def create_users(user_type, count, **fields):
+    tag = uuid.uuid4().hex[:8]
+    User.objects.bulk_create([
+        User(username=f'{PREFIX}{tag}-{user_type.lower()}-{i}', user_type=user_type, **fields)
+        for i in range(count)
+    ], batch_size=1000)
+    return list(User.objects.filter(username__startswith=f'{PREFIX}{tag}-').order_by('pk'))
+
+
+def build_bookings(count):
+    """
+    Unsaved bookings with their related objects cached, so serializing them
+    does not touch the database.
+    """
+    category = ServiceCategory(id=1, name='Plumbing')
+    service = Service(id=1, category=category, name='Pipe repair', description='Fix leaking pipes', estimated_base_price=Decimal('1500.00'))
+    bookings = []
+    for i in range(count):
+        customer = User(id=2 * i + 1, username=f'customer{i}', email=f'c{i}@example.com', user_type='CUSTOMER')
+        provider = User(id=2 * i + 2, username=f'provider{i}', email=f'p{i}@example.com', user_type='PROVIDER')
+        ServiceProviderProfile(user=provider, is_verified=True, on_duty=True, average_rating=4.5, bio='Experienced')
+        bookings.append(Booking(
+            id=uuid.uuid4(), customer=customer, provider=provider, service=service, status='COMPLETED',
+            booking_latitude=-6.8, booking_longitude=39.28, final_price=Decimal('1500.00'),
+            created_at=timezone.now(), accepted_at=timezone.now(), completed_at=timezone.now(),
+        ))
+    return bookings
+
+
+def build_profiles(count, ratings_per_provider=5):
+    service = Service(id=1, name='Pipe repair', description='Fix leaking pipes', estimated_base_price=Decimal('1500.00'))
+    rater = User(id=10**6, username='rater', user_type='CUSTOMER')
+    profiles = []
+    for i in range(count):
+        user = User(id=i + 1, username=f'provider{i}', email=f'p{i}@example.com', user_type='PROVIDER')
+        profile = ServiceProviderProfile(user=user, service_offered=service, is_verified=True, on_duty=True, average_rating=4.2, bio='Experienced')
+        ratings = [Rating(id=i * 100 + j, rater=rater, ratee=user, score=4, comment='Good job', created_at=timezone.now())
+                   for j in range(ratings_per_provider)]
+        # Behave as if user.received_ratings had been prefetched
+        queryset = Rating.objects.all()
+        queryset._result_cache = ratings
+        queryset._prefetch_done = True
+        user._prefetched_objects_cache = {'received_ratings': queryset}
+        profiles.append(profile)
+    return profiles
+
+
+# --- Matching ---
+
+CENTER = (-6.7924, 39.2083)
+
+
+def _matching_fixtures(providers):
+    def build():
+        rng = random.Random(providers)
+        service = create_service()
+        customer = create_users('CUSTOMER', 1)[0]
+        # Spread over about 10 km x 10 km around the customer
+        ServiceProviderProfile.objects.bulk_create([
+            ServiceProviderProfile(
+                user=user, service_offered=service, is_verified=True, on_duty=True,
+                last_known_latitude=CENTER[0] + rng.uniform(-0.045, 0.045),
+                last_known_longitude=CENTER[1] + rng.uniform(-0.045, 0.045),
+            )
+            for user in create_users('PROVIDER', providers)
+        ], batch_size=1000)
+        return {'service': service, 'request': SimpleNamespace(user=customer)}
+    return rollback_fixtures(build)
+
+
+def _register_matching(providers):
+    setup, teardown = _matching_fixtures(providers)
+
+    @benchmark(f'matching.create_booking[{providers} providers]', setup, teardown, rounds=20)
+    def create_booking(state):
+        serializer = BookingSerializer(
+            data={'service_id': state.service.id, 'latitude': CENTER[0], 'longitude': CENTER[1]},
+            context={'request': state.request},
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save(customer=state.request.user)
+
+
+for _providers in (100, 1000, 10000):
+    _register_matching(_providers)
+
+
+# --- Geometry ---
+
+def _points():
+    rng = random.Random(1)
+    return [(CENTER[0] + rng.uniform(-0.5, 0.5), CENTER[1] + rng.uniform(-0.5, 0.5)) for _ in range(10000)]
+
+
+@benchmark('geo.haversine[10000 calls]', setup=_points, rounds=50)
+def haversine_calls(points):
+    lat, lon = CENTER
+    for point_lat, point_lon in points:
+        haversine(lat, lon, point_lat, point_lon)
+
+
+@benchmark('geo.eta_batch[10000 origins]', setup=_points, rounds=50)
+def eta_batch(points):
+    HaversineSpeedModel().estimate(points, CENTER)
+
+
+# --- Serialization ---
+
+@benchmark('serialize.bookings[500]', setup=lambda: build_bookings(500), rounds=20)
+def serialize_bookings(bookings):
+    BookingSerializer(bookings, many=True).data
+
+
+@benchmark('serialize.provider_profiles[500]', setup=lambda: build_profiles(500), rounds=20)
+def serialize_profiles(profiles):
+    ProviderProfileSerializer(profiles, many=True).data
+
+
+def _admin_users():
+    rng = random.Random(2)
+    service = create_service()
+    customers = create_users('CUSTOMER', 250)
+    providers = create_users('PROVIDER', 250)
+    ServiceProviderProfile.objects.bulk_create([
+        ServiceProviderProfile(user=user, service_offered=service, is_verified=True) for user in providers
+    ])
+    Booking.objects.bulk_create([
+        Booking(
+            customer=rng.choice(customers), provider=rng.choice(providers), service=service,
+            status='COMPLETED', booking_latitude=CENTER[0], booking_longitude=CENTER[1],
+        )
+        for _ in range(2000)
+    ], batch_size=1000)
+    return {'user_ids': [user.pk for user in customers + providers]}
+
+
+@benchmark('serialize.admin_users[500]', *rollback_fixtures(_admin_users), rounds=20)
+def serialize_admin_users(state):
+    # The queryset of the admin user list, restricted to the fixture users
+    queryset = AdminUserViewSet.queryset.filter(pk__in=state.user_ids)
+    AdminUserSerializer(queryset, many=True).data
+
+
+# --- Consumers ---
+
+class _SocketPair:
+    """
+    A customer and a provider connected to the same booking through a consumer,
+    with an in-memory channel layer.
+    """
+
+    def __init__(self, route):
+        self.route = route
+
+    def setup(self):
+        self.settings = override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+        self.settings.enable()
+        self.customer = create_users('CUSTOMER', 1)[0]
+        self.provider = create_users('PROVIDER', 1)[0]
+        self.booking = Booking.objects.create(
+            customer=self.customer, provider=self.provider, status='IN_PROGRESS',
+            booking_latitude=CENTER[0], booking_longitude=CENTER[1],
+        )
+        self.loop = asyncio.new_event_loop()
+        self.application = URLRouter(websocket_urlpatterns)
+        self.sockets = {
+            user.user_type: self.loop.run_until_complete(self._connect(user))
+            for user in (self.customer, self.provider)
+        }
+        return self
+
+    async def _connect(self, user):
+        path = f'/ws/{self.route}/{self.booking.pk}/'
+        communicator = ApplicationCommunicator(self.application, {
+            'type': 'websocket', 'path': path, 'user': user, 'subprotocols': [], 'headers': [],
+            'query_string': b'',
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        message = await communicator.receive_output(5)
+        assert message['type'] == 'websocket.accept', message
+        return communicator
+
+    def round_trip(self, sender, receiver, payload, echo=False):
+        """
+        Send `payload` from one socket and wait until the other one gets it.
+        With `echo`, the sender's own copy (chat groups include the sender) is
+        drained as well.
+        """
+        async def exchange():
+            await self.sockets[sender].send_input({'type': 'websocket.receive', 'text': json.dumps(payload)})
+            message = await self.sockets[receiver].receive_output(5)
+            if echo:
+                await self.sockets[sender].receive_output(5)
+            return message
+        return self.loop.run_until_complete(exchange())
+
+    def teardown(self, state):
+        async def close():
+            for communicator in self.sockets.values():
+                await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+                await communicator.wait(5)
+        try:
+            self.loop.run_until_complete(close())
+            self.loop.close()
+        finally:
+            self.settings.disable()
+            ChatMessage.objects.filter(booking=self.booking).delete()
+            self.booking.delete()
+            User.objects.filter(pk__in=[self.customer.pk, self.provider.pk]).delete()
+
+
+_chat = _SocketPair('chat')
+
+
+@benchmark('consumers.chat_round_trip', _chat.setup, _chat.teardown, rounds=200)
+def chat_round_trip(pair):
+    # Customer -> ChatConsumer (saves the message) -> layer -> provider socket
+    pair.round_trip('CUSTOMER', 'PROVIDER', {'message': 'On my way?'}, echo=True)
+
+
+_location = _SocketPair('location')
+
+
+@benchmark('consumers.location_round_trip', _location.setup, _location.teardown, rounds=500)
+def location_round_trip(pair):
+    # Provider -> LocationConsumer -> layer -> customer socket
+    pair.round_trip('PROVIDER', 'CUSTOMER', {'latitude': CENTER[0] + 0.001, 'longitude': CENTER[1] + 0.001})
+
+
+# --- Views: sync vs async ---
+
+# Requests in flight at once per round
+CONCURRENCY = 50
+
+
+def api_urlconf(api_patterns):
+    """
+    A root URLconf serving `api_patterns` under /api/, e.g. api.urls.sync_urlpatterns
+    to route the hot paths to the sync views whatever ASYNC_VIEWS says.
+    """
+    module = ModuleType('api_urlconf')
+    module.urlpatterns = [path('api/', include(api_patterns))]
+    return module
+
+
+class _ViewLoad:
+    """
+    CONCURRENCY copies of one request sent at once through the ASGI handler,
+    with the hot paths routed to the sync or the async views. The fixtures are
+    committed (the views query from other threads) and deleted afterwards.
+    """
+
+    def __init__(self, variant, method, path, user_type, body=None):
+        self.variant = variant
+        self.method = method
+        self.path = path
+        self.user_type = user_type
+        self.body = body
+
+    def setup(self):
+        from . import urls
+
+        patterns = urls.async_urlpatterns + urls.sync_urlpatterns if self.variant == 'async' else urls.sync_urlpatterns
+        self.settings = override_settings(ROOT_URLCONF=api_urlconf(patterns))
+        self.settings.enable()
+        self.service = create_service()
+        self.customer = create_users('CUSTOMER', 1)[0]
+        self.provider = create_users('PROVIDER', 1)[0]
+        ServiceProviderProfile.objects.create(
+            user=self.provider, service_offered=self.service, is_verified=True, on_duty=True,
+            last_known_latitude=CENTER[0], last_known_longitude=CENTER[1],
+        )
+        self.bookings = Booking.objects.bulk_create([
+            Booking(
+                customer=self.customer, provider=self.provider, service=self.service, status='COMPLETED',
+                booking_latitude=CENTER[0], booking_longitude=CENTER[1], final_price=Decimal('1500.00'),
+            )
+            for _ in range(20)
+        ])
+        self.payment = Payment.objects.create(
+            booking=self.bookings[0], amount=Decimal('1500.00'), payment_method='M-PESA', status='PENDING',
+            external_transaction_id=f'{PREFIX}{uuid.uuid4().hex}',
+        )
+        user = self.provider if self.user_type == 'PROVIDER' else self.customer
+        self.token = str(CustomTokenObtainPairSerializer.get_token(user).access_token) if self.user_type else None
+        self.loop = asyncio.new_event_loop()
+        self.client = AsgiClient(get_asgi_application(), LatencyRecorder())
+        return self
+
+    def send(self):
+        path = self.path.format(booking=self.bookings[0].pk)
+        body = self.body(self) if self.body else None
+
+        async def burst():
+            return await asyncio.gather(*(
+                self.client.request(path, self.method, path, self.token, body) for _ in range(CONCURRENCY)
+            ))
+        statuses = {status for status, _ in self.loop.run_until_complete(burst())}
+        if max(statuses) >= 400:
+            raise RuntimeError(f'{self.method} {path} ({self.variant}) answered {sorted(statuses)}')
+
+    def teardown(self, state):
+        try:
+            self.loop.close()
+        finally:
+            self.settings.disable()
+            Payment.objects.filter(pk=self.payment.pk).delete()
+            Booking.objects.filter(pk__in=[booking.pk for booking in self.bookings]).delete()
+            User.objects.filter(pk__in=[self.customer.pk, self.provider.pk]).delete()
+            self.service.category.delete()
+
+
+def _mpesa_callback(load):
+    return {'Body': {'stkCallback': {
+        'CheckoutRequestID': load.payment.external_transaction_id, 'ResultCode': 0, 'ResultDesc': 'OK',
+    }}}
+
+
+VIEW_LOADS = {
+    'provider_location': ('POST', '/api/provider/location/', 'PROVIDER',
+                          lambda load: {'latitude': CENTER[0] + 0.001, 'longitude': CENTER[1]}),
+    'provider_status': ('PATCH', '/api/provider/status/', 'PROVIDER', lambda load: {'is_on_duty': True}),
+    'booking_list': ('GET', '/api/bookings/', 'CUSTOMER', None),
+    'booking_detail': ('GET', '/api/bookings/{booking}/', 'CUSTOMER', None),
+    'mpesa_callback': ('POST', '/api/payments/callback/', None, _mpesa_callback),
+}
+
+
+def _register_view_load(name, variant, method, path, user_type, body):
+    load = _ViewLoad(variant, method, path, user_type, body)
+
+    @benchmark(f'views.{name}[{variant} x{CONCURRENCY}]', load.setup, load.teardown, rounds=10)
+    def send(load):
+        load.send()
+
+
+for _name, _request in VIEW_LOADS.items():
+    for _variant in ('sync', 'async'):
+        _register_view_load(_name, _variant, *_request)
+
+
+# --- History ---
+
+def default_history_path():
+    return os.getenv('BENCHMARK_HISTORY', str(settings.BASE_DIR / '.benchmarks' / 'history.json'))
+
+
+def machine_id():
+    return f'{platform.node()}/{platform.python_implementation()}-{platform.python_version()}'
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    try:
+        with open(path) as history_file:
+            return json.load(history_file)
+    except FileNotFoundError:
+        return []
+
+
+def save_history(path, history):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as history_file:
+        json.dump(history, history_file, indent=1)
+
+
+def baseline(history, name, machine, window):
+    """
+    Median of the medians recorded for `name` on this machine over the last
+    `window` runs that have it, or None.
+    """
+    medians = [
+        run['results'][name]['median'] for run in history
+        if run.get('machine') == machine and name in run['results']
+    ][-window:]
+    return statistics.median(medians) if medians else None
@@ -0,0 +1,104 @@
+# In api/booking_transitions.py
+from typing import NamedTuple, Optional
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from . import heatmap, rollups
+from .connection_context import publish_status
+from .models import Booking
+
+# Provider-driven booking state machine.
+# Each transition is applied as a single conditional UPDATE, so a double-tap or two
+# concurrent requests can never apply it twice.
+TRANSITIONS = {
+    'accept': {
+        'from': 'PENDING',
+        'to': 'ACCEPTED',
+        'timestamp': 'accepted_at',
+        'error': 'Cannot accept a booking with status {status}.',
+    },
+    'decline': {
+        'from': 'PENDING',
+        'to': 'REJECTED',
+        'timestamp': None,
+        'error': 'Cannot decline a booking with status {status}.',
+    },
+    'start': {
+        'from': 'ACCEPTED',
+        'to': 'IN_PROGRESS',
+        'timestamp': None,
+        'error': 'Cannot start a job with status {status}.',
+    },
+    'complete': {
+        'from': 'IN_PROGRESS',
+        'to': 'COMPLETED',
+        'timestamp': 'completed_at',
+        'error': 'Cannot complete a job with status {status}.',
+    },
+}
+
+
+class TransitionResult(NamedTuple):
+    applied: bool
+    booking_id: object
+    status: Optional[str]
+    # The fields written by the transition (status and timestamp)
+    changes: dict
+    # None, 'not_found' or 'invalid_status'
+    error: Optional[str] = None
+    error_message: Optional[str] = None
+
+    def as_dict(self):
+        """
+        Compact response body for a successful transition.
+        """
+        data = {'id': str(self.booking_id), 'applied': self.applied}
+        for field, value in self.changes.items():
+            data[field] = value.isoformat() if hasattr(value, 'isoformat') else value
+        return data
+
+
+def apply_transition(booking_id, provider, name):
+    """
+    Apply the transition `name` to a booking assigned to `provider`.
+
+    The happy path is one `UPDATE ... WHERE id=? AND provider_id=? AND status=?`
+    (plus the analytics rollup and heatmap, in the same transaction), then the
+    new status is pushed to the booking's sockets.
+    Only when nothing was updated is the booking read, to tell a missing (or
+    someone else's) booking apart from one in the wrong status.
+    """
+    transition = TRANSITIONS[name]
+    changes = {'status': transition['to']}
+    if transition['timestamp']:
+        changes[transition['timestamp']] = timezone.now()
+
+    try:
+        with transaction.atomic():
+            updated = Booking.objects.filter(
+                pk=booking_id, provider=provider, status=transition['from']
+            ).update(**changes)
+            if updated:
+                booking = Booking.objects.filter(pk=booking_id).values(
+                    'created_at', 'service_id', 'booking_latitude', 'booking_longitude'
+                ).first()
+                rollups.record_transition(booking, transition['from'], transition['to'])
+                heatmap.record_transition(booking, transition['from'], transition['to'])
+                # Connected sockets refresh their context once the change is visible
+                transaction.on_commit(lambda: publish_status(booking_id, transition['to']))
+    except ValidationError:
+        # Malformed UUID
+        return TransitionResult(False, booking_id, None, {}, 'not_found')
+
+    if updated:
+        return TransitionResult(True, booking_id, transition['to'], changes)
+
+    current = Booking.objects.filter(pk=booking_id, provider=provider).values_list('status', flat=True).first()
+    if current is None:
+        return TransitionResult(False, booking_id, None, {}, 'not_found')
+    return TransitionResult(
+        False, booking_id, current, {}, 'invalid_status',
+        transition['error'].format(status=current),
+    )
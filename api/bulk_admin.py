@@ -0,0 +1,93 @@
+# In api/bulk_admin.py
+from django.db import transaction
+
+from . import heatmap
+from .models import User, ServiceProviderProfile
+from .user_state import publish_user_states, user_from_state
+
+# Upper bound on the users changed by one bulk request
+MAX_BULK_USERS = 1000
+
+NOT_FOUND = 'Not found'
+
+# The bulk counterparts of AdminUserViewSet.suspend / activate / verify_provider.
+# 'user' and 'profile' are the fields set with one UPDATE each, 'reject' returns
+# the reason a user is skipped (or None).
+BULK_ACTIONS = {
+    'suspend': {
+        'user': {'is_active': False},
+        # Suspended providers also go off duty
+        'profile': {'on_duty': False},
+        'reject': lambda row: 'Cannot suspend superuser accounts' if row['is_superuser'] else None,
+    },
+    'activate': {
+        'user': {'is_active': True},
+        'profile': {},
+        'reject': lambda row: None,
+    },
+    'verify': {
+        'user': {'is_active': True},
+        'profile': {'is_verified': True},
+        'reject': lambda row: (
+            'User is not a provider' if row['user_type'] != 'PROVIDER'
+            else 'Provider profile not found' if row['provider_profile__user_id'] is None
+            else None
+        ),
+    },
+}
+
+
+def apply_bulk_action(name, queryset, requested_ids=None):
+    """
+    Apply a bulk action to the users of `queryset` with set-based UPDATEs: one
+    read, one UPDATE on User and at most one on ServiceProviderProfile (plus
+    the heatmap bookkeeping when suspending), in a single transaction. No
+    post_save signals fire.
+
+    Returns ({user_id: 'ok' or the reason it was skipped}, matched): ids in
+    `requested_ids` that matched no user are reported as NOT_FOUND, `matched`
+    counts the users of `queryset`, of which only the first MAX_BULK_USERS (by
+    id) are handled.
+    """
+    spec = BULK_ACTIONS[name]
+    results = {}
+    states = {}
+    with transaction.atomic():
+        rows = list(queryset.select_for_update(of=('self',)).values(
+            'id', 'username', 'user_type', 'is_active', 'is_superuser',
+            'provider_profile__user_id', 'provider_profile__is_verified',
+        ).order_by('id')[:MAX_BULK_USERS])
+        # Only a full batch may have left users out, count them before the UPDATE changes the match
+        matched = queryset.count() if len(rows) == MAX_BULK_USERS else len(rows)
+        for row in rows:
+            reason = spec['reject'](row)
+            results[row['id']] = reason or 'ok'
+            if reason is None:
+                state = {
+                    'username': row['username'],
+                    'user_type': row['user_type'],
+                    'is_active': row['is_active'],
+                    'is_verified': bool(row['provider_profile__is_verified']),
+                    'profile_id': row['provider_profile__user_id'] if row['user_type'] == 'PROVIDER' else None,
+                }
+                state.update((field, value) for field, value in spec['user'].items() if field in state)
+                state.update((field, value) for field, value in spec['profile'].items() if field in state)
+                states[row['id']] = state
+
+        if states:
+            User.objects.filter(pk__in=list(states)).update(**spec['user'])
+            provider_ids = [user_id for user_id, state in states.items() if state['profile_id'] is not None]
+            if spec['profile']:
+                ServiceProviderProfile.objects.filter(user_id__in=provider_ids).update(**spec['profile'])
+            if spec['profile'].get('on_duty') is False:
+                # Off duty providers no longer count as supply
+                heatmap.remove_providers(provider_ids)
+
+            # Outstanding tokens must see the change, even from cache-only auth
+            transaction.on_commit(lambda: publish_user_states(
+                user_from_state(user_id, state) for user_id, state in states.items()
+            ))
+
+    for user_id in requested_ids or ():
+        results.setdefault(user_id, NOT_FOUND)
+    return results, matched
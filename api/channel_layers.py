@@ -0,0 +1,244 @@
+# In api/channel_layers.py
+"""
+Channel layer strategies, selected in settings with CHANNEL_LAYER:
+
+- ShardedRedisChannelLayer / ShardedRedisPubSubChannelLayer: channels_redis layers
+  whose groups and channels are spread over the hosts with a consistent hash ring,
+  so adding a Redis host only moves ~1/N of the booking groups.
+- LocalFirstChannelLayer: delivers group messages to members connected to this
+  process directly, and only goes through the inner (Redis) layer when another
+  node has members in the group. Without an inner layer it is a pure in-process
+  layer, for a single process only: a message sent from another worker (or a
+  management command) never reaches the sockets of this one.
+"""
+import asyncio
+import bisect
+import hashlib
+import time
+import uuid
+
+from channels.layers import BaseChannelLayer, InMemoryChannelLayer
+from channels_redis.core import RedisChannelLayer
+from channels_redis.pubsub import RedisPubSubChannelLayer, RedisPubSubLoopLayer
+from channels_redis.utils import _wrap_close
+from django.utils.module_loading import import_string
+
+
+class HashRing:
+    """
+    Consistent hash ring with virtual nodes, mapping a key to a node index.
+    """
+
+    def __init__(self, nodes, replicas=128):
+        self._ring = []
+        for index, node in enumerate(nodes):
+            for replica in range(replicas):
+                self._ring.append((self._hash(f'{node}#{replica}'), index))
+        self._ring.sort()
+        self._keys = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(value):
+        if isinstance(value, str):
+            value = value.encode('utf8')
+        return int.from_bytes(hashlib.md5(value).digest()[:8], 'big')
+
+    def get(self, key):
+        if len(self._ring) == 0:
+            raise ValueError('Empty hash ring')
+        position = bisect.bisect(self._keys, self._hash(key)) % len(self._ring)
+        return self._ring[position][1]
+
+
+def _host_id(host):
+    if isinstance(host, dict):
+        return host.get('address') or f"{host.get('host')}:{host.get('port')}"
+    if isinstance(host, (list, tuple)):
+        return f'{host[0]}:{host[1]}'
+    return str(host)
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """
+    RedisChannelLayer using a consistent hash ring over its hosts instead of
+    channels_redis' range partitioning.
+    """
+
+    def __init__(self, hosts=None, **kwargs):
+        super().__init__(hosts=hosts, **kwargs)
+        self._hash_ring = HashRing([_host_id(host) for host in self.hosts])
+
+    def consistent_hash(self, value):
+        return self._hash_ring.get(value)
+
+
+class _ShardedPubSubLoopLayer(RedisPubSubLoopLayer):
+    def __init__(self, hosts=None, **kwargs):
+        super().__init__(hosts=hosts, **kwargs)
+        self._hash_ring = HashRing([_host_id(host) for host in (hosts or [('localhost', 6379)])])
+
+    def _get_shard(self, channel_or_group_name):
+        return self._shards[self._hash_ring.get(channel_or_group_name)]
+
+
+class ShardedRedisPubSubChannelLayer(RedisPubSubChannelLayer):
+    """
+    Redis pub/sub layer sharded with a consistent hash ring over its hosts.
+    """
+
+    def _get_layer(self):
+        loop = asyncio.get_running_loop()
+        try:
+            layer = self._layers[loop]
+        except KeyError:
+            layer = _ShardedPubSubLoopLayer(*self._args, **self._kwargs, channel_layer=self)
+            self._layers[loop] = layer
+            _wrap_close(self, loop)
+        return layer
+
+
+# Control messages exchanged between the nodes of a LocalFirstChannelLayer
+_GROUP = 'layer.group'
+_DIRECT = 'layer.direct'
+_JOIN = 'layer.join'
+_HERE = 'layer.here'
+_LEAVE = 'layer.leave'
+
+
+class LocalFirstChannelLayer(BaseChannelLayer):
+    """
+    In-process channel layer with an optional inner layer for cross-node delivery.
+
+    Every consumer channel lives in this process. Per group, the node (not every
+    connection) joins the inner group with its node channel and announces itself,
+    so each node learns which other nodes have members. A group_send is delivered
+    locally right away and is only skipped on the inner layer when this node has
+    members itself (so it tracks the group) and knows of no other node with
+    members. A node without members, e.g. an HTTP worker publishing a booking's
+    status, always publishes.
+    """
+    extensions = ['groups', 'flush']
+
+    # While a join is being announced, keep publishing even if no peer is known yet
+    PRESENCE_GRACE = 2.0
+
+    def __init__(self, inner=None, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.group_expiry = group_expiry
+        self.local = InMemoryChannelLayer(
+            expiry=expiry, group_expiry=group_expiry, capacity=capacity, channel_capacity=channel_capacity,
+        )
+        if isinstance(inner, dict):
+            inner = import_string(inner['BACKEND'])(**inner.get('CONFIG', {}))
+        self.inner = inner
+        self.node_id = uuid.uuid4().hex[:12]
+        self.node_channel = f'layer-node.{self.node_id}'
+        self.local_prefix = f'local.{self.node_id}.'
+        # group -> {node channel: last seen}, for the other nodes with members
+        self.remote_nodes = {}
+        self._grace_until = {}
+        self._reader = None
+
+    # --- Channels ---
+
+    async def new_channel(self, prefix='specific.'):
+        await self._ensure_reader()
+        return await self.local.new_channel(prefix=self.local_prefix)
+
+    async def send(self, channel, message):
+        if channel.startswith(self.local_prefix) or self.inner is None:
+            await self.local.send(channel, message)
+            return
+        # A channel of another node: hand it to that node's reader
+        node_id = channel[len('local.'):].split('.', 1)[0]
+        await self.inner.send(f'layer-node.{node_id}', {'type': _DIRECT, 'channel': channel, 'message': message})
+
+    async def receive(self, channel):
+        return await self.local.receive(channel)
+
+    # --- Groups ---
+
+    async def group_add(self, group, channel):
+        first_member = not self.local.groups.get(group)
+        await self.local.group_add(group, channel)
+        if first_member and self.inner is not None:
+            await self._ensure_reader()
+            self._grace_until[group] = time.monotonic() + self.PRESENCE_GRACE
+            await self.inner.group_add(group, self.node_channel)
+            await self.inner.group_send(group, {'type': _JOIN, 'group': group, 'node': self.node_channel})
+
+    async def group_discard(self, group, channel):
+        await self.local.group_discard(group, channel)
+        if not self.local.groups.get(group) and self.inner is not None:
+            self._grace_until.pop(group, None)
+            await self.inner.group_discard(group, self.node_channel)
+            if self.remote_nodes.pop(group, None):
+                await self.inner.group_send(group, {'type': _LEAVE, 'group': group, 'node': self.node_channel})
+
+    async def group_send(self, group, message):
+        await self.local.group_send(group, message)
+        if self.inner is not None and self._has_remote_members(group):
+            await self.inner.group_send(group, {
+                'type': _GROUP, 'group': group, 'node': self.node_channel, 'message': message,
+            })
+
+    def _has_remote_members(self, group):
+        if not self.local.groups.get(group):
+            # Not in the group, so no announcements of the other nodes were heard
+            return True
+        now = time.monotonic()
+        if self._grace_until.get(group, 0) > now:
+            return True
+        nodes = self.remote_nodes.get(group)
+        if not nodes:
+            return False
+        # Forget nodes that have not been heard from within the group expiry
+        for node, seen in list(nodes.items()):
+            if now - seen > self.group_expiry:
+                del nodes[node]
+        return bool(nodes)
+
+    # --- Node reader ---
+
+    async def _ensure_reader(self):
+        if self.inner is not None and (self._reader is None or self._reader.done()):
+            self._reader = asyncio.ensure_future(self._read_node_channel())
+
+    async def _read_node_channel(self):
+        while True:
+            message = await self.inner.receive(self.node_channel)
+            await self._handle_node_message(message)
+
+    async def _handle_node_message(self, message):
+        kind = message.get('type')
+        if kind == _DIRECT:
+            await self.local.send(message['channel'], message['message'])
+            return
+
+        group, node = message['group'], message['node']
+        if node == self.node_channel:
+            return # Our own publication, already delivered locally
+        if kind == _GROUP:
+            self.remote_nodes.setdefault(group, {})[node] = time.monotonic()
+            await self.local.group_send(group, message['message'])
+        elif kind == _JOIN:
+            self.remote_nodes.setdefault(group, {})[node] = time.monotonic()
+            if self.local.groups.get(group):
+                await self.inner.send(node, {'type': _HERE, 'group': group, 'node': self.node_channel})
+        elif kind == _HERE:
+            self.remote_nodes.setdefault(group, {})[node] = time.monotonic()
+        elif kind == _LEAVE:
+            self.remote_nodes.get(group, {}).pop(node, None)
+
+    # --- Housekeeping ---
+
+    async def flush(self):
+        await self.close()
+        await self.local.flush()
+        self.remote_nodes.clear()
+        self._grace_until.clear()
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
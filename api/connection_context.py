@@ -0,0 +1,130 @@
+# In api/connection_context.py
+"""
+Per-connection context of the booking sockets.
+
+A consumer loads a ConnectionContext once when the socket connects: who is
+connected (from the user the socket middleware built from the token) and the
+booking's participants, status and location, in a single query. Messages are
+then authorized and labelled from it without touching the database. The
+multiplexed socket (StreamConsumer) loads one per booking it subscribes to,
+in a batch (load_contexts).
+
+The context never changes in place. When a booking changes state,
+publish_status() sends a 'context.refresh' event to the booking's socket
+groups and each consumer swaps in an updated copy.
+"""
+import logging
+import uuid
+from typing import NamedTuple, Optional, Tuple
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from .heatmap import OPEN_STATUSES
+from .models import Booking
+
+logger = logging.getLogger(__name__)
+
+
+def booking_groups(booking_id):
+    """
+    The channel layer groups of a booking's chat and location sockets.
+    """
+    return f'chat_{booking_id}', f'location_{booking_id}'
+
+
+class ConnectionContext(NamedTuple):
+    user_id: int
+    username: str
+    role: str
+    booking_id: str
+    customer_id: int
+    provider_id: Optional[int]
+    status: str
+    # Where the booking was placed, the destination of the ETA
+    destination: Tuple[float, float]
+
+    @property
+    def is_open(self):
+        # Location pings are only relayed for open bookings
+        return self.status in OPEN_STATUSES
+
+    def refreshed(self, event):
+        """
+        A copy updated from a 'context.refresh' event.
+        """
+        return self._replace(status=event['status'])
+
+
+async def load_context(user, booking_id):
+    """
+    The context of `user` on a booking, None when the booking does not exist
+    or the user is neither its customer nor its provider.
+    """
+    if user.pk is None:
+        return None
+    try:
+        row = await Booking.objects.filter(pk=booking_id).values_list(
+            'customer_id', 'provider_id', 'status', 'booking_latitude', 'booking_longitude'
+        ).afirst()
+    except ValidationError:
+        # Malformed UUID
+        return None
+    if row is None:
+        return None
+    customer_id, provider_id, status, latitude, longitude = row
+    # Compared by id, so neither participant is loaded
+    if user.pk not in (customer_id, provider_id):
+        return None
+    return ConnectionContext(
+        user.pk, user.username, user.user_type, str(booking_id), customer_id, provider_id, status,
+        (latitude, longitude),
+    )
+
+
+async def load_contexts(user, booking_ids):
+    """
+    Batch variant of load_context for the multiplexed socket: the contexts of
+    `user` on the bookings it may follow, keyed by booking id, in one query.
+    Admins may follow any booking. Malformed and unknown ids, and other users'
+    bookings, are left out.
+    """
+    ids = set()
+    for booking_id in booking_ids:
+        try:
+            ids.add(uuid.UUID(str(booking_id)))
+        except ValueError:
+            continue
+    if user.pk is None or not ids:
+        return {}
+    bookings = Booking.objects.filter(pk__in=ids)
+    if user.user_type != 'ADMIN':
+        bookings = bookings.filter(Q(customer_id=user.pk) | Q(provider_id=user.pk))
+    return {
+        str(booking_id): ConnectionContext(
+            user.pk, user.username, user.user_type, str(booking_id), customer_id, provider_id, status,
+            (latitude, longitude),
+        )
+        async for booking_id, customer_id, provider_id, status, latitude, longitude in bookings.values_list(
+            'id', 'customer_id', 'provider_id', 'status', 'booking_latitude', 'booking_longitude'
+        )
+    }
+
+
+def publish_status(booking_id, status):
+    """
+    Push a booking's new status to the consumers connected to it. Called after
+    the change is committed; a channel layer failure is logged, the change
+    itself stands.
+    """
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    event = {'type': 'context.refresh', 'booking_id': str(booking_id), 'status': status}
+    try:
+        for group in booking_groups(booking_id):
+            async_to_sync(layer.group_send)(group, event)
+    except Exception:
+        logger.exception('socket.context_refresh_failed', extra={'event_fields': {'booking_id': str(booking_id)}})
@@ -1,28 +1,57 @@
 # In api/consumers.py
-import json
+import logging
+import uuid
+
 from channels.generic.websocket import AsyncWebsocketConsumer 
 from asgiref.sync import sync_to_async 
-from .models import Booking, ChatMessage, User
+from .models import ChatMessage
+from . import fastjson, metrics
+from .backpressure import BoundedSendMixin, DISCONNECT, DROP_OLDEST
+from .location_codec import BINARY_SUBPROTOCOL, LocationEncoder, LocationDecoder
+from .connection_context import booking_groups, load_context, load_contexts
+from .eta import CoalescedEta
+from .logs import log_event
+
+logger = logging.getLogger(__name__)
+
+class ContextMixin:
+    """
+    Keeps the connection's ConnectionContext (api/connection_context.py),
+    loaded at connect and swapped on 'context.refresh' events, so messages are
+    handled without touching the database.
+    """
+    context = None
+
+    async def context_refresh(self, event):
+        if self.context is not None:
+            self.context = self.context.refreshed(event)
+
+
+class ChatConsumer(ContextMixin, BoundedSendMixin, AsyncWebsocketConsumer):
+    # A chat client that falls this far behind is disconnected and reloads the history
+    outbound_maxsize = 64
+    outbound_policy = DISCONNECT
 
-class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         # Get booking_id from the URL route
         self.booking_id = self.scope['url_route']['kwargs']['booking_id']
-        self.booking_group_name = f'chat_{self.booking_id}'
-        self.user = self.scope['user']
+        self.booking_group_name, _ = booking_groups(self.booking_id)
 
         # Authorization: Check if the user is part of the booking
-        if await self.is_user_part_of_booking():
+        self.context = await load_context(self.scope['user'], self.booking_id)
+        if self.context is not None:
             # Join room group
             await self.channel_layer.group_add(
                 self.booking_group_name,
                 self.channel_name
             )
-            await self.accept()
+            await self.accept(subprotocol=self.scope.get('auth_subprotocol'))
+            self.start_outbound()
         else:
             await self.close()
 
     async def disconnect(self, close_code):
+        await self.stop_outbound()
         # Leave room group
         await self.channel_layer.group_discard(
             self.booking_group_name,
@@ -31,67 +60,73 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     # Receive message from WebSocket
     async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+        text_data_json = fastjson.loads(text_data)
         message_text = text_data_json['message']
 
         # Save the message to the database
-        new_message = await self.create_chat_message(message_text)
+        new_message = await ChatMessage.objects.acreate(
+            booking_id=self.booking_id, sender_id=self.context.user_id, message=message_text,
+        )
+        log_event(logger, 'chat.message', booking_id=self.booking_id, sender_id=self.context.user_id, message_id=new_message.id)
 
         # Send message to room group
-        await self.channel_layer.group_send(
+        await metrics.group_send(
+            self,
             self.booking_group_name,
             {
                 'type': 'chat_message', # This will call the chat_message method
+                'booking_id': self.booking_id,
                 'message': new_message.message,
-                'sender': new_message.sender.username,
+                'sender': self.context.username,
                 'timestamp': new_message.timestamp.isoformat()
             }
         )
 
-    # Receive message from room group and send to client's WebSocket
+    # Receive message from room group and queue it for the client's WebSocket
     async def chat_message(self, event):
+        await self.enqueue(event)
+
+    async def send_outbound(self, event):
         # Send message to WebSocket
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=fastjson.dumps_str({
             'message': event['message'],
             'sender': event['sender'],
             'timestamp': event['timestamp']
         }))
+
         
-    # --- Helper methods that touch the database ---
-    @sync_to_async
-    def is_user_part_of_booking(self):
-        try:
-            booking = Booking.objects.get(pk=self.booking_id)
-            return self.user == booking.customer or self.user == booking.provider
-        except Booking.DoesNotExist:
-            return False
-
-    @sync_to_async
-    def create_chat_message(self, message):
-        return ChatMessage.objects.create(
-            booking_id=self.booking_id,
-            sender=self.user,
-            message=message
-        )
-        
-class LocationConsumer(AsyncWebsocketConsumer):
+class LocationConsumer(ContextMixin, BoundedSendMixin, AsyncWebsocketConsumer):
+    # Only the latest fix is worth sending to a client on a slow link
+    outbound_maxsize = 1
+    outbound_policy = DROP_OLDEST
+
     async def connect(self):
         self.booking_id = self.scope['url_route']['kwargs']['booking_id']
-        self.booking_group_name = f'location_{self.booking_id}'
-        self.user = self.scope['user']
+        _, self.booking_group_name = booking_groups(self.booking_id)
+
+        # Clients offering the binary subprotocol get compact frames (see api/location_codec.py)
+        self.binary = BINARY_SUBPROTOCOL in (self.scope.get('subprotocols') or [])
+        self.encoder = LocationEncoder()
+        self.decoder = LocationDecoder()
 
         # Authorization: Only the customer and provider of a booking can connect
-        if await self.is_user_part_of_booking():
+        self.context = await load_context(self.scope['user'], self.booking_id)
+        if self.context is not None:
+            # Pings refresh the booking's ETA, coalesced (see api/eta.py), to
+            # where the booking was placed
+            self.eta = CoalescedEta(self.booking_id, self.context.destination)
             # Join the location-specific group
             await self.channel_layer.group_add(
                 self.booking_group_name,
                 self.channel_name
             )
-            await self.accept()
+            await self.accept(subprotocol=BINARY_SUBPROTOCOL if self.binary else self.scope.get('auth_subprotocol'))
+            self.start_outbound()
         else:
             await self.close()
 
     async def disconnect(self, close_code):
+        await self.stop_outbound()
         # Leave room group
         await self.channel_layer.group_discard(
             self.booking_group_name,
@@ -99,43 +134,255 @@ class LocationConsumer(AsyncWebsocketConsumer):
         )
 
     # Receive location update from WebSocket (sent by the provider)
-    async def receive(self, text_data):
-        # Only providers should be sending their location
-        if self.user.user_type != 'PROVIDER':
-            return # Ignore messages from non-providers
-        
-        text_data_json = json.loads(text_data)
-        latitude = text_data_json.get('latitude')
-        longitude = text_data_json.get('longitude')
+    async def receive(self, text_data=None, bytes_data=None):
+        # Only providers should be sending their location, while the booking is open
+        if self.context.role != 'PROVIDER' or not self.context.is_open:
+            return # Ignore pings from customers and for finished bookings
         
-        if latitude is None or longitude is None:
-            return # Ignore malformed data
+        if bytes_data is not None:
+            decoded = self.decoder.decode(bytes_data)
+            if decoded is None:
+                return # Ignore malformed frames
+            _, latitude, longitude = decoded
+        else:
+            text_data_json = fastjson.loads(text_data)
+            try:
+                latitude = float(text_data_json['latitude'])
+                longitude = float(text_data_json['longitude'])
+            except (KeyError, TypeError, ValueError):
+                return # Ignore malformed data
             
+        if self.eta.due(latitude, longitude):
+            await sync_to_async(self.eta.refresh)(latitude, longitude)
+
+        log_event(logger, 'location.ping', booking_id=self.booking_id, provider_id=self.context.user_id, source='socket')
+
         # Broadcast the location data to the group (to the customer)
-        await self.channel_layer.group_send(
+        await metrics.group_send(
+            self,
             self.booking_group_name,
             {
                 'type': 'location_update', # Calls the location_update method
+                'booking_id': self.booking_id,
                 'latitude': latitude,
                 'longitude': longitude,
+                'eta_seconds': self.eta.current['eta_seconds'],
             }
         )
         
-    # Receive location from room group and forward it to the client's WebSocket
+    # Receive location from room group and queue it for the client's WebSocket
     async def location_update(self, event):
         # This message will be sent to the customer
-        if self.user.user_type == 'CUSTOMER':
-            await self.send(text_data=json.dumps({
+        if self.context.role == 'CUSTOMER':
+            await self.enqueue(event)
+
+    async def send_outbound(self, event):
+        # Encoded at send time, so binary deltas stay relative to what the client received
+        if self.binary:
+            await self.send(bytes_data=self.encoder.encode(event['latitude'], event['longitude']))
+        else:
+            await self.send(text_data=fastjson.dumps_str({
                 'latitude': event['latitude'],
                 'longitude': event['longitude'],
+                'eta_seconds': event.get('eta_seconds'),
             }))
 
-    # --- Helper Method ---
-    # We can reuse the same authorization logic from the ChatConsumer
-    @sync_to_async
-    def is_user_part_of_booking(self):
+
+def canonical_id(booking_id):
+    """
+    A booking id as the groups and contexts key it; malformed ids are kept
+    as sent, and later denied.
+    """
+    try:
+        return str(uuid.UUID(str(booking_id)))
+    except ValueError:
+        return str(booking_id)
+
+
+class StreamConsumer(BoundedSendMixin, AsyncWebsocketConsumer):
+    """
+    One socket per user carrying the chat and location streams of many
+    bookings (ws/stream/), instead of a chat and a location socket per booking.
+
+    Client frames (JSON):
+    - {"action": "subscribe" | "unsubscribe", "stream": "chat" | "location", "bookings": [ids]}
+      Membership of all the bookings is checked in one query; the reply lists
+      the bookings subscribed and the ones denied. Admins may watch any booking.
+    - {"action": "chat", "booking": id, "message": text}, on a chat subscription
+    - {"action": "location", "latitude": lat, "longitude": lon}, from a
+      provider: relayed to every open booking it is subscribed to and assigned
+    Server frames carry a "type" ("subscribed", "unsubscribed", "chat",
+    "location", "status" when a booking changed state, or "error") and the
+    "booking" they are about.
+
+    Chat messages are never dropped (a client too far behind is disconnected);
+    location fixes are coalesced so only the latest per booking is queued.
+    The binary location codec is only offered on ws/location/.
+    """
+    STREAMS = ('chat', 'location')
+    # Bookings a connection may follow per stream
+    MAX_SUBSCRIPTIONS = 100
+    outbound_maxsize = 256
+    outbound_policy = DISCONNECT
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if self.user.pk is None:
+            await self.close()
+            return
+        # booking id -> ConnectionContext, for every booking followed on any stream
+        self.contexts = {}
+        self.subscriptions = {stream: set() for stream in self.STREAMS}
+        # booking id -> CoalescedEta, for the bookings the provider pings for
+        self.etas = {}
+        # booking id -> latest location event not sent yet
+        self.pending_locations = {}
+        await self.accept(subprotocol=self.scope.get('auth_subprotocol'))
+        self.start_outbound()
+
+    async def disconnect(self, close_code):
+        await self.stop_outbound()
+        for stream, bookings in getattr(self, 'subscriptions', {}).items():
+            for booking_id in bookings:
+                await self.channel_layer.group_discard(self.group(stream, booking_id), self.channel_name)
+
+    @staticmethod
+    def group(stream, booking_id):
+        chat_group, location_group = booking_groups(booking_id)
+        return chat_group if stream == 'chat' else location_group
+
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            booking = Booking.objects.get(pk=self.booking_id)
-            return self.user == booking.customer or self.user == booking.provider
-        except Booking.DoesNotExist:
-            return False
\ No newline at end of file
+            frame = fastjson.loads(text_data or bytes_data)
+            action = frame['action']
+        except (TypeError, ValueError, KeyError):
+            return await self.reply({'type': 'error', 'error': 'Malformed frame.'})
+        if action in ('subscribe', 'unsubscribe'):
+            stream, bookings = frame.get('stream'), frame.get('bookings')
+            if stream not in self.STREAMS or not isinstance(bookings, list):
+                return await self.reply({'type': 'error', 'error': 'Expected a stream and a list of bookings.'})
+            handler = self.subscribe if action == 'subscribe' else self.unsubscribe
+            return await handler(stream, [canonical_id(booking_id) for booking_id in bookings])
+        if action == 'chat':
+            return await self.send_chat(canonical_id(frame.get('booking')), frame.get('message'))
+        if action == 'location':
+            return await self.send_location(frame)
+        await self.reply({'type': 'error', 'error': f'Unknown action {action!r}.'})
+
+    async def reply(self, frame):
+        await self.enqueue(frame)
+
+    # --- Subscriptions ---
+
+    async def subscribe(self, stream, bookings):
+        followed = self.subscriptions[stream]
+        requested = [booking_id for booking_id in dict.fromkeys(bookings) if booking_id not in followed]
+        if len(followed) + len(requested) > self.MAX_SUBSCRIPTIONS:
+            return await self.reply({
+                'type': 'error', 'stream': stream,
+                'error': f'At most {self.MAX_SUBSCRIPTIONS} bookings per stream.',
+            })
+        # Bookings already followed on the other stream reuse their context
+        missing = [booking_id for booking_id in requested if booking_id not in self.contexts]
+        self.contexts.update(await load_contexts(self.user, missing))
+
+        subscribed = [booking_id for booking_id in requested if booking_id in self.contexts]
+        for booking_id in subscribed:
+            await self.channel_layer.group_add(self.group(stream, booking_id), self.channel_name)
+            followed.add(booking_id)
+        await self.reply({
+            'type': 'subscribed', 'stream': stream, 'bookings': sorted(followed),
+            'denied': [booking_id for booking_id in requested if booking_id not in self.contexts],
+        })
+
+    async def unsubscribe(self, stream, bookings):
+        followed = self.subscriptions[stream]
+        for booking_id in bookings:
+            if booking_id not in followed:
+                continue
+            followed.discard(booking_id)
+            await self.channel_layer.group_discard(self.group(stream, booking_id), self.channel_name)
+            if not any(booking_id in other for other in self.subscriptions.values()):
+                self.contexts.pop(booking_id, None)
+                self.etas.pop(booking_id, None)
+        await self.reply({'type': 'unsubscribed', 'stream': stream, 'bookings': sorted(followed)})
+
+    # --- From the client ---
+
+    async def send_chat(self, booking_id, message):
+        context = self.contexts.get(booking_id)
+        if booking_id not in self.subscriptions['chat'] or context.user_id not in (context.customer_id, context.provider_id):
+            return await self.reply({'type': 'error', 'booking': booking_id, 'error': 'Not subscribed to this chat.'})
+        if not isinstance(message, str) or not message:
+            return await self.reply({'type': 'error', 'booking': booking_id, 'error': 'Expected a message.'})
+
+        new_message = await ChatMessage.objects.acreate(booking_id=booking_id, sender_id=context.user_id, message=message)
+        log_event(logger, 'chat.message', booking_id=booking_id, sender_id=context.user_id, message_id=new_message.id)
+        await metrics.group_send(self, self.group('chat', booking_id), {
+            'type': 'chat_message',
+            'booking_id': booking_id,
+            'message': new_message.message,
+            'sender': context.username,
+            'timestamp': new_message.timestamp.isoformat(),
+        })
+
+    async def send_location(self, frame):
+        try:
+            latitude = float(frame['latitude'])
+            longitude = float(frame['longitude'])
+        except (KeyError, TypeError, ValueError):
+            return # Ignore malformed data, like ws/location/
+        for booking_id in self.subscriptions['location']:
+            context = self.contexts[booking_id]
+            # Only to the bookings this provider is assigned to, while they are open
+            if context.provider_id != context.user_id or not context.is_open:
+                continue
+            eta = self.etas.get(booking_id)
+            if eta is None:
+                eta = self.etas[booking_id] = CoalescedEta(booking_id, context.destination)
+            if eta.due(latitude, longitude):
+                await sync_to_async(eta.refresh)(latitude, longitude)
+            log_event(logger, 'location.ping', booking_id=booking_id, provider_id=context.user_id, source='stream')
+            await metrics.group_send(self, self.group('location', booking_id), {
+                'type': 'location_update',
+                'booking_id': booking_id,
+                'latitude': latitude,
+                'longitude': longitude,
+                'eta_seconds': eta.current['eta_seconds'],
+            })
+
+    # --- From the groups ---
+
+    async def chat_message(self, event):
+        await self.enqueue({
+            'type': 'chat', 'booking': event['booking_id'], 'message': event['message'],
+            'sender': event['sender'], 'timestamp': event['timestamp'],
+        })
+
+    async def location_update(self, event):
+        booking_id = event['booking_id']
+        context = self.contexts.get(booking_id)
+        # The provider does not get its own fixes back
+        if context is None or context.user_id == context.provider_id:
+            return
+        if booking_id not in self.pending_locations:
+            # Queued once; a newer fix replaces the pending one
+            await self.enqueue({'type': 'location', 'booking': booking_id})
+        self.pending_locations[booking_id] = event
+
+    async def context_refresh(self, event):
+        booking_id = event['booking_id']
+        context = self.contexts.get(booking_id)
+        # Sent to both groups of the booking, forwarded once
+        if context is None or context.status == event['status']:
+            return
+        self.contexts[booking_id] = context.refreshed(event)
+        await self.enqueue({'type': 'status', 'booking': booking_id, 'status': event['status']})
+
+    async def send_outbound(self, frame):
+        if frame['type'] == 'location':
+            event = self.pending_locations.pop(frame['booking'], None)
+            if event is None:
+                return
+            frame = dict(frame, latitude=event['latitude'], longitude=event['longitude'], eta_seconds=event.get('eta_seconds'))
+        await self.send(text_data=fastjson.dumps_str(frame))
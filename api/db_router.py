@@ -0,0 +1,130 @@
+# In api/db_router.py
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from rest_framework import permissions
+
+REPLICA_DB = 'replica'
+PRIMARY_PIN_KEY = 'primary_pin:{}'
+
+# Set for the duration of a view opted in with @read_from_replica
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads to the 'replica' database only inside views opted in with
+    @read_from_replica, everything else (and every write) goes to 'default'.
+
+    To try it locally with two SQLite files, set DB_REPLICA_NAME, run
+    `python manage.py migrate --database replica` and copy db.sqlite3 over the
+    replica file whenever it should "catch up".
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and REPLICA_DB in connections.databases:
+            return REPLICA_DB
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return True
+
+
+def pin_to_primary(user_id):
+    """
+    Read-your-writes: keep a user's reads on the primary for a short window after
+    one of their own writes, while the replica catches up.
+    """
+    cache.set(PRIMARY_PIN_KEY.format(user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+
+async def apin_to_primary(user_id):
+    await cache.aset(PRIMARY_PIN_KEY.format(user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned_to_primary(user):
+    if not user or not user.is_authenticated:
+        return False
+    return cache.get(PRIMARY_PIN_KEY.format(user.pk), False)
+
+
+async def ais_pinned_to_primary(user):
+    if not user or not user.is_authenticated:
+        return False
+    return await cache.aget(PRIMARY_PIN_KEY.format(user.pk), False)
+
+
+class PrimaryPinMiddleware:
+    """
+    Pins the user to the primary after every successful unsafe request.
+    DRF copies the authenticated user to the Django request, so it is available
+    here (the async views in api/async_views.py do the same).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        user_id = self._written_by(request, response)
+        if user_id is not None:
+            pin_to_primary(user_id)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        user_id = self._written_by(request, response)
+        if user_id is not None:
+            await apin_to_primary(user_id)
+        return response
+
+    @staticmethod
+    def _written_by(request, response):
+        if request.method not in permissions.SAFE_METHODS and response.status_code < 400:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                return user.pk
+        return None
+
+
+def read_from_replica(view_class):
+    """
+    Class decorator for DRF views: safe requests read from the replica, unless the
+    user is pinned to the primary after a recent write.
+    """
+    initial = view_class.initial
+    finalize_response = view_class.finalize_response
+
+    def _initial(self, request, *args, **kwargs):
+        # Runs after authentication, so request.user is known
+        initial(self, request, *args, **kwargs)
+        if request.method in permissions.SAFE_METHODS and not is_pinned_to_primary(request.user):
+            self._replica_token = _replica_reads.set(True)
+
+    def _finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            _replica_reads.reset(token)
+            self._replica_token = None
+        return finalize_response(self, request, response, *args, **kwargs)
+
+    view_class.initial = _initial
+    view_class.finalize_response = _finalize_response
+    return view_class
@@ -0,0 +1,272 @@
+# In api/eta.py
+"""
+ETA estimation for matching and for the live booking status.
+
+The travel-time model is chosen with settings.ETA_MODEL:
+
+- 'haversine' (default): straight-line distance times a detour factor, at a
+  constant speed.
+- 'road_graph': shortest travel time over a road graph loaded from the JSON
+  file at settings.ETA_GRAPH_PATH:
+
+      {"nodes": {"<id>": [lat, lon], ...},
+       "edges": [["<from>", "<to>", seconds], ["<from>", "<to>", seconds, true], ...]}
+
+  Edges are two-way unless the 4th element (oneway) is true. One Dijkstra run
+  from the destination answers a whole batch of origins. The file is checked
+  when it is loaded, an invalid graph raises ValueError.
+
+Every model implements estimate(origins, destination) -> [Estimate, ...].
+
+The current ETA of each active booking is kept in the default cache, where the
+socket that computed it and the REST endpoints read it: it is only shared by
+every process with a shared cache (CACHE_URL), with the per-process default a
+request may miss the ETA computed by another worker.
+"""
+import heapq
+import json
+import math
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .utils import haversine
+
+# Current ETA of an active booking, see store_booking_eta
+BOOKING_ETA_KEY = 'booking_eta:{}'
+BOOKING_ETA_TIMEOUT = 60 * 60
+
+class Estimate(NamedTuple):
+    distance_km: float
+    seconds: float
+
+
+def _distances_km(origins, destination):
+    """
+    Straight-line distances from each (lat, lon) origin to the destination.
+    """
+    return [haversine(lat, lon, destination[0], destination[1]) for lat, lon in origins]
+
+
+class HaversineSpeedModel:
+    """
+    Straight-line distance times a detour factor, at a constant speed.
+    """
+    name = 'haversine'
+
+    def __init__(self, speed_kmh=30.0, detour_factor=1.3):
+        self.speed_kmh = speed_kmh
+        self.detour_factor = detour_factor
+
+    def estimate(self, origins, destination):
+        seconds_per_km = self.detour_factor * 3600.0 / self.speed_kmh
+        return [Estimate(distance, distance * seconds_per_km) for distance in _distances_km(origins, destination)]
+
+
+class RoadGraphModel:
+    """
+    Shortest travel time over a road graph. Points are snapped to their nearest
+    node and the legs to and from the graph are covered at access_speed_kmh.
+    Origins the graph cannot connect fall back to the haversine model.
+    """
+    name = 'road_graph'
+
+    # Size in degrees of the grid used to find the nearest node (~1 km), and
+    # how many rings of it are searched before scanning every node
+    GRID = 0.01
+    MAX_RINGS = 20
+
+    def __init__(self, path, access_speed_kmh=15.0, fallback=None):
+        with open(path) as graph_file:
+            graph = json.load(graph_file)
+        try:
+            self.nodes = {str(node): (float(lat), float(lon)) for node, (lat, lon) in graph['nodes'].items()}
+        except (KeyError, TypeError, ValueError) as exc:
+            raise ValueError(f'{path}: "nodes" must map node ids to [lat, lon] ({exc})') from None
+        # Reversed adjacency: travel times *towards* each node
+        self.incoming = {node: [] for node in self.nodes}
+        for index, edge in enumerate(graph.get('edges', ())):
+            source, target, seconds = self._check_edge(path, index, edge)
+            oneway = len(edge) > 3 and edge[3]
+            self.incoming[target].append((source, seconds))
+            if not oneway:
+                self.incoming[source].append((target, seconds))
+        self.grid = {}
+        for node, (lat, lon) in self.nodes.items():
+            self.grid.setdefault(self._grid_key(lat, lon), []).append(node)
+        self.access_seconds_per_km = 3600.0 / access_speed_kmh
+        self.fallback = fallback or HaversineSpeedModel()
+
+    def _check_edge(self, path, index, edge):
+        """
+        (source, target, seconds) of an edge of the graph file, ValueError when
+        it is malformed or names a node the file does not define.
+        """
+        if not isinstance(edge, list) or len(edge) not in (3, 4):
+            raise ValueError(f'{path}: edge {index} must be [from, to, seconds] or [from, to, seconds, oneway]')
+        source, target = str(edge[0]), str(edge[1])
+        for node in (source, target):
+            if node not in self.nodes:
+                raise ValueError(f'{path}: edge {index} references unknown node {node!r}')
+        try:
+            seconds = float(edge[2])
+        except (TypeError, ValueError):
+            seconds = math.nan
+        # Dijkstra needs non-negative weights
+        if not seconds >= 0 or math.isinf(seconds):
+            raise ValueError(f'{path}: edge {index} has an invalid travel time {edge[2]!r}')
+        return source, target, seconds
+
+    def _grid_key(self, lat, lon):
+        return math.floor(lat / self.GRID), math.floor(lon / self.GRID)
+
+    def snap(self, lat, lon):
+        """
+        Return (node, distance_km) of the node (approximately) nearest to a point:
+        grid cells are searched ring by ring, plus one ring after the first hit.
+        Points far from every node fall back to a scan of all nodes.
+        """
+        if not self.nodes:
+            return None, math.inf
+        row, col = self._grid_key(lat, lon)
+        best, best_distance = None, math.inf
+        found_at = None
+        for ring in range(self.MAX_RINGS + 1):
+            for r, c in self._ring_cells(row, col, ring):
+                for node in self.grid.get((r, c), ()):
+                    distance = haversine(lat, lon, *self.nodes[node])
+                    if distance < best_distance:
+                        best, best_distance = node, distance
+            if best is not None and found_at is None:
+                found_at = ring
+            if found_at is not None and ring > found_at:
+                return best, best_distance
+        if best is None:
+            for node, (node_lat, node_lon) in self.nodes.items():
+                distance = haversine(lat, lon, node_lat, node_lon)
+                if distance < best_distance:
+                    best, best_distance = node, distance
+        return best, best_distance
+
+    @staticmethod
+    def _ring_cells(row, col, ring):
+        if ring == 0:
+            yield row, col
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield row - ring, c
+            yield row + ring, c
+        for r in range(row - ring + 1, row + ring):
+            yield r, col - ring
+            yield r, col + ring
+
+    def _travel_times_to(self, target, sources):
+        """
+        Dijkstra over the reversed graph from `target`, stopping once every
+        source node is settled.
+        """
+        remaining = set(sources)
+        times = {target: 0.0}
+        heap = [(0.0, target)]
+        settled = set()
+        while heap and remaining:
+            elapsed, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            remaining.discard(node)
+            for neighbor, seconds in self.incoming[node]:
+                candidate = elapsed + seconds
+                if candidate < times.get(neighbor, math.inf):
+                    times[neighbor] = candidate
+                    heapq.heappush(heap, (candidate, neighbor))
+        return {node: times[node] for node in settled}
+
+    def estimate(self, origins, destination):
+        target, target_access = self.snap(*destination)
+        snapped = [self.snap(lat, lon) for lat, lon in origins]
+        times = self._travel_times_to(target, {node for node, _ in snapped if node is not None}) if target else {}
+        straight = _distances_km(origins, destination)
+        estimates = []
+        for index, (node, access) in enumerate(snapped):
+            if node in times:
+                seconds = times[node] + (access + target_access) * self.access_seconds_per_km
+                estimates.append(Estimate(straight[index], seconds))
+            else:
+                estimates.append(self.fallback.estimate([origins[index]], destination)[0])
+        return estimates
+
+
+_model = None
+_model_key = None
+
+
+def get_model():
+    """
+    The configured travel-time model, built once per process (graphs can be large).
+    """
+    global _model, _model_key
+    key = (settings.ETA_MODEL, settings.ETA_GRAPH_PATH, settings.ETA_SPEED_KMH, settings.ETA_DETOUR_FACTOR)
+    if _model is None or _model_key != key:
+        fallback = HaversineSpeedModel(settings.ETA_SPEED_KMH, settings.ETA_DETOUR_FACTOR)
+        if settings.ETA_MODEL == 'road_graph':
+            _model = RoadGraphModel(settings.ETA_GRAPH_PATH, fallback=fallback)
+        else:
+            _model = fallback
+        _model_key = key
+    return _model
+
+
+# --- Per-booking ETA ---
+
+def store_booking_eta(booking_id, provider_location, estimate):
+    data = {
+        'eta_seconds': round(estimate.seconds),
+        'distance_km': round(estimate.distance_km, 3),
+        'provider_latitude': provider_location[0],
+        'provider_longitude': provider_location[1],
+        'computed_at': time.time(),
+        'model': get_model().name,
+    }
+    cache.set(BOOKING_ETA_KEY.format(booking_id), data, BOOKING_ETA_TIMEOUT)
+    return data
+
+
+def get_booking_eta(booking_id):
+    return cache.get(BOOKING_ETA_KEY.format(booking_id))
+
+
+def refresh_booking_eta(booking_id, provider_location, destination):
+    estimate = get_model().estimate([provider_location], destination)[0]
+    return store_booking_eta(booking_id, provider_location, estimate)
+
+
+class CoalescedEta:
+    """
+    Per-connection ETA refresher for a booking: location pings only trigger a
+    recomputation every ETA_REFRESH_SECONDS, or sooner once the provider moved
+    more than ETA_REFRESH_METERS since the last one.
+    """
+
+    def __init__(self, booking_id, destination):
+        self.booking_id = booking_id
+        self.destination = destination
+        self.current = None
+        self._refreshed_at = None
+        self._refreshed_from = None
+
+    def due(self, latitude, longitude):
+        if self._refreshed_at is None:
+            return True
+        if time.monotonic() - self._refreshed_at >= settings.ETA_REFRESH_SECONDS:
+            return True
+        moved_km = haversine(latitude, longitude, *self._refreshed_from)
+        return moved_km * 1000 >= settings.ETA_REFRESH_METERS
+
+    def refresh(self, latitude, longitude):
+        self.current = refresh_booking_eta(self.booking_id, (latitude, longitude), self.destination)
+        self._refreshed_at = time.monotonic()
+        self._refreshed_from = (latitude, longitude)
+        return self.current
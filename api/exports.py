@@ -0,0 +1,190 @@
+# In api/exports.py
+"""
+Streaming CSV / NDJSON exports for admins.
+
+Rows are read with values_list() and iterator(chunk_size=...), so PostgreSQL
+uses a server-side cursor and only one chunk of plain tuples is in memory at a
+time; the response is generated while the client downloads it.
+
+The streamers are async generators, fetching one chunk at a time in a thread
+(see rows()): under ASGI, Django drains a sync iterator into a list before
+sending anything, which would hold the whole export in memory and delay the
+first byte until the last row was read.
+"""
+import csv
+from decimal import Decimal
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.db.models import BooleanField
+
+from . import fastjson
+from .models import Booking, Payment, User
+
+CHUNK_SIZE = 2000
+# Rows encoded per chunk written to the socket
+ROWS_PER_WRITE = 500
+
+EXPORTS = {
+    'bookings': {
+        'model': Booking,
+        'fields': [
+            ('id', 'id'),
+            ('status', 'status'),
+            ('customer', 'customer__username'),
+            ('provider', 'provider__username'),
+            ('service', 'service__name'),
+            ('final_price', 'final_price'),
+            ('latitude', 'booking_latitude'),
+            ('longitude', 'booking_longitude'),
+            ('created_at', 'created_at'),
+            ('accepted_at', 'accepted_at'),
+            ('completed_at', 'completed_at'),
+        ],
+        'date_field': 'created_at',
+        'filters': {'status': 'status', 'service': 'service_id'},
+    },
+    'payments': {
+        'model': Payment,
+        'fields': [
+            ('id', 'id'),
+            ('booking', 'booking_id'),
+            ('amount', 'amount'),
+            ('payment_method', 'payment_method'),
+            ('status', 'status'),
+            ('external_transaction_id', 'external_transaction_id'),
+            ('created_at', 'created_at'),
+            ('updated_at', 'updated_at'),
+        ],
+        'date_field': 'created_at',
+        'filters': {'status': 'status', 'payment_method': 'payment_method'},
+    },
+    'users': {
+        'model': User,
+        'fields': [
+            ('id', 'id'),
+            ('username', 'username'),
+            ('email', 'email'),
+            ('first_name', 'first_name'),
+            ('last_name', 'last_name'),
+            ('phone_number', 'phone_number'),
+            ('user_type', 'user_type'),
+            ('is_active', 'is_active'),
+            ('date_joined', 'date_joined'),
+        ],
+        'date_field': 'date_joined',
+        'filters': {'user_type': 'user_type', 'is_active': 'is_active'},
+    },
+}
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def export_queryset(dataset, start=None, end=None, filters=None, using='default'):
+    """
+    values_list() queryset for an export, ordered by its date field.
+    `filters` maps the query parameter names of EXPORTS[dataset]['filters'] to
+    values; raises ValueError for a value the field cannot hold.
+    """
+    spec = EXPORTS[dataset]
+    date_field = spec['date_field']
+    queryset = spec['model'].objects.using(using).all()
+    if start:
+        queryset = queryset.filter(**{f'{date_field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{date_field}__lt': end})
+    for param, value in (filters or {}).items():
+        field = spec['filters'][param]
+        queryset = queryset.filter(**{field: filter_value(spec['model'], param, field, value)})
+    return queryset.order_by(date_field, 'pk').values_list(*[column for _, column in spec['fields']])
+
+
+def filter_value(model, param, field, value):
+    """
+    A query parameter converted for `field` of `model`, so a malformed value is
+    rejected here rather than when the export is streamed.
+    """
+    model_field = model._meta.get_field(field)
+    if isinstance(model_field, BooleanField):
+        try:
+            return {'true': True, 'false': False}[value.lower()]
+        except KeyError:
+            raise ValueError(f'{param} must be true or false') from None
+    try:
+        return model_field.to_python(value)
+    except ValidationError:
+        raise ValueError(f'{param} must be a valid {model_field.name}') from None
+
+
+async def rows(queryset):
+    """
+    Async iterator over the rows of `queryset`, fetching CHUNK_SIZE rows at a
+    time in a thread. QuerySet.aiterator() cannot be used: it starts
+    values_list() queries on the event loop.
+    """
+    chunk_size = CHUNK_SIZE
+    iterator = queryset.iterator(chunk_size=chunk_size)
+    fetch = sync_to_async(lambda: list(islice(iterator, chunk_size)))
+    while True:
+        chunk = await fetch()
+        for row in chunk:
+            yield row
+        if len(chunk) < chunk_size:
+            return
+
+
+class _Echo:
+    """
+    File-like object for csv.writer that hands back the line instead of storing it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+async def stream_csv(dataset, queryset):
+    writer = csv.writer(_Echo())
+    # The header goes out before the query runs
+    yield writer.writerow([name for name, _ in EXPORTS[dataset]['fields']]).encode()
+    lines = []
+    async for row in rows(queryset):
+        lines.append(writer.writerow([_csv_value(value) for value in row]))
+        if len(lines) >= ROWS_PER_WRITE:
+            yield ''.join(lines).encode()
+            lines = []
+    if lines:
+        yield ''.join(lines).encode()
+
+
+def _json_value(value):
+    # Money stays a string, like in the API responses
+    return str(value) if isinstance(value, Decimal) else value
+
+
+async def stream_ndjson(dataset, queryset):
+    names = [name for name, _ in EXPORTS[dataset]['fields']]
+    lines = []
+    first = True
+    async for row in rows(queryset):
+        lines.append(fastjson.dumps({name: _json_value(value) for name, value in zip(names, row)}))
+        # Nothing to send ahead of the rows here, so the first one goes out on its own
+        if first or len(lines) >= ROWS_PER_WRITE:
+            first = False
+            yield b'\n'.join(lines) + b'\n'
+            lines = []
+    if lines:
+        yield b'\n'.join(lines) + b'\n'
+
+
+STREAMERS = {
+    'csv': stream_csv,
+    'ndjson': stream_ndjson,
+}
@@ -0,0 +1,52 @@
+# In api/fastjson.py
+"""
+Fast JSON encoding/decoding for the REST API and the websocket consumers.
+
+Uses orjson when it is installed and falls back to the standard library otherwise.
+UUID values are serialized natively. Dates and times (orjson would write UTC
+datetimes with '+00:00' where DRF writes 'Z'), Decimal, lazy translations and
+anything else DRF knows how to encode go through DRF's encoder, so the output
+matches DRF's JSONRenderer.
+"""
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+_encoder = JSONEncoder()
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(obj):
+        """
+        Serialize `obj` to UTF-8 encoded JSON bytes.
+        """
+        return orjson.dumps(obj, default=_encoder.default, option=_OPTIONS)
+
+    def loads(data):
+        return orjson.loads(data)
+
+    JSONDecodeError = orjson.JSONDecodeError
+else:
+    def dumps(obj):
+        """
+        Serialize `obj` to UTF-8 encoded JSON bytes.
+        """
+        return json.dumps(obj, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+    def loads(data):
+        return json.loads(data)
+
+    JSONDecodeError = json.JSONDecodeError
+
+
+def dumps_str(obj):
+    """
+    Serialize `obj` to a JSON string, for websocket text frames.
+    """
+    return dumps(obj).decode()
@@ -0,0 +1,85 @@
+# In api/geohash.py
+"""
+Minimal geohash encoding, used to bucket locations into grid cells.
+
+Precision 5 gives cells of roughly 4.9 km x 4.9 km, precision 6 about 1.2 km x 0.6 km.
+"""
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = {char: index for index, char in enumerate(_BASE32)}
+
+
+def encode(latitude, longitude, precision=5):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                value = (value << 1) | 1
+                lon_range[0] = mid
+            else:
+                value <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                value = (value << 1) | 1
+                lat_range[0] = mid
+            else:
+                value <<= 1
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def bounds(cell):
+    """
+    Return (min_lat, min_lon, max_lat, max_lon) of a cell.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in cell:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lon_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            target[1 - bit] = mid
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def center(cell):
+    min_lat, min_lon, max_lat, max_lon = bounds(cell)
+    return (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+
+
+def neighbors(cell):
+    """
+    The cell itself and its (up to) 8 surrounding cells.
+    """
+    min_lat, min_lon, max_lat, max_lon = bounds(cell)
+    height, width = max_lat - min_lat, max_lon - min_lon
+    lat, lon = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+    cells = []
+    for dlat in (-height, 0, height):
+        for dlon in (-width, 0, width):
+            neighbor_lat = lat + dlat
+            if not -90 <= neighbor_lat <= 90:
+                continue
+            # Wrap around the antimeridian
+            neighbor_lon = (lon + dlon + 180) % 360 - 180
+            neighbor = encode(neighbor_lat, neighbor_lon, len(cell))
+            if neighbor not in cells:
+                cells.append(neighbor)
+    return cells
@@ -0,0 +1,228 @@
+# In api/heatmap.py
+"""
+Incremental supply/demand heatmap over geohash cells (see HeatmapCell).
+
+Supply: verified, on-duty providers with a location, counted in the cell of
+their last known location under the service they offer. The cell a provider is
+counted in is stored on the profile (heatmap_cell), so a location ping that
+stays in the same cell is still a single UPDATE.
+
+Demand: open bookings (pending, accepted or in progress), counted in the cell
+where they were placed.
+
+Providers and bookings without a service share one row per cell, keyed by
+unique_heatmap_cell_no_service.
+"""
+import operator
+from functools import reduce
+from math import sqrt
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from . import geohash
+from .models import Booking, HeatmapCell, Service, ServiceProviderProfile
+from .utils import increment
+
+OPEN_STATUSES = ('PENDING', 'ACCEPTED', 'IN_PROGRESS')
+
+# Marks "the service did not change" for sync_provider
+_UNCHANGED = object()
+
+
+def cell_for(latitude, longitude):
+    return geohash.encode(latitude, longitude, settings.HEATMAP_PRECISION)
+
+
+def _bump(cell, service_id, **deltas):
+    increment(HeatmapCell, {'cell': cell, 'service_id': service_id}, **deltas)
+
+
+# --- Supply ---
+
+def update_provider_location(profile_id, latitude, longitude):
+    """
+    Store a provider's location ping.
+
+    One UPDATE when the provider stays in the cell it is counted in, or is off
+    duty (and so not counted anywhere); otherwise the provider is moved between
+    cells by sync_provider.
+    """
+    cell = cell_for(latitude, longitude)
+    updated = ServiceProviderProfile.objects.filter(
+        Q(heatmap_cell=cell) | Q(on_duty=False), pk=profile_id
+    ).update(last_known_latitude=latitude, last_known_longitude=longitude)
+    if not updated:
+        sync_provider(profile_id, location=(latitude, longitude))
+
+
+async def aupdate_provider_location(profile_id, latitude, longitude):
+    """
+    Async variant of update_provider_location, for the async location view.
+    Only a provider changing cells leaves the event loop.
+    """
+    cell = cell_for(latitude, longitude)
+    updated = await ServiceProviderProfile.objects.filter(
+        Q(heatmap_cell=cell) | Q(on_duty=False), pk=profile_id
+    ).aupdate(last_known_latitude=latitude, last_known_longitude=longitude)
+    if not updated:
+        await sync_to_async(sync_provider)(profile_id, location=(latitude, longitude))
+
+
+def sync_provider(profile_id, location=None, previous_service_id=_UNCHANGED):
+    """
+    Recount a provider after its duty status, location (optionally stored here
+    as well) or service changed. Pass previous_service_id when the service
+    offered changed since the provider was last counted.
+    """
+    with transaction.atomic():
+        row = ServiceProviderProfile.objects.select_for_update().filter(pk=profile_id).values(
+            'on_duty', 'is_verified', 'service_offered_id', 'heatmap_cell',
+            'last_known_latitude', 'last_known_longitude',
+        ).first()
+        if row is None:
+            return
+
+        changes = {}
+        if location is not None:
+            latitude, longitude = location
+            changes['last_known_latitude'], changes['last_known_longitude'] = latitude, longitude
+        else:
+            latitude, longitude = row['last_known_latitude'], row['last_known_longitude']
+
+        counted = row['on_duty'] and row['is_verified'] and latitude is not None and longitude is not None
+        cell = cell_for(latitude, longitude) if counted else ''
+        service_id = row['service_offered_id']
+        old_service_id = service_id if previous_service_id is _UNCHANGED else previous_service_id
+
+        if cell != row['heatmap_cell'] or old_service_id != service_id:
+            if row['heatmap_cell']:
+                _bump(row['heatmap_cell'], old_service_id, providers=-1)
+            if cell:
+                _bump(cell, service_id, providers=1)
+            changes['heatmap_cell'] = cell
+
+        if changes:
+            ServiceProviderProfile.objects.filter(pk=profile_id).update(**changes)
+
+
+def remove_providers(user_ids):
+    """
+    Stop counting the given providers (suspended or deleted), set-based: one
+    read and one UPDATE of the cells they were counted in, however many.
+    """
+    with transaction.atomic():
+        profiles = ServiceProviderProfile.objects.filter(user_id__in=user_ids).exclude(heatmap_cell='')
+        counts = profiles.values('heatmap_cell', 'service_offered_id').annotate(total=Count('pk')).order_by()
+        cells = [
+            (Q(cell=row['heatmap_cell'], service_id=row['service_offered_id']), row['total'])
+            for row in counts
+        ]
+        if cells:
+            # A counted provider's cell always exists, so no row needs creating
+            HeatmapCell.objects.filter(reduce(operator.or_, (match for match, _ in cells))).update(
+                providers=F('providers') - Case(
+                    *(When(match, then=Value(total)) for match, total in cells), default=Value(0)
+                )
+            )
+        profiles.update(heatmap_cell='')
+
+
+# --- Demand ---
+
+def record_booking_created(booking):
+    if booking.status in OPEN_STATUSES:
+        _bump(cell_for(booking.booking_latitude, booking.booking_longitude), booking.service_id, open_bookings=1)
+
+
+def record_transition(booking, from_status, to_status):
+    """
+    Count a booking (a dict with its location and service_id) in or out of the
+    open bookings when a transition crosses that line.
+    """
+    was_open, is_open = from_status in OPEN_STATUSES, to_status in OPEN_STATUSES
+    if was_open != is_open:
+        cell = cell_for(booking['booking_latitude'], booking['booking_longitude'])
+        _bump(cell, booking['service_id'], open_bookings=1 if is_open else -1)
+
+
+# --- Reads ---
+
+def area_totals(latitude, longitude, service_id):
+    """
+    Providers and open bookings for a service in the cell of a location and
+    the 8 cells around it.
+    """
+    totals = HeatmapCell.objects.filter(
+        cell__in=geohash.neighbors(cell_for(latitude, longitude)), service_id=service_id
+    ).aggregate(providers=Sum('providers'), open_bookings=Sum('open_bookings'))
+    return totals['providers'] or 0, totals['open_bookings'] or 0
+
+
+def search_radius_km(latitude, longitude, service_id):
+    """
+    Radius matching should search for a provider around a location: the base
+    MATCH_RADIUS_KM where supply keeps up with demand, widened with the
+    shortage (the searched area grows with demand / supply) up to
+    MATCH_MAX_RADIUS_KM. None when MATCH_RADIUS_KM is unset: no cutoff.
+    """
+    if settings.MATCH_RADIUS_KM is None:
+        return None
+    providers, open_bookings = area_totals(latitude, longitude, service_id)
+    # The booking being matched is not counted yet
+    demand = open_bookings + 1
+    if providers >= demand:
+        return settings.MATCH_RADIUS_KM
+    return min(settings.MATCH_RADIUS_KM * sqrt(demand / max(providers, 1)), settings.MATCH_MAX_RADIUS_KM)
+
+
+@receiver(pre_delete, sender=Service)
+def fold_deleted_service(sender, instance, **kwargs):
+    """
+    Move the cells of a service being deleted to the cells without a service,
+    as its providers and bookings are. Left to SET_NULL they would sit next to
+    those cells, and every later bump would count twice.
+    """
+    cells = HeatmapCell.objects.filter(service_id=instance.pk)
+    for cell, providers, open_bookings in cells.values_list('cell', 'providers', 'open_bookings').iterator():
+        _bump(cell, None, providers=providers, open_bookings=open_bookings)
+    cells.delete()
+
+
+def rebuild():
+    """
+    Recompute every cell (and each provider's heatmap_cell) from the profiles
+    and bookings, in one transaction. Returns the number of cells written.
+    """
+    counts = {}
+    provider_cells = {}
+    with transaction.atomic():
+        profiles = ServiceProviderProfile.objects.select_for_update().filter(
+            on_duty=True, is_verified=True,
+            last_known_latitude__isnull=False, last_known_longitude__isnull=False,
+        ).values_list('pk', 'service_offered_id', 'last_known_latitude', 'last_known_longitude')
+        for pk, service_id, latitude, longitude in profiles.iterator(chunk_size=2000):
+            cell = cell_for(latitude, longitude)
+            counts.setdefault((cell, service_id), [0, 0])[0] += 1
+            provider_cells.setdefault(cell, []).append(pk)
+
+        bookings = Booking.objects.filter(status__in=OPEN_STATUSES).values_list(
+            'service_id', 'booking_latitude', 'booking_longitude'
+        )
+        for service_id, latitude, longitude in bookings.iterator(chunk_size=2000):
+            counts.setdefault((cell_for(latitude, longitude), service_id), [0, 0])[1] += 1
+
+        ServiceProviderProfile.objects.exclude(heatmap_cell='').update(heatmap_cell='')
+        for cell, pks in provider_cells.items():
+            ServiceProviderProfile.objects.filter(pk__in=pks).update(heatmap_cell=cell)
+
+        HeatmapCell.objects.all().delete()
+        HeatmapCell.objects.bulk_create([
+            HeatmapCell(cell=cell, service_id=service_id, providers=providers, open_bookings=open_bookings)
+            for (cell, service_id), (providers, open_bookings) in counts.items()
+        ], batch_size=1000)
+    return len(counts)
@@ -0,0 +1,446 @@
+# In api/loadtest.py
+"""
+In-process load harness for the ASGI application (see the loadtest command).
+
+Simulated providers and customers drive quickassist_project.asgi.application
+directly through asgiref's ApplicationCommunicator, so the whole stack runs
+(middleware, JWT auth, views, consumers, channel layer, database) without a
+server or a network in between. M-Pesa is replaced by StubMpesaServer, a local
+HTTP server that MPESA_BASE_URL points at; its payment callbacks are posted
+back to the application in-process.
+
+Latencies are recorded per route (e.g. 'POST /api/bookings/') and per socket
+route (connect, and the delivery of a message to the other end).
+"""
+import asyncio
+import json
+import queue
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode
+
+from asgiref.testing import ApplicationCommunicator
+
+from . import fastjson
+
+# Seconds to wait for the application before a request counts as timed out
+REQUEST_TIMEOUT = 30
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class LatencyRecorder:
+    """
+    Latencies and errors per route.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.errors = {}
+        self.started = time.monotonic()
+        self.finished = None
+
+    def record(self, route, seconds, ok=True):
+        self.timings.setdefault(route, []).append(seconds)
+        if not ok:
+            self.errors[route] = self.errors.get(route, 0) + 1
+
+    def stop(self):
+        self.finished = time.monotonic()
+
+    def summary(self):
+        """
+        One row per route: count, errors, throughput (per second over the whole
+        run) and p50/p95/p99/max latency in milliseconds.
+        """
+        elapsed = (self.finished or time.monotonic()) - self.started
+        rows = []
+        for route in sorted(self.timings):
+            timings = sorted(self.timings[route])
+            rows.append({
+                'route': route,
+                'count': len(timings),
+                'errors': self.errors.get(route, 0),
+                'per_second': len(timings) / elapsed if elapsed else 0.0,
+                'p50_ms': percentile(timings, 0.50) * 1000,
+                'p95_ms': percentile(timings, 0.95) * 1000,
+                'p99_ms': percentile(timings, 0.99) * 1000,
+                'max_ms': timings[-1] * 1000,
+            })
+        return rows
+
+
+class AsgiClient:
+    """
+    Minimal HTTP and WebSocket client for an ASGI application, recording the
+    latency of every exchange.
+    """
+
+    def __init__(self, application, recorder, host='localhost'):
+        self.application = application
+        self.recorder = recorder
+        self.host = host
+
+    def _headers(self, token, extra=()):
+        headers = [(b'host', self.host.encode())]
+        if token:
+            headers.append((b'authorization', f'Bearer {token}'.encode()))
+        headers.extend(extra)
+        return headers
+
+    async def request(self, route, method, path, token=None, data=None):
+        """
+        Send one request and return (status, decoded JSON body or None).
+        Responses of 400 and above count as errors for `route`.
+        """
+        body = fastjson.dumps(data) if data is not None else b''
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': self._headers(token, [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+            ]),
+            'client': ('127.0.0.1', 50000),
+            'server': (self.host, 80),
+        }
+        start = time.perf_counter()
+        communicator = ApplicationCommunicator(self.application, scope)
+        status, chunks = 599, []
+        try:
+            await communicator.send_input({'type': 'http.request', 'body': body, 'more_body': False})
+            response = await communicator.receive_output(REQUEST_TIMEOUT)
+            status = response['status']
+            while True:
+                message = await communicator.receive_output(REQUEST_TIMEOUT)
+                chunks.append(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            await communicator.wait(REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            await communicator.wait(0)
+        self.recorder.record(route, time.perf_counter() - start, ok=status < 400)
+        content = b''.join(chunks)
+        try:
+            return status, (fastjson.loads(content) if content else None)
+        except ValueError:
+            return status, None
+
+    async def websocket(self, route, path, token):
+        """
+        Open a socket, recording the handshake under `route`. Returns a
+        SocketSession, or None when the connection was refused.
+        """
+        scope = {
+            'type': 'websocket',
+            'asgi': {'version': '3.0'},
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': urlencode({'token': token}).encode(),
+            'root_path': '',
+            'headers': self._headers(None),
+            'subprotocols': [],
+            'client': ('127.0.0.1', 50000),
+            'server': (self.host, 80),
+        }
+        start = time.perf_counter()
+        communicator = ApplicationCommunicator(self.application, scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        try:
+            message = await communicator.receive_output(REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            message = {'type': 'websocket.close'}
+        accepted = message['type'] == 'websocket.accept'
+        self.recorder.record(route, time.perf_counter() - start, ok=accepted)
+        if not accepted:
+            await communicator.wait(0)
+            return None
+        return SocketSession(communicator)
+
+
+class SocketSession:
+
+    def __init__(self, communicator):
+        self.communicator = communicator
+
+    async def send(self, data):
+        await self.communicator.send_input({'type': 'websocket.receive', 'text': fastjson.dumps_str(data)})
+
+    async def receive(self, timeout):
+        """
+        The next text frame decoded, or None on timeout or close.
+        """
+        # receive_output() would cancel the application on a timeout, and an
+        # idle socket is not an error here
+        try:
+            message = await asyncio.wait_for(self.communicator.output_queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if message['type'] != 'websocket.send' or message.get('text') is None:
+            return None
+        return fastjson.loads(message['text'])
+
+    async def close(self):
+        await self.communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await self.communicator.wait(REQUEST_TIMEOUT)
+
+
+# --- M-Pesa stub ---
+
+class StubMpesaServer:
+    """
+    Local stand-in for the Daraja API: issues tokens, accepts every STK push
+    and queues the matching success callback, which the harness delivers with
+    deliver_callbacks() `callback_delay` seconds later (like M-Pesa, once the
+    customer entered their PIN). `latency` seconds are added to every response.
+    """
+
+    def __init__(self, latency=0.0, callback_delay=1.0):
+        self.latency = latency
+        self.callback_delay = callback_delay
+        self.callbacks = queue.Queue()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}'
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def _reply(self, payload):
+                time.sleep(stub.latency)
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.startswith('/oauth/v1/generate'):
+                    self._reply({'access_token': 'stub-token', 'expires_in': '3599'})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                if not self.path.startswith('/mpesa/stkpush/v1/processrequest'):
+                    self.send_error(404)
+                    return
+                checkout_request_id = f'ws_CO_{uuid.uuid4().hex}'
+                stub.callbacks.put((time.monotonic() + stub.callback_delay, {
+                    'Body': {'stkCallback': {
+                        'MerchantRequestID': uuid.uuid4().hex,
+                        'CheckoutRequestID': checkout_request_id,
+                        'ResultCode': 0,
+                        'ResultDesc': 'The service request is processed successfully.',
+                        'CallbackMetadata': {'Item': [
+                            {'Name': 'Amount', 'Value': payload.get('Amount')},
+                            {'Name': 'PhoneNumber', 'Value': payload.get('PhoneNumber')},
+                        ]},
+                    }},
+                }))
+                self._reply({
+                    'MerchantRequestID': uuid.uuid4().hex,
+                    'CheckoutRequestID': checkout_request_id,
+                    'ResponseCode': '0',
+                    'ResponseDescription': 'Success. Request accepted for processing',
+                    'CustomerMessage': 'Success. Request accepted for processing',
+                })
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    async def deliver_callbacks(self, client, stop, interval=0.2):
+        """
+        Post queued callbacks to the application until `stop` is set and the
+        queue is drained.
+        """
+        while True:
+            try:
+                due, callback = self.callbacks.get_nowait()
+            except queue.Empty:
+                if stop.is_set():
+                    return
+                await asyncio.sleep(interval)
+                continue
+            await asyncio.sleep(max(0, due - time.monotonic()))
+            await client.request('POST /api/payments/callback/', 'POST', '/api/payments/callback/', data=callback)
+
+
+# --- Simulated users ---
+
+class Simulation:
+    """
+    Shared state of a run. Providers and customers are lists of
+    (user_id, access_token); `center` and `radius_deg` bound the locations used.
+    """
+
+    def __init__(self, client, service_id, center, radius_deg, options, seed=1):
+        self.client = client
+        self.service_id = service_id
+        self.center = center
+        self.radius_deg = radius_deg
+        self.options = options
+        self.random = random.Random(seed)
+        self.stop = asyncio.Event()
+        # booking id -> perf_counter() of the provider's last location ping over the socket
+        self.location_sent = {}
+
+    def point(self):
+        lat, lon = self.center
+        return (
+            lat + self.random.uniform(-self.radius_deg, self.radius_deg),
+            lon + self.random.uniform(-self.radius_deg, self.radius_deg),
+        )
+
+    async def pause(self, seconds):
+        """
+        Sleep up to `seconds` (jittered), returning early when the run stops.
+        """
+        try:
+            await asyncio.wait_for(self.stop.wait(), seconds * self.random.uniform(0.5, 1.5))
+        except asyncio.TimeoutError:
+            pass
+
+    async def provider(self, token):
+        client, options = self.client, self.options
+        await self.pause(options['ramp_up'])
+        location = self.point()
+        await client.request('PATCH /api/provider/status/', 'PATCH', '/api/provider/status/', token, {'is_on_duty': True})
+        on_duty = True
+        ticks = 0
+        while not self.stop.is_set():
+            location = (location[0] + self.random.uniform(-0.001, 0.001), location[1] + self.random.uniform(-0.001, 0.001))
+            await client.request(
+                'POST /api/provider/location/', 'POST', '/api/provider/location/', token,
+                {'latitude': location[0], 'longitude': location[1]},
+            )
+            if self.random.random() < options['toggle_rate']:
+                on_duty = not on_duty
+                await client.request(
+                    'PATCH /api/provider/status/', 'PATCH', '/api/provider/status/', token, {'is_on_duty': on_duty}
+                )
+            ticks += 1
+            if ticks % options['poll_every'] == 0:
+                status, bookings = await client.request('GET /api/bookings/', 'GET', '/api/bookings/', token)
+                if status == 200:
+                    for booking in bookings:
+                        if booking['status'] == 'PENDING' and not self.stop.is_set():
+                            await self.job(token, booking['id'], location)
+            await self.pause(options['ping_interval'])
+
+    async def job(self, token, booking_id, location):
+        client, options = self.client, self.options
+        base = f'/api/bookings/{booking_id}'
+        status, _ = await client.request('POST /api/bookings/{id}/accept_booking/', 'POST', f'{base}/accept_booking/', token)
+        if status != 200:
+            return
+        await client.request('PATCH /api/bookings/{id}/start_job/', 'PATCH', f'{base}/start_job/', token)
+        socket = await client.websocket('WS connect /ws/location/', f'/ws/location/{booking_id}/', token)
+        if socket is not None:
+            for _ in range(options['job_pings']):
+                location = (location[0] + 0.0005, location[1] + 0.0005)
+                self.location_sent[booking_id] = time.perf_counter()
+                await socket.send({'latitude': location[0], 'longitude': location[1]})
+                await self.pause(options['ping_interval'])
+            await socket.close()
+        await client.request('PATCH /api/bookings/{id}/complete_job/', 'PATCH', f'{base}/complete_job/', token)
+
+    async def customer(self, token):
+        client, options = self.client, self.options
+        await self.pause(options['ramp_up'])
+        await client.request('GET /api/categories/', 'GET', '/api/categories/', token)
+        await client.request('GET /api/services/', 'GET', '/api/services/', token)
+        while not self.stop.is_set():
+            latitude, longitude = self.point()
+            status, booking = await client.request('POST /api/bookings/', 'POST', '/api/bookings/', token, {
+                'service_id': self.service_id, 'latitude': latitude, 'longitude': longitude,
+            })
+            if status == 201:
+                await self.follow_booking(token, booking['id'])
+            await self.pause(options['think_time'])
+
+    async def follow_booking(self, token, booking_id):
+        client, options = self.client, self.options
+        chat = await client.websocket('WS connect /ws/chat/', f'/ws/chat/{booking_id}/', token)
+        location = await client.websocket('WS connect /ws/location/', f'/ws/location/{booking_id}/', token)
+        if chat is not None:
+            start = time.perf_counter()
+            await chat.send({'message': 'Hello, how far are you?'})
+            # The customer is in the chat group too, so the message comes back
+            received = await chat.receive(REQUEST_TIMEOUT)
+            client.recorder.record('WS chat round trip', time.perf_counter() - start, ok=received is not None)
+
+        deadline = time.monotonic() + options['job_timeout']
+        booking = None
+        while time.monotonic() < deadline and not self.stop.is_set():
+            if location is not None:
+                update = await location.receive(options['ping_interval'])
+                sent = self.location_sent.get(booking_id)
+                if update is not None and sent is not None:
+                    client.recorder.record('WS location delivery', time.perf_counter() - sent)
+            else:
+                await self.pause(options['ping_interval'])
+            status, booking = await client.request(
+                'GET /api/bookings/{id}/', 'GET', f'/api/bookings/{booking_id}/', token
+            )
+            if status == 200 and booking['status'] in ('COMPLETED', 'REJECTED', 'CANCELLED'):
+                break
+
+        for socket in (chat, location):
+            if socket is not None:
+                await socket.close()
+        self.location_sent.pop(booking_id, None)
+
+        if booking and booking['status'] == 'COMPLETED' and not self.stop.is_set():
+            method = 'M-PESA' if self.random.random() < options['mpesa_fraction'] else 'CASH'
+            await client.request(
+                'POST /api/bookings/{id}/pay_for_job/', 'POST', f'/api/bookings/{booking_id}/pay_for_job/',
+                token, {'payment_method': method},
+            )
+
+    async def run(self, providers, customers, duration, mpesa=None):
+        actors = [self.provider(token) for _, token in providers]
+        actors += [self.customer(token) for _, token in customers]
+        tasks = [asyncio.ensure_future(actor) for actor in actors]
+        if mpesa is not None:
+            tasks.append(asyncio.ensure_future(mpesa.deliver_callbacks(self.client, self.stop)))
+        await asyncio.sleep(duration)
+        self.stop.set()
+        # Let in-flight requests finish, so their latencies are recorded
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.client.recorder.stop()
@@ -0,0 +1,81 @@
+# In api/location_codec.py
+"""
+Compact binary wire format for live location streaming.
+
+Clients opt in by offering the BINARY_SUBPROTOCOL websocket subprotocol; everyone
+else keeps receiving JSON text frames. Coordinates are fixed-point integers in
+micro-degrees (~0.11 m at the equator). Every frame carries a sequence number:
+
+    key frame:    !B H i i   type=1, seq, lat, lon        (11 bytes)
+    delta frame:  !B H h h   type=2, seq, dlat, dlon      (7 bytes)
+
+A delta is relative to the previous frame on the same connection. A key frame is
+sent first, whenever a delta does not fit in 16 bits (~3.6 km), and every
+KEYFRAME_INTERVAL frames so a client can always resynchronize.
+"""
+import struct
+
+BINARY_SUBPROTOCOL = 'quickassist.location.v1'
+
+SCALE = 1_000_000
+KEYFRAME_INTERVAL = 30
+
+KEY_FRAME = 1
+DELTA_FRAME = 2
+
+_KEY = struct.Struct('!BHii')
+_DELTA = struct.Struct('!BHhh')
+_INT16_MAX = 32767
+
+
+class LocationEncoder:
+    """
+    Per-connection encoder: holds the previous fix and the sequence number.
+    """
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self._previous = None
+        self._since_key = 0
+
+    def encode(self, latitude, longitude):
+        lat = round(latitude * SCALE)
+        lon = round(longitude * SCALE)
+        seq = self.seq
+        self.seq = (self.seq + 1) & 0xFFFF
+
+        previous = self._previous
+        self._previous = (lat, lon)
+        if previous is not None and self._since_key < self.keyframe_interval:
+            dlat, dlon = lat - previous[0], lon - previous[1]
+            if abs(dlat) <= _INT16_MAX and abs(dlon) <= _INT16_MAX:
+                self._since_key += 1
+                return _DELTA.pack(DELTA_FRAME, seq, dlat, dlon)
+
+        self._since_key = 0
+        return _KEY.pack(KEY_FRAME, seq, lat, lon)
+
+
+class LocationDecoder:
+    """
+    Decodes frames produced by LocationEncoder, for binary clients sending fixes.
+    """
+
+    def __init__(self):
+        self._previous = None
+
+    def decode(self, data):
+        """
+        Return (seq, latitude, longitude), or None for a malformed frame or a
+        delta received before any key frame.
+        """
+        if len(data) == _KEY.size and data[0] == KEY_FRAME:
+            _, seq, lat, lon = _KEY.unpack(data)
+        elif len(data) == _DELTA.size and data[0] == DELTA_FRAME and self._previous is not None:
+            _, seq, dlat, dlon = _DELTA.unpack(data)
+            lat, lon = self._previous[0] + dlat, self._previous[1] + dlon
+        else:
+            return None
+        self._previous = (lat, lon)
+        return seq, lat / SCALE, lon / SCALE
@@ -0,0 +1,235 @@
+# In api/logs.py
+"""
+Structured (JSON lines) logging that never blocks a request on I/O.
+
+- AsyncQueueHandler: the emitting thread only puts the record on a bounded
+  queue; a listener thread formats and writes it. When the queue is full the
+  record is dropped and counted (quickassist_log_records_dropped_total), the
+  request does not wait.
+- JsonFormatter: one JSON object per line with the timestamp, level, logger,
+  event, correlation id and the event's fields, with payment and personal
+  data redacted (see redact()).
+- Correlation ids: CorrelationIdMiddleware (REST) and
+  SocketCorrelationMiddleware (websockets) take the client's X-Correlation-ID
+  (or the `correlation_id` query parameter on a socket) or generate one, so a
+  client can tie its REST calls and socket messages together.
+- log_event(): logs an event with fields, sampled at LOG_SAMPLE_RATES[event]
+  for high-volume events such as location pings.
+
+Configured in settings.LOGGING for the 'api' loggers.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import traceback
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import parse_qs
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+
+from . import fastjson
+from .metrics import REGISTRY, Counter
+
+CORRELATION_HEADER = 'X-Correlation-ID'
+# Client-supplied ids are kept only when they look like an id
+_VALID_CORRELATION_ID = re.compile(r'^[\w.:-]{1,64}$')
+
+_correlation_id = ContextVar('correlation_id', default=None)
+
+LOG_RECORDS_DROPPED = REGISTRY.register(Counter(
+    'quickassist_log_records_dropped_total', 'Log records dropped because the logging queue was full.',
+))
+
+# Keys whose values never reach the logs, compared case-insensitively
+REDACTED_KEYS = {
+    'password', 'authorization', 'access', 'refresh', 'token', 'access_token',
+    'phone_number', 'phonenumber', 'partya', 'mpesareceiptnumber', 'email',
+}
+REDACTED = '[redacted]'
+
+
+# --- Correlation ids ---
+
+def get_correlation_id():
+    return _correlation_id.get()
+
+
+def set_correlation_id(value=None):
+    """
+    Use `value` (when it looks like an id) or a new id as the correlation id
+    of the current request or connection. Returns the id and the token to
+    reset the context variable with.
+    """
+    if not value or not _VALID_CORRELATION_ID.match(value):
+        value = uuid.uuid4().hex
+    return value, _correlation_id.set(value)
+
+
+class CorrelationIdMiddleware:
+    """
+    Takes or generates the request's correlation id and echoes it in the
+    X-Correlation-ID response header.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        correlation_id, reset = set_correlation_id(request.headers.get(CORRELATION_HEADER))
+        try:
+            response = self.get_response(request)
+        finally:
+            _correlation_id.reset(reset)
+        response[CORRELATION_HEADER] = correlation_id
+        return response
+
+    async def __acall__(self, request):
+        correlation_id, reset = set_correlation_id(request.headers.get(CORRELATION_HEADER))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _correlation_id.reset(reset)
+        response[CORRELATION_HEADER] = correlation_id
+        return response
+
+
+class SocketCorrelationMiddleware:
+    """
+    ASGI middleware giving a websocket connection a correlation id, taken from
+    the X-Correlation-ID handshake header or the `correlation_id` query
+    parameter (browsers cannot set headers), used by every message it handles.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get('headers') or [])
+        value = headers.get(CORRELATION_HEADER.lower().encode(), b'').decode('latin1')
+        if not value:
+            value = parse_qs(scope.get('query_string', b'').decode()).get('correlation_id', [''])[0]
+        correlation_id, _ = set_correlation_id(value)
+        return await self.inner(dict(scope, correlation_id=correlation_id), receive, send)
+
+
+class CorrelationIdFilter(logging.Filter):
+    """
+    Stamps the record with the current correlation id. Must run in the
+    emitting thread, so it belongs on the queue handler.
+    """
+
+    def filter(self, record):
+        record.correlation_id = _correlation_id.get()
+        return True
+
+
+# --- Events ---
+
+def log_event(logger, event, level=logging.INFO, **fields):
+    """
+    Log `event` (e.g. 'booking.created') with structured fields. Events listed
+    in LOG_SAMPLE_RATES are only logged for that fraction of the calls, and
+    carry the rate in 'sample_rate'.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    rate = settings.LOG_SAMPLE_RATES.get(event)
+    if rate is not None:
+        if random.random() >= rate:
+            return
+        fields['sample_rate'] = rate
+    logger.log(level, event, extra={'event_fields': fields})
+
+
+def redact(value):
+    """
+    A copy of `value` with sensitive keys masked, including the Name/Value
+    items of an M-Pesa CallbackMetadata.
+    """
+    if isinstance(value, dict):
+        if set(value) == {'Name', 'Value'} and str(value['Name']).lower() in REDACTED_KEYS:
+            return {'Name': value['Name'], 'Value': REDACTED}
+        return {
+            key: REDACTED if str(key).lower() in REDACTED_KEYS else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+# --- Formatting and output ---
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, dt_timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+            'correlation_id': getattr(record, 'correlation_id', None),
+        }
+        fields = getattr(record, 'event_fields', None)
+        if fields:
+            entry.update(redact(fields))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return fastjson.dumps_str(entry)
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler writing to `stream` from a listener thread. The formatter
+    set on this handler (e.g. by LOGGING) is used by the listener.
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        # Flush what is queued at exit
+        atexit.register(self._stop_listener)
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Only what the listener cannot do: merge the arguments and render the
+        # traceback (exc_info does not cross threads). Formatting stays off this thread.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels().inc()
+
+    def _stop_listener(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def close(self):
+        self._stop_listener()
+        super().close()
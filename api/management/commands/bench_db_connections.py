@@ -0,0 +1,77 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_started, request_finished
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request database cost with and without persistent connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Number of simulated requests per mode',
+        )
+
+    def simulate(self, requests, conn_max_age, pool=None):
+        """
+        Run `requests` request cycles, each doing one trivial query. The request
+        signals close (or keep) the connection exactly like the real handler does.
+        """
+        settings_dict = connection.settings_dict
+        saved = settings_dict['CONN_MAX_AGE'], settings_dict['OPTIONS'].get('pool')
+        connection.close()
+        settings_dict['CONN_MAX_AGE'] = conn_max_age
+        if saved[1]:
+            # Temporarily bypass the pool to measure raw connection setup
+            settings_dict['OPTIONS']['pool'] = pool
+        timings = []
+        try:
+            for _ in range(requests):
+                start = time.perf_counter()
+                request_started.send(sender=self.__class__)
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.fetchone()
+                request_finished.send(sender=self.__class__)
+                timings.append(time.perf_counter() - start)
+        finally:
+            connection.close()
+            settings_dict['CONN_MAX_AGE'] = saved[0]
+            if saved[1]:
+                settings_dict['OPTIONS']['pool'] = saved[1]
+        timings.sort()
+        return {
+            'mean': sum(timings) / len(timings),
+            'p50': timings[len(timings) // 2],
+            'p99': timings[int(len(timings) * 0.99) - 1],
+        }
+
+    def handle(self, *args, **options):
+        requests = options['requests']
+        pool = connection.settings_dict['OPTIONS'].get('pool')
+        conn_max_age = connection.settings_dict['CONN_MAX_AGE'] or 60
+
+        self.stdout.write(f"Database: {connection.vendor} ({connection.settings_dict['NAME']})")
+        self.stdout.write(f"Requests per mode: {requests}")
+
+        results = [('new connection per request', self.simulate(requests, 0))]
+        if pool:
+            results.append(('connection pool', self.simulate(requests, 0, pool=pool)))
+        else:
+            results.append((f'persistent (CONN_MAX_AGE={conn_max_age})', self.simulate(requests, conn_max_age)))
+
+        for label, result in results:
+            self.stdout.write(
+                f"  {label:<40} mean {result['mean'] * 1000:.3f} ms  "
+                f"p50 {result['p50'] * 1000:.3f} ms  p99 {result['p99'] * 1000:.3f} ms"
+            )
+        baseline = results[0][1]['mean']
+        reused = results[-1][1]['mean']
+        self.stdout.write(self.style.SUCCESS(
+            f"Connection setup saved per request: {(baseline - reused) * 1000:.3f} ms "
+            f"({baseline / reused:.1f}x faster)"
+        ))
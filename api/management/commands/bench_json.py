@@ -0,0 +1,56 @@
+import json
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api import fastjson
+from api.benchmarks import build_bookings, build_profiles
+from api.renderers import FastJSONRenderer
+from api.serializers import BookingSerializer, ProviderProfileSerializer
+
+
+def timeit(func, rounds):
+    func()  # warm up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the default and the fast JSON renderer/parser on booking and provider list payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=500, help='Rows per list payload')
+        parser.add_argument('--rounds', type=int, default=50, help='Repetitions per measurement')
+
+    def handle(self, *args, **options):
+        size, rounds = options['size'], options['rounds']
+        payloads = {
+            'booking list': BookingSerializer(build_bookings(size), many=True).data,
+            'provider list': ProviderProfileSerializer(build_profiles(size), many=True).data,
+        }
+        # Raw socket frame: UUID, Decimal and datetime values, as the consumers see them
+        frame = {'booking': uuid.uuid4(), 'amount': Decimal('1500.00'), 'timestamp': timezone.now(), 'message': 'On my way'}
+
+        self.stdout.write(f"orjson available: {fastjson.orjson is not None}")
+        default_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+        for name, data in payloads.items():
+            body = default_renderer.render(data)
+            render_default = timeit(lambda: default_renderer.render(data), rounds)
+            render_fast = timeit(lambda: fast_renderer.render(data), rounds)
+            parse_default = timeit(lambda: json.loads(body), rounds)
+            parse_fast = timeit(lambda: fastjson.loads(body), rounds)
+            self.stdout.write(f"{name} ({size} rows, {len(body) / 1024:.0f} KiB)")
+            self.stdout.write(f"  render  default {render_default * 1000:8.3f} ms  fast {render_fast * 1000:8.3f} ms  ({render_default / render_fast:.1f}x)")
+            self.stdout.write(f"  parse   default {parse_default * 1000:8.3f} ms  fast {parse_fast * 1000:8.3f} ms  ({parse_default / parse_fast:.1f}x)")
+
+        frame_rounds = rounds * 1000
+        encode_default = timeit(lambda: default_renderer.render(frame), frame_rounds)
+        encode_fast = timeit(lambda: fastjson.dumps_str(frame), frame_rounds)
+        self.stdout.write("socket frame")
+        self.stdout.write(f"  encode  default {encode_default * 1e6:8.2f} us  fast {encode_fast * 1e6:8.2f} us  ({encode_default / encode_fast:.1f}x)")
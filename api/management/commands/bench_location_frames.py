@@ -0,0 +1,74 @@
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import fastjson
+from api.location_codec import LocationEncoder, LocationDecoder
+
+
+def gps_trace(fixes, speed_kmh, interval_s, seed=42):
+    """
+    A provider driving through Dar es Salaam: one fix every `interval_s` seconds,
+    gently changing heading, with a few metres of GPS jitter.
+    """
+    rng = random.Random(seed)
+    lat, lon, heading = -6.7924, 39.2083, rng.uniform(0, 2 * math.pi)
+    step_deg = speed_kmh / 3600 * interval_s / 111.32
+    trace = []
+    for _ in range(fixes):
+        heading += rng.gauss(0, 0.2)
+        lat += step_deg * math.cos(heading) + rng.gauss(0, 0.00003)
+        lon += step_deg * math.sin(heading) + rng.gauss(0, 0.00003)
+        trace.append((lat, lon))
+    return trace
+
+
+def ws_frame_size(payload_size):
+    # Server-to-client frames are unmasked: 2 header bytes up to 125 bytes of payload
+    return payload_size + (2 if payload_size < 126 else 4)
+
+
+class Command(BaseCommand):
+    help = 'Measure bytes per location update and encode cost of the JSON and binary wire modes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixes', type=int, default=10000)
+        parser.add_argument('--speed', type=float, default=30.0, help='Travel speed in km/h')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between fixes')
+
+    def handle(self, *args, **options):
+        trace = gps_trace(options['fixes'], options['speed'], options['interval'])
+
+        start = time.perf_counter()
+        json_frames = [fastjson.dumps_str({'latitude': lat, 'longitude': lon}) for lat, lon in trace]
+        json_cost = (time.perf_counter() - start) / len(trace)
+
+        encoder = LocationEncoder()
+        start = time.perf_counter()
+        binary_frames = [encoder.encode(lat, lon) for lat, lon in trace]
+        binary_cost = (time.perf_counter() - start) / len(trace)
+
+        # Round trip check: the decoded position is within fixed-point precision
+        decoder = LocationDecoder()
+        worst_error = max(
+            max(abs(decoded[1] - lat), abs(decoded[2] - lon))
+            for decoded, (lat, lon) in zip((decoder.decode(frame) for frame in binary_frames), trace)
+        )
+
+        modes = [
+            ('json', [len(frame.encode()) for frame in json_frames], json_cost),
+            ('binary', [len(frame) for frame in binary_frames], binary_cost),
+        ]
+        self.stdout.write(f"{len(trace)} fixes at {options['speed']} km/h every {options['interval']} s")
+        for name, sizes, cost in modes:
+            payload = sum(sizes) / len(sizes)
+            on_wire = sum(ws_frame_size(size) for size in sizes) / len(sizes)
+            self.stdout.write(
+                f"  {name:<7} payload {payload:6.1f} B  on the wire {on_wire:6.1f} B  encode {cost * 1e6:5.2f} us"
+            )
+        json_wire = sum(ws_frame_size(size) for size in modes[0][1])
+        binary_wire = sum(ws_frame_size(size) for size in modes[1][1])
+        self.stdout.write(f"  binary max position error: {worst_error * 111320:.3f} m")
+        self.stdout.write(self.style.SUCCESS(f"binary uses {binary_wire / json_wire:.0%} of the JSON bytes"))
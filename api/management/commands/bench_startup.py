@@ -0,0 +1,99 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter so the import cost is really a cold start
+PROBE = '''
+import json, time
+t0 = time.perf_counter()
+import django
+django.setup()
+from django.core.handlers.wsgi import WSGIHandler
+from django.urls import get_resolver
+WSGIHandler()  # loads the middleware chain
+get_resolver().url_patterns  # imports the URLconf and views
+startup = time.perf_counter() - t0
+
+from django.conf import settings
+from django.test import Client
+from api.models import User
+from api.serializers import CustomTokenObtainPairSerializer
+# The test client's Host header, accepted in this process only
+settings.ALLOWED_HOSTS.append('testserver')
+# A token carrying the state claims authenticates without a user lookup
+token = CustomTokenObtainPairSerializer.get_token(User(pk=0, username='bench', user_type='CUSTOMER')).access_token
+client = Client(HTTP_AUTHORIZATION=f'Bearer {{token}}')
+response = client.get('/api/categories/')  # warm up
+assert response.status_code == 200, response.status_code
+timings = []
+statuses = set()
+for _ in range({requests}):
+    start = time.perf_counter()
+    response = client.get('/api/categories/', HTTP_ACCEPT='{accept}')
+    timings.append(time.perf_counter() - start)
+    statuses.add(response.status_code)
+timings.sort()
+print(json.dumps({{
+    'startup': startup, 'request_p50': timings[len(timings) // 2], 'request_mean': sum(timings) / len(timings),
+    'statuses': sorted(statuses),
+}}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Compare cold-start import time and per-request middleware overhead of the settings profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3, help='Cold starts per profile')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per run')
+        parser.add_argument(
+            '--accept',
+            default='application/json',
+            help="Accept header of the measured requests (try 'text/html' for a browser)",
+        )
+
+    def probe(self, settings_module, requests, accept):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+        env.pop('DJANGO_ENV', None)
+        # A single process, where prod accepts a process-local cache
+        env.setdefault('CACHE_URL', 'locmem://')
+        env.setdefault('METRICS_TOKEN', 'bench-startup')
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE.format(requests=requests, accept=accept)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        # The measured request lists the categories (one query plus the services prefetch)
+        profiles = ['quickassist_project.settings.dev', 'quickassist_project.settings.prod']
+        results = {}
+        for profile in profiles:
+            runs = [self.probe(profile, options['requests'], options['accept']) for _ in range(options['runs'])]
+            results[profile] = {
+                key: statistics.median(run[key] for run in runs)
+                for key in ('startup', 'request_p50', 'request_mean')
+            }
+
+            # A profile may refuse the Accept header (prod renders JSON only, 406)
+            results[profile]['statuses'] = sorted({status for run in runs for status in run['statuses']})
+
+        self.stdout.write(
+            f"{'profile':<36} {'cold start':>12} {'request p50':>12} {'request mean':>13} {'status':>7}"
+        )
+        for profile, result in results.items():
+            self.stdout.write(
+                f"{profile:<36} {result['startup'] * 1000:>9.1f} ms "
+                f"{result['request_p50'] * 1e6:>9.0f} us {result['request_mean'] * 1e6:>10.0f} us "
+                f"{','.join(map(str, result['statuses'])):>7}"
+            )
+        dev, prod = (results[profile] for profile in profiles)
+        self.stdout.write(self.style.SUCCESS(
+            f"prod saves {(dev['startup'] - prod['startup']) * 1000:.1f} ms per process start and "
+            f"{(dev['request_mean'] - prod['request_mean']) * 1e6:.0f} us per request"
+        ))
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import os
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from api import heatmap, rollups
+from api.loadtest import AsgiClient, LatencyRecorder, Simulation, StubMpesaServer
+from api.models import Booking, Service, ServiceCategory, ServiceProviderProfile, User
+from api.serializers import CustomTokenObtainPairSerializer
+
+# Simulated users are created with this username prefix and removed afterwards
+PREFIX = 'load-'
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the ASGI application in-process with simulated providers and customers '
+        'and report latency and throughput per route. Creates (and removes) its own '
+        'users, so point it at a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--providers', type=int, default=1000)
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--duration', type=int, default=60, help='Seconds to run')
+        parser.add_argument('--ramp-up', type=float, default=10, help='Seconds over which users start')
+        parser.add_argument('--ping-interval', type=float, default=5, help='Seconds between provider location pings')
+        parser.add_argument('--poll-every', type=int, default=3, help='Pings between a provider\'s booking polls')
+        parser.add_argument('--toggle-rate', type=float, default=0.02, help='Chance of a duty toggle per ping')
+        parser.add_argument('--job-pings', type=int, default=3, help='Socket location pings during a job')
+        parser.add_argument('--job-timeout', type=float, default=60, help='Seconds a customer follows a booking')
+        parser.add_argument('--think-time', type=float, default=15, help='Seconds between a customer\'s bookings')
+        parser.add_argument('--mpesa-fraction', type=float, default=0.5, help='Share of payments made with M-Pesa')
+        parser.add_argument('--mpesa-latency', type=float, default=0.05, help='Seconds the stub M-Pesa takes to answer')
+        parser.add_argument('--mpesa-callback-delay', type=float, default=1.0, help='Seconds before the stub calls back')
+        parser.add_argument('--radius-km', type=float, default=10, help='Spread of the simulated locations')
+        parser.add_argument('--center', default='-6.79,39.21', help='lat,lon the locations are spread around')
+        parser.add_argument(
+            '--channel-layer', choices=['memory', 'configured'], default='memory',
+            help='In-memory channel layer (default) or the one configured in settings',
+        )
+        parser.add_argument('--json', dest='json_path', help='Also write the report to this JSON file')
+        parser.add_argument('--keep', action='store_true', help='Keep the simulated users and bookings')
+
+    # --- Fixtures ---
+
+    @staticmethod
+    def area(options):
+        """
+        Center (lat, lon) of the simulated locations and their spread in degrees.
+        """
+        center = tuple(float(value) for value in options['center'].split(','))
+        return center, options['radius_km'] / 111.0
+
+    def cleanup(self, start=None):
+        users = User.objects.filter(username__startswith=PREFIX)
+        with transaction.atomic():
+            Booking.objects.filter(customer__in=users).delete()
+            deleted, _ = users.delete()
+            ServiceCategory.objects.filter(name=f'{PREFIX}category').delete()
+        # Counters kept incrementally by the requests are recomputed without the simulated rows
+        heatmap.rebuild()
+        if start is not None:
+            rollups.rebuild(start, timezone.now())
+        return deleted
+
+    def create_users(self, options):
+        """
+        Create the service, providers and customers in bulk (one password hash
+        for all) and return (service_id, providers, customers) where the last
+        two are lists of (user_id, access_token).
+        """
+        rng = random.Random(1)
+        password = make_password('load-test')
+        (center_lat, center_lon), spread = self.area(options)
+
+        category = ServiceCategory.objects.create(name=f'{PREFIX}category')
+        service = Service.objects.create(
+            category=category, name='Load test service', description='Created by the loadtest command',
+            estimated_base_price=500,
+        )
+        users = [
+            User(username=f'{PREFIX}provider-{i}', password=password, user_type='PROVIDER')
+            for i in range(options['providers'])
+        ] + [
+            User(username=f'{PREFIX}customer-{i}', password=password, user_type='CUSTOMER',
+                 phone_number=f'2547{i:08d}')
+            for i in range(options['customers'])
+        ]
+        User.objects.bulk_create(users, batch_size=1000)
+        users = list(User.objects.filter(username__startswith=PREFIX).order_by('pk'))
+        providers = [user for user in users if user.user_type == 'PROVIDER']
+        customers = [user for user in users if user.user_type == 'CUSTOMER']
+        ServiceProviderProfile.objects.bulk_create([
+            ServiceProviderProfile(
+                user=user, service_offered=service, service_price=500, is_verified=True,
+                last_known_latitude=center_lat + rng.uniform(-spread, spread),
+                last_known_longitude=center_lon + rng.uniform(-spread, spread),
+            )
+            for user in providers
+        ], batch_size=1000)
+
+        def token(user):
+            # The same access token a login returns, with the embedded user state
+            return str(CustomTokenObtainPairSerializer.get_token(user).access_token)
+
+        return (
+            service.id,
+            [(user.pk, token(user)) for user in providers],
+            [(user.pk, token(user)) for user in customers],
+        )
+
+    # --- Run ---
+
+    def report(self, rows):
+        self.stdout.write(
+            f"{'route':<44} {'count':>7} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+        )
+        for row in rows:
+            self.stdout.write(
+                f"{row['route']:<44} {row['count']:>7} {row['errors']:>6} {row['per_second']:>8.1f} "
+                f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}"
+            )
+
+    def handle(self, *args, **options):
+        removed = self.cleanup()
+        if removed:
+            self.stdout.write(f"Removed {removed} rows left by a previous run")
+        started_at = timezone.now()
+        service_id, providers, customers = self.create_users(options)
+        self.stdout.write(f"Simulating {len(providers)} providers and {len(customers)} customers for {options['duration']}s")
+
+        mpesa = StubMpesaServer(options['mpesa_latency'], options['mpesa_callback_delay']).start()
+        overrides = {'MPESA_BASE_URL': mpesa.url}
+        if options['channel_layer'] == 'memory':
+            overrides['CHANNEL_LAYERS'] = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+        credentials = {
+            'MPESA_CONSUMER_KEY': 'stub', 'MPESA_CONSUMER_SECRET': 'stub',
+            'MPESA_SHORTCODE': '174379', 'MPESA_PASSKEY': 'stub',
+        }
+        saved_environ = {name: os.environ.get(name) for name in credentials}
+        os.environ.update(credentials)
+        try:
+            with override_settings(**overrides):
+                from quickassist_project.asgi import application
+
+                recorder = LatencyRecorder()
+                client = AsgiClient(application, recorder)
+                center, spread = self.area(options)
+                simulation = Simulation(client, service_id, center, spread, options)
+                asyncio.run(simulation.run(providers, customers, options['duration'], mpesa))
+        finally:
+            mpesa.stop()
+            for name, value in saved_environ.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            if not options['keep']:
+                self.cleanup(started_at)
+
+        rows = recorder.summary()
+        self.report(rows)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as report_file:
+                json.dump({'options': {k: v for k, v in options.items() if isinstance(v, (int, float, str, bool))},
+                           'routes': rows}, report_file, indent=2)
+            self.stdout.write(f"Report written to {options['json_path']}")
+        self.stdout.write(self.style.SUCCESS('Load test finished'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api import heatmap
+
+
+class Command(BaseCommand):
+    help = 'Recompute the supply/demand heatmap cells from provider and booking locations'
+
+    def handle(self, *args, **options):
+        cells = heatmap.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {cells} heatmap cells'))
@@ -0,0 +1,61 @@
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils.dateparse import parse_date
+
+from api import rollups
+from api.models import Booking
+
+
+class Command(BaseCommand):
+    help = 'Recompute the booking/revenue analytics rollups from the Booking and Payment tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            type=str,
+            help='First day to rebuild (YYYY-MM-DD, UTC). Defaults to the oldest booking',
+        )
+        parser.add_argument(
+            '--until',
+            type=str,
+            help='Last day to rebuild, inclusive (YYYY-MM-DD, UTC). Defaults to the newest booking',
+        )
+        parser.add_argument(
+            '--batch-days',
+            type=int,
+            default=7,
+            help='Days recomputed per transaction',
+        )
+
+    def parse_day(self, value):
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'Invalid date: {value}')
+        return day
+
+    def handle(self, *args, **options):
+        bounds = Booking.objects.aggregate(first=Min('created_at'), last=Max('created_at'))
+        if bounds['first'] is None and not (options['since'] and options['until']):
+            self.stdout.write('No bookings, nothing to rebuild.')
+            return
+
+        since = self.parse_day(options['since']) if options['since'] else bounds['first'].astimezone(dt_timezone.utc).date()
+        until = self.parse_day(options['until']) if options['until'] else bounds['last'].astimezone(dt_timezone.utc).date()
+        if until < since:
+            raise CommandError('--until is before --since')
+
+        start = datetime.combine(since, time.min, tzinfo=dt_timezone.utc)
+        end = datetime.combine(until + timedelta(days=1), time.min, tzinfo=dt_timezone.utc)
+        step = timedelta(days=max(options['batch_days'], 1))
+
+        total = 0
+        while start < end:
+            batch_end = min(start + step, end)
+            rows = rollups.rebuild(start, batch_end)
+            total += rows
+            self.stdout.write(f"  {start:%Y-%m-%d} .. {batch_end:%Y-%m-%d}: {rows} rows")
+            start = batch_end
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} rollup rows from {since} to {until}'))
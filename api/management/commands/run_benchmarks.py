@@ -0,0 +1,76 @@
+import fnmatch
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the micro-benchmarks of api/benchmarks.py, record them in the history file '
+        'and compare them with the recent runs on this machine.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('patterns', nargs='*', help='Only run benchmarks matching these glob patterns')
+        parser.add_argument('--list', action='store_true', help='List the benchmarks and exit')
+        parser.add_argument('--rounds', type=int, help='Override the rounds of every benchmark')
+        parser.add_argument('--history', default=None, help='History file (default: $BENCHMARK_HISTORY or .benchmarks/history.json)')
+        parser.add_argument('--no-save', action='store_true', help='Do not append this run to the history')
+        parser.add_argument('--window', type=int, default=5, help='Past runs the baseline is taken from')
+        parser.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown over the baseline (0.25 = 25%%)')
+        parser.add_argument('--check', action='store_true', help='Exit with an error when a benchmark regressed')
+
+    def handle(self, *args, **options):
+        selected = [
+            bench for name, bench in benchmarks.BENCHMARKS.items()
+            if not options['patterns'] or any(fnmatch.fnmatch(name, pattern) for pattern in options['patterns'])
+        ]
+        if options['list']:
+            for bench in selected:
+                self.stdout.write(bench.name)
+            return
+        if not selected:
+            raise CommandError('No benchmark matches the given patterns.')
+
+        path = options['history'] or benchmarks.default_history_path()
+        history = benchmarks.load_history(path)
+        machine = benchmarks.machine_id()
+        results = {}
+        regressions = []
+
+        self.stdout.write(f"{'benchmark':<44} {'median':>11} {'min':>11} {'baseline':>11} {'change':>8}")
+        for bench in selected:
+            result = bench.run(options['rounds'])
+            results[bench.name] = result
+            reference = benchmarks.baseline(history, bench.name, machine, options['window'])
+            change = ''
+            if reference:
+                ratio = result['median'] / reference
+                change = f'{(ratio - 1) * 100:+.1f}%'
+                if ratio > 1 + options['threshold']:
+                    regressions.append(bench.name)
+                    change = self.style.ERROR(change)
+            self.stdout.write(
+                f"{bench.name:<44} {result['median'] * 1000:>8.3f} ms {result['min'] * 1000:>8.3f} ms "
+                f"{(f'{reference * 1000:8.3f} ms' if reference else '-'):>11} {change:>8}"
+            )
+
+        if not options['no_save']:
+            history.append({
+                'timestamp': timezone.now().isoformat(),
+                'commit': benchmarks.current_commit(),
+                'machine': machine,
+                'results': results,
+            })
+            benchmarks.save_history(path, history)
+            self.stdout.write(f"Recorded in {path}")
+
+        if regressions:
+            message = f"{len(regressions)} benchmark(s) slower than the baseline by more than {options['threshold']:.0%}: {', '.join(regressions)}"
+            if options['check']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('No regressions'))
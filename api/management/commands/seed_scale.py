@@ -0,0 +1,410 @@
+import time
+import uuid
+from array import array
+from bisect import bisect
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+from math import cos, radians
+from random import Random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Avg, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api import heatmap, rollups
+from api.models import (
+    Booking, ChatMessage, Payment, Rating, Service, ServiceCategory, ServiceProviderProfile, User,
+)
+
+# name, latitude, longitude, share of the population, spread in km, hotspots
+CITIES = {
+    'dar-es-salaam': ('Dar es Salaam', -6.7924, 39.2083, 0.45, 12, 12),
+    'mwanza': ('Mwanza', -2.5164, 32.9175, 0.12, 7, 6),
+    'arusha': ('Arusha', -3.3869, 36.6830, 0.11, 6, 6),
+    'dodoma': ('Dodoma', -6.1630, 35.7516, 0.09, 6, 5),
+    'mbeya': ('Mbeya', -8.9094, 33.4608, 0.08, 5, 4),
+    'morogoro': ('Morogoro', -6.8278, 37.6591, 0.06, 4, 4),
+    'tanga': ('Tanga', -5.0689, 39.0988, 0.05, 4, 3),
+    'zanzibar': ('Zanzibar', -6.1659, 39.2026, 0.04, 4, 3),
+}
+
+PROFILES = {
+    'small': {
+        'customers': 2000, 'providers': 300, 'bookings': 10000, 'days': 90,
+        'cities': ['dar-es-salaam'],
+    },
+    'medium': {
+        'customers': 50000, 'providers': 3000, 'bookings': 250000, 'days': 365,
+        'cities': ['dar-es-salaam', 'arusha'],
+    },
+    'city': {
+        'customers': 500000, 'providers': 20000, 'bookings': 2000000, 'days': 365,
+        'cities': ['dar-es-salaam'],
+    },
+    'national': {
+        'customers': 2000000, 'providers': 80000, 'bookings': 5000000, 'days': 730,
+        'cities': list(CITIES),
+    },
+}
+
+# category -> [(service, base price)]
+CATALOG = {
+    'Home Repair': [('Plumbing', 25000), ('Electrical', 30000), ('Carpentry', 35000), ('Painting', 50000)],
+    'Cleaning': [('House Cleaning', 20000), ('Laundry', 10000), ('Fumigation', 60000)],
+    'Automotive': [('Car Wash', 8000), ('Mechanic', 40000), ('Towing', 70000)],
+    'Beauty': [('Hair Styling', 15000), ('Barber', 5000), ('Makeup', 30000)],
+    'Moving': [('Moving Help', 80000), ('Delivery', 10000)],
+}
+
+# Share of bookings per final status. Open bookings are recent, the rest spread over the period.
+STATUS_WEIGHTS = {
+    'COMPLETED': 0.80, 'CANCELLED': 0.10, 'REJECTED': 0.07,
+    'PENDING': 0.01, 'ACCEPTED': 0.01, 'IN_PROGRESS': 0.01,
+}
+OPEN_STATUSES = ('PENDING', 'ACCEPTED', 'IN_PROGRESS')
+
+# Bookings per hour of the day (local morning and evening peaks)
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 7, 9, 9, 8, 7, 7, 7, 7, 8, 9, 10, 10, 8, 6, 4, 2, 1]
+
+RATING_SHARE = 0.6
+SCORE_WEIGHTS = {5: 0.55, 4: 0.27, 3: 0.10, 2: 0.05, 1: 0.03}
+MPESA_SHARE = 0.6
+FAILED_PAYMENT_SHARE = 0.05
+
+MESSAGES = [
+    'Hello, I am on my way.', 'How long until you arrive?', 'I am at the gate.',
+    'Please call me when you are close.', 'The traffic is heavy, about 10 more minutes.',
+    'Thank you!', 'Can you bring extra materials?', 'Which house number?',
+    'I have arrived.', 'Great work, thanks.',
+]
+
+
+@contextmanager
+def explicit_timestamps():
+    """
+    Let bulk_create store the generated timestamps instead of now() in the
+    auto_now / auto_now_add fields.
+    """
+    fields = [
+        Booking._meta.get_field('created_at'),
+        Rating._meta.get_field('created_at'),
+        Payment._meta.get_field('created_at'),
+        Payment._meta.get_field('updated_at'),
+        ChatMessage._meta.get_field('timestamp'),
+    ]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Chooser:
+    """
+    Weighted random choice with precomputed cumulative weights.
+    """
+
+    def __init__(self, rng, weights):
+        self.rng = rng
+        self.values = list(weights)
+        self.cumulative = list(accumulate(weights.values()))
+
+    def __call__(self):
+        return self.values[bisect(self.cumulative, self.rng.random() * self.cumulative[-1])]
+
+
+class Geography:
+    """
+    City-shaped locations: most points are clustered around a city's hotspots
+    (neighbourhoods, markets), the rest spread over the whole city.
+    """
+
+    def __init__(self, rng, city_keys):
+        self.rng = rng
+        self.cities = [CITIES[key] for key in city_keys]
+        self.choose_city = Chooser(rng, {index: city[3] for index, city in enumerate(self.cities)})
+        self.hotspots = []
+        for _, lat, lon, _, spread_km, count in self.cities:
+            self.hotspots.append([self._offset(lat, lon, spread_km * 0.5) for _ in range(count)])
+
+    def _offset(self, lat, lon, sigma_km):
+        return (
+            lat + self.rng.gauss(0, sigma_km) / 111.0,
+            lon + self.rng.gauss(0, sigma_km) / (111.0 * cos(radians(lat))),
+        )
+
+    def point(self, city):
+        _, lat, lon, _, spread_km, _ = self.cities[city]
+        if self.rng.random() < 0.8:
+            lat, lon = self.rng.choice(self.hotspots[city])
+            return self._offset(lat, lon, spread_km * 0.15)
+        return self._offset(lat, lon, spread_km)
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a large synthetic dataset (users, providers, bookings, payments, '
+        'ratings, chat messages) for scale testing. Deterministic for a given seed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', choices=list(PROFILES), default='small')
+        parser.add_argument('--customers', type=int, help='Override the profile')
+        parser.add_argument('--providers', type=int, help='Override the profile')
+        parser.add_argument('--bookings', type=int, help='Override the profile')
+        parser.add_argument('--days', type=int, help='Period the bookings are spread over')
+        parser.add_argument('--messages-per-booking', type=float, default=3, help='Average chat messages per booking')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='seed-', help='Username prefix of the generated users')
+        parser.add_argument('--reset', action='store_true', help='Delete users with the prefix (and their bookings) first')
+        parser.add_argument('--skip-derived', action='store_true', help='Do not rebuild the heatmap and rollups')
+
+    def progress(self, label, done, total, started):
+        elapsed = time.monotonic() - started
+        rate = done / elapsed if elapsed else 0
+        self.stdout.write(f"  {label}: {done}/{total} ({rate:,.0f} rows/s)")
+
+    # --- Catalog and users ---
+
+    def create_catalog(self):
+        services = {}
+        for category_name, entries in CATALOG.items():
+            category, _ = ServiceCategory.objects.get_or_create(name=category_name)
+            for name, price in entries:
+                service, _ = Service.objects.get_or_create(
+                    category=category, name=name,
+                    defaults={'description': f'{name} by a verified professional', 'estimated_base_price': price},
+                )
+                services[service.id] = service.estimated_base_price
+        return services
+
+    def create_users(self, user_type, count, options, rng, start, end):
+        """
+        Bulk-create `count` users and return their ids (in creation order).
+        """
+        prefix = options['prefix']
+        letter = user_type[0].lower()
+        password = make_password('seed-password')
+        span = (end - start).total_seconds()
+        ids = array('q')
+        started = time.monotonic()
+        batch_size = options['batch_size']
+        for offset in range(0, count, batch_size):
+            users = []
+            for i in range(offset, min(offset + batch_size, count)):
+                username = f'{prefix}{letter}{i}'
+                users.append(User(
+                    username=username,
+                    email=f'{username}@example.com',
+                    password=password,
+                    first_name=f'{user_type.title()}',
+                    last_name=str(i),
+                    user_type=user_type,
+                    # Unique per user type, customers and providers use different ranges
+                    phone_number=f"255{'7' if user_type == 'CUSTOMER' else '6'}{options['seed'] % 10}{i:08d}",
+                    date_joined=start + timedelta(seconds=rng.random() * span),
+                ))
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+            if users[0].pk is None:
+                # Backends that cannot return ids from a bulk insert
+                usernames = [user.username for user in users]
+                pks = dict(User.objects.filter(username__in=usernames).values_list('username', 'pk'))
+                ids.extend(pks[username] for username in usernames)
+            else:
+                ids.extend(user.pk for user in users)
+            self.progress(f'{user_type.lower()}s', len(ids), count, started)
+        return ids
+
+    def create_profiles(self, provider_ids, services, geography, rng, options):
+        """
+        Create the provider profiles and return {(city, service_id): [provider ids]}.
+        """
+        choose_service = Chooser(rng, {service_id: 1 for service_id in services})
+        by_area = {}
+        batch_size = options['batch_size']
+        started = time.monotonic()
+        for offset in range(0, len(provider_ids), batch_size):
+            profiles = []
+            for user_id in provider_ids[offset:offset + batch_size]:
+                city = geography.choose_city()
+                service_id = choose_service()
+                verified = rng.random() < 0.85
+                latitude, longitude = geography.point(city)
+                profiles.append(ServiceProviderProfile(
+                    user_id=user_id,
+                    service_offered_id=service_id,
+                    service_price=(services[service_id] * Decimal(rng.uniform(0.8, 1.3))).quantize(Decimal('1')),
+                    bio='Experienced and reliable.',
+                    is_verified=verified,
+                    on_duty=verified and rng.random() < 0.3,
+                    last_known_latitude=latitude,
+                    last_known_longitude=longitude,
+                ))
+                if verified:
+                    by_area.setdefault((city, service_id), []).append(user_id)
+            with transaction.atomic():
+                ServiceProviderProfile.objects.bulk_create(profiles)
+            self.progress('provider profiles', offset + len(profiles), len(provider_ids), started)
+        return by_area
+
+    # --- Bookings and what hangs off them ---
+
+    def create_bookings(self, customer_ids, by_area, services, geography, rng, options, end):
+        total, days = options['bookings'], options['days']
+        customer_cities = bytearray(geography.choose_city() for _ in customer_ids)
+        # Services with providers, per city
+        area_services = {}
+        for city, service_id in by_area:
+            area_services.setdefault(city, []).append(service_id)
+        if not area_services:
+            raise CommandError('No verified providers were generated, increase --providers.')
+
+        choose_status = Chooser(rng, STATUS_WEIGHTS)
+        choose_hour = Chooser(rng, dict(enumerate(HOUR_WEIGHTS)))
+        choose_score = Chooser(rng, SCORE_WEIGHTS)
+        day_start = (end - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+        batch_size = options['batch_size']
+        max_messages = max(0, round(options['messages_per_booking'] * 2))
+        counts = {'bookings': 0, 'payments': 0, 'ratings': 0, 'messages': 0}
+        started = time.monotonic()
+
+        for offset in range(0, total, batch_size):
+            bookings, payments, ratings, messages = [], [], [], []
+            for _ in range(min(batch_size, total - offset)):
+                index = rng.randrange(len(customer_ids))
+                customer_id = customer_ids[index]
+                city = customer_cities[index]
+                if city not in area_services:
+                    city = rng.choice(list(area_services))
+                service_id = rng.choice(area_services[city])
+                provider_id = rng.choice(by_area[(city, service_id)])
+                status = choose_status()
+                if status in OPEN_STATUSES:
+                    created_at = end - timedelta(seconds=rng.uniform(60, 2 * 3600))
+                else:
+                    created_at = day_start + timedelta(
+                        days=rng.randrange(days), hours=choose_hour(), seconds=rng.uniform(0, 3600)
+                    )
+                    if created_at >= end:
+                        created_at = end - timedelta(seconds=rng.uniform(3 * 3600, 48 * 3600))
+                accepted_at = completed_at = final_price = None
+                if status in ('ACCEPTED', 'IN_PROGRESS', 'COMPLETED'):
+                    accepted_at = created_at + timedelta(seconds=rng.uniform(30, 600))
+                if status == 'COMPLETED':
+                    completed_at = accepted_at + timedelta(seconds=rng.uniform(1800, 4 * 3600))
+                    final_price = services[service_id]
+                latitude, longitude = geography.point(city)
+                booking_id = uuid.UUID(int=rng.getrandbits(128), version=4)
+                bookings.append(Booking(
+                    id=booking_id, customer_id=customer_id, provider_id=provider_id, service_id=service_id,
+                    status=status, booking_latitude=latitude, booking_longitude=longitude,
+                    final_price=final_price, created_at=created_at,
+                    accepted_at=accepted_at, completed_at=completed_at,
+                ))
+
+                if status == 'COMPLETED':
+                    paid_at = completed_at + timedelta(seconds=rng.uniform(60, 1800))
+                    mpesa = rng.random() < MPESA_SHARE
+                    attempts = ['FAILED', 'SUCCESS'] if rng.random() < FAILED_PAYMENT_SHARE else ['SUCCESS']
+                    for attempt in attempts:
+                        payments.append(Payment(
+                            id=uuid.UUID(int=rng.getrandbits(128), version=4), booking_id=booking_id,
+                            amount=final_price, payment_method='M-PESA' if mpesa else 'CASH', status=attempt,
+                            external_transaction_id=f'ws_CO_{rng.getrandbits(64):016x}' if mpesa else None,
+                            created_at=paid_at, updated_at=paid_at + timedelta(seconds=rng.uniform(5, 60)),
+                        ))
+                    if rng.random() < RATING_SHARE:
+                        ratings.append(Rating(
+                            booking_id=booking_id, rater_id=customer_id, ratee_id=provider_id,
+                            score=choose_score(), comment='', created_at=paid_at,
+                        ))
+
+                if accepted_at is not None and max_messages:
+                    sent_at = accepted_at
+                    for number in range(rng.randint(0, max_messages)):
+                        sent_at += timedelta(seconds=rng.uniform(10, 300))
+                        messages.append(ChatMessage(
+                            booking_id=booking_id, sender_id=customer_id if number % 2 == 0 else provider_id,
+                            message=rng.choice(MESSAGES), timestamp=sent_at,
+                        ))
+
+            with transaction.atomic():
+                Booking.objects.bulk_create(bookings)
+                Payment.objects.bulk_create(payments)
+                Rating.objects.bulk_create(ratings)
+                ChatMessage.objects.bulk_create(messages)
+            counts['bookings'] += len(bookings)
+            counts['payments'] += len(payments)
+            counts['ratings'] += len(ratings)
+            counts['messages'] += len(messages)
+            self.progress('bookings', counts['bookings'], total, started)
+        return counts
+
+    def update_average_ratings(self, prefix):
+        average = Rating.objects.filter(ratee_id=OuterRef('user_id')).values('ratee_id').annotate(
+            average=Avg('score')
+        ).values('average')
+        ServiceProviderProfile.objects.filter(user__username__startswith=prefix).update(
+            average_rating=Coalesce(Subquery(average), Value(0.0))
+        )
+
+    def reset(self, prefix):
+        users = User.objects.filter(username__startswith=prefix)
+        with transaction.atomic():
+            Booking.objects.filter(customer__in=users).delete()
+            deleted, _ = users.delete()
+        return deleted
+
+    def handle(self, *args, **options):
+        profile = PROFILES[options['profile']]
+        for key in ('customers', 'providers', 'bookings', 'days'):
+            if options[key] is None:
+                options[key] = profile[key]
+        if options['customers'] < 1 or options['providers'] < 1:
+            raise CommandError('At least one customer and one provider are needed.')
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            if not options['reset']:
+                raise CommandError(f"Users with the prefix '{prefix}' exist, use --reset or another --prefix.")
+            self.stdout.write(f"Deleted {self.reset(prefix)} rows of a previous run")
+
+        rng = Random(options['seed'])
+        geography = Geography(rng, profile['cities'])
+        end = timezone.now()
+        start = end - timedelta(days=options['days'])
+        started = time.monotonic()
+        self.stdout.write(
+            f"Profile {options['profile']}: {options['customers']} customers, {options['providers']} providers, "
+            f"{options['bookings']} bookings over {options['days']} days"
+        )
+
+        services = self.create_catalog()
+        customer_ids = self.create_users('CUSTOMER', options['customers'], options, rng, start, end)
+        provider_ids = self.create_users('PROVIDER', options['providers'], options, rng, start, end)
+        by_area = self.create_profiles(provider_ids, services, geography, rng, options)
+        with explicit_timestamps():
+            counts = self.create_bookings(customer_ids, by_area, services, geography, rng, options, end)
+        self.update_average_ratings(prefix)
+
+        if not options['skip_derived']:
+            self.stdout.write('Rebuilding the heatmap and rollups...')
+            heatmap.rebuild()
+            rollups.rebuild(start - timedelta(days=1), end + timedelta(hours=1))
+
+        rows = len(customer_ids) + 2 * len(provider_ids) + sum(counts.values())
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Bookings {counts['bookings']}, payments {counts['payments']}, "
+            f"ratings {counts['ratings']}, chat messages {counts['messages']}"
+        )
+        self.stdout.write(self.style.SUCCESS(f'Generated {rows} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)'))
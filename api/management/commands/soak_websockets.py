@@ -0,0 +1,101 @@
+import asyncio
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.backpressure import outbound_stats
+from api.connection_context import ConnectionContext
+from api.consumers import ChatConsumer, LocationConsumer
+from api.location_codec import LocationEncoder
+
+
+def make_sender(delay, counters):
+    """
+    Stand-in for the server's ASGI send: a slow client takes `delay` seconds to
+    drain every frame.
+    """
+    async def send(message):
+        if message['type'] == 'websocket.close':
+            counters['closed'] += 1
+            return
+        counters['sent'] += 1
+        if delay:
+            await asyncio.sleep(delay)
+    return send
+
+
+class Command(BaseCommand):
+    help = 'Soak the websocket consumers with many connections, some of them slow, and watch memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=10000)
+        parser.add_argument('--slow-fraction', type=float, default=0.1)
+        parser.add_argument('--slow-delay', type=float, default=2.0, help='Seconds a slow client takes per frame')
+        parser.add_argument('--duration', type=int, default=20, help='Seconds to run')
+        parser.add_argument('--rate', type=int, default=1, help='Events per connection per second')
+        parser.add_argument('--unbounded', action='store_true', help='Disable the queue bounds, for comparison')
+
+    def build(self, options, counters):
+        rng = random.Random(1)
+        # The customer's side of an in-progress booking
+        context = ConnectionContext(1, 'customer', 'CUSTOMER', 'soak', 1, 2, 'IN_PROGRESS', (-6.79, 39.2))
+        location_class, chat_class = LocationConsumer, ChatConsumer
+        if options['unbounded']:
+            location_class = type('UnboundedLocationConsumer', (LocationConsumer,), {'outbound_maxsize': 0})
+            chat_class = type('UnboundedChatConsumer', (ChatConsumer,), {'outbound_maxsize': 0})
+
+        consumers = []
+        for i in range(options['connections']):
+            slow = rng.random() < options['slow_fraction']
+            # Half of the connections follow a location stream, half a chat
+            consumer = location_class() if i % 2 == 0 else chat_class()
+            consumer.scope = {'type': 'websocket'}
+            consumer.context = context
+            consumer.binary = False
+            consumer.encoder = LocationEncoder()
+            consumer.base_send = make_sender(options['slow_delay'] if slow else 0, counters)
+            consumer.start_outbound()
+            consumers.append(consumer)
+        return consumers
+
+    async def soak(self, options):
+        counters = {'sent': 0, 'closed': 0}
+        consumers = self.build(options, counters)
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        samples = []
+        start = time.monotonic()
+        for second in range(options['duration']):
+            # `rate` location fixes or chat messages per connection per second
+            for consumer in consumers * options['rate']:
+                if isinstance(consumer, LocationConsumer):
+                    await consumer.location_update({'type': 'location_update', 'latitude': -6.79, 'longitude': 39.2})
+                else:
+                    await consumer.chat_message({
+                        'type': 'chat_message', 'message': 'x' * 100, 'sender': 'provider',
+                        'timestamp': timezone.now().isoformat(),
+                    })
+            await asyncio.sleep(max(0, start + second + 1 - time.monotonic()))
+            memory = tracemalloc.get_traced_memory()[0] - baseline
+            stats = outbound_stats()
+            samples.append(memory)
+            depth = sum(entry['depth'] for entry in stats.values())
+            self.stdout.write(
+                f"t={second + 1:>3}s  memory {memory / 2**20:7.2f} MiB  queued {depth:>8}  "
+                f"sent {counters['sent']:>9}  closed {counters['closed']:>6}"
+            )
+        tracemalloc.stop()
+        for consumer in consumers:
+            await consumer.stop_outbound()
+        return samples
+
+    def handle(self, *args, **options):
+        samples = asyncio.run(self.soak(options))
+        for name, entry in outbound_stats().items():
+            self.stdout.write(f"{name}: dropped {entry['dropped']}, disconnected {entry['overflowed']}")
+        half = len(samples) // 2
+        growth = samples[-1] - samples[half]
+        self.stdout.write(f"Memory growth over the second half: {growth / 2**20:.2f} MiB")
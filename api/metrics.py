@@ -0,0 +1,411 @@
+# In api/metrics.py
+"""
+In-process metrics registry, exposed in the Prometheus text format at /metrics.
+
+Metrics are per process: every worker serves its own values and the scraper
+adds them up. Recording is a dict lookup and a few additions under an
+uncontended lock, cheap enough to leave on in production:
+
+- MetricsMiddleware: latency and query count of every request, per DRF view
+  and action
+- matching duration and candidate-set size (BookingSerializer.create)
+- M-Pesa call latency and errors (api/mpesa_service.py)
+- channel layer group_send latency (the websocket consumers)
+- open websocket connections and outbound queues, read from
+  api/backpressure.py when scraped
+"""
+import bisect
+import hmac
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .backpressure import outbound_stats
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from a cache hit to a slow external call
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """
+        The child for these label values (positional, in labelnames order).
+        """
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f'{self.name} takes labels {self.labelnames}, got {values}')
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def clear(self):
+        with self._lock:
+            self._children.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labelnames, key):
+        return [f'{name}{_format_labels(labelnames, key)} {_format_value(self.value)}']
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Per bucket, made cumulative when rendered; the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def render(self, name, labelnames, key):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket_count
+            le = 'le="' + _format_value(bound if bound == math.inf else float(bound)) + '"'
+            lines.append(f'{name}_bucket{_format_labels(labelnames, key, le)} {cumulative}')
+        labels = _format_labels(labelnames, key)
+        lines.append(f'{name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{name}_count{labels} {count}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def register_collector(self, collector):
+        """
+        `collector()` is called on every scrape and returns Gauge/Counter
+        objects filled with the values of that moment.
+        """
+        self.collectors.append(collector)
+        return collector
+
+    def clear(self):
+        for metric in self.metrics.values():
+            metric.clear()
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for metric in collector():
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    'quickassist_http_request_duration_seconds', 'HTTP request latency per view and action.',
+    ('view', 'action'),
+))
+REQUEST_QUERIES = REGISTRY.register(Histogram(
+    'quickassist_http_request_queries', 'Database queries per HTTP request, per view and action.',
+    ('view', 'action'), buckets=COUNT_BUCKETS,
+))
+REQUESTS = REGISTRY.register(Counter(
+    'quickassist_http_requests_total', 'HTTP responses per view, action and status code.',
+    ('view', 'action', 'status'),
+))
+MATCHING_DURATION = REGISTRY.register(Histogram(
+    'quickassist_matching_duration_seconds', 'Time to pick a provider for a new booking, per outcome.',
+    ('outcome',),
+))
+MATCHING_CANDIDATES = REGISTRY.register(Histogram(
+    'quickassist_matching_candidates', 'Providers considered when matching a new booking.',
+    buckets=COUNT_BUCKETS,
+))
+MPESA_DURATION = REGISTRY.register(Histogram(
+    'quickassist_mpesa_request_duration_seconds', 'M-Pesa API call latency per operation.',
+    ('operation',),
+))
+MPESA_REQUESTS = REGISTRY.register(Counter(
+    'quickassist_mpesa_requests_total', 'M-Pesa API calls per operation and outcome (ok or error).',
+    ('operation', 'outcome'),
+))
+CHANNEL_SEND_DURATION = REGISTRY.register(Histogram(
+    'quickassist_channel_layer_send_duration_seconds', 'Channel layer group_send latency per consumer.',
+    ('consumer',),
+))
+
+
+@REGISTRY.register_collector
+def _websocket_metrics():
+    connections_gauge = Gauge('quickassist_websocket_connections', 'Open websocket connections per consumer.', ('consumer',))
+    depth = Gauge('quickassist_websocket_outbound_depth', 'Items queued for the clients, per consumer.', ('consumer',))
+    max_depth = Gauge('quickassist_websocket_outbound_max_depth', 'Deepest outbound queue, per consumer.', ('consumer',))
+    dropped = Counter('quickassist_websocket_outbound_dropped_total', 'Items dropped for slow clients, per consumer.', ('consumer',))
+    overflowed = Counter(
+        'quickassist_websocket_outbound_overflowed_total', 'Connections closed for falling behind, per consumer.', ('consumer',),
+    )
+    for consumer, entry in outbound_stats().items():
+        connections_gauge.labels(consumer).set(entry['connections'])
+        depth.labels(consumer).set(entry['depth'])
+        max_depth.labels(consumer).set(entry['max_depth'])
+        dropped.labels(consumer).inc(entry['dropped'])
+        overflowed.labels(consumer).inc(entry['overflowed'])
+    return [connections_gauge, depth, max_depth, dropped, overflowed]
+
+
+@contextmanager
+def mpesa_call(operation):
+    """
+    Time an M-Pesa API call and count it as an error if the block raises.
+    """
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        MPESA_DURATION.labels(operation).observe(time.perf_counter() - started)
+        MPESA_REQUESTS.labels(operation, outcome).inc()
+
+
+async def group_send(consumer, group, message):
+    """
+    consumer.channel_layer.group_send, timed per consumer class.
+    """
+    started = time.perf_counter()
+    try:
+        await consumer.channel_layer.group_send(group, message)
+    finally:
+        CHANNEL_SEND_DURATION.labels(type(consumer).__name__).observe(time.perf_counter() - started)
+
+
+class _QueryCounter:
+    __slots__ = ('count',)
+
+    def __init__(self):
+        self.count = 0
+
+
+# The counter of the request in progress; contexts are copied into the threads
+# running its sync code, so queries made through sync_to_async count as well
+_request_queries = ContextVar('request_queries', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _request_queries.get()
+    if counter is not None:
+        counter.count += 1
+    return execute(sql, params, many, context)
+
+
+def _install_query_hook(sender, connection, **kwargs):
+    # Permanent, and a single ContextVar lookup per query outside of a request
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(_install_query_hook, dispatch_uid='api.metrics')
+
+
+def view_labels(view_func, method):
+    """
+    ('BookingViewSet', 'accept_booking') for DRF views and viewsets, the
+    function name and the HTTP method for plain Django views.
+    """
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    name = view_class.__name__ if view_class else getattr(view_func, '__name__', 'unknown')
+    actions = getattr(view_func, 'actions', None)
+    return name, (actions or {}).get(method.lower(), method.lower())
+
+
+def request_view_labels(request):
+    """
+    view_labels() of the view a request resolved to, ('unresolved', method) otherwise.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved', request.method.lower()
+    return view_labels(match.func, request.method)
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, query count and status of every request. Place it
+    first in MIDDLEWARE so the time spent in the other middleware counts too.
+    Requests that resolve to no view are labelled 'unresolved'. Works in both
+    sync and async mode.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.METRICS_ENABLED
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        counter = _QueryCounter()
+        reset = _request_queries.set(counter)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_queries.reset(reset)
+        self._record(request, response, time.perf_counter() - started, counter)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        counter = _QueryCounter()
+        reset = _request_queries.set(counter)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(reset)
+        self._record(request, response, time.perf_counter() - started, counter)
+        return response
+
+    @staticmethod
+    def _record(request, response, elapsed, counter):
+        view, action = request_view_labels(request)
+        REQUEST_DURATION.labels(view, action).observe(elapsed)
+        REQUEST_QUERIES.labels(view, action).observe(counter.count)
+        REQUESTS.labels(view, action, response.status_code).inc()
+
+
+def metrics_view(request):
+    """
+    The scrape endpoint. When METRICS_TOKEN is set, scrapers must send it as
+    `Authorization: Bearer <token>`. Only dev runs without it: the prod
+    settings refuse to start with metrics enabled and no token.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(supplied.encode(), token.encode()):
+            return HttpResponseForbidden()
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
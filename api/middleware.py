@@ -0,0 +1,98 @@
+# In api/middleware.py
+import time
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError, AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .user_state import aget_user_state, user_from_state
+from .utils import TTLCache
+
+# Subprotocol a browser client can use to pass its token, e.g.
+# new WebSocket(url, ['access_token', token]). The server echoes it back on accept.
+TOKEN_SUBPROTOCOL = 'access_token'
+
+# Decoded claims keyed by raw token, kept until the token expires. A reconnect
+# storm replays the same tokens, so each one is verified only once per process.
+_claims_cache = TTLCache(max_entries=50000)
+
+
+def get_raw_token(scope):
+    """
+    Extract the JWT from the `token` query string parameter or from the
+    ['access_token', <token>] subprotocol pair.
+    """
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if query.get('token'):
+        return query['token'][0], None
+
+    subprotocols = scope.get('subprotocols') or []
+    if TOKEN_SUBPROTOCOL in subprotocols:
+        index = subprotocols.index(TOKEN_SUBPROTOCOL)
+        if index + 1 < len(subprotocols):
+            return subprotocols[index + 1], TOKEN_SUBPROTOCOL
+    return None, None
+
+
+def decode_token(raw_token):
+    """
+    Verify a raw access token and return its claims, using the per-process cache.
+    Returns None for invalid or expired tokens.
+    """
+    claims = _claims_cache.get(raw_token)
+    if claims is not None:
+        return claims
+    try:
+        claims = AccessToken(raw_token).payload
+    except TokenError:
+        return None
+    _claims_cache.set(raw_token, claims, timeout=claims['exp'] - time.time())
+    return claims
+
+
+@database_sync_to_async
+def _lookup_user(claims):
+    # Only for tokens issued before the state claims existed
+    try:
+        return JWTAuthentication().get_user(claims)
+    except (AuthenticationFailed, InvalidToken):
+        return AnonymousUser()
+
+
+async def get_user_for_token(raw_token):
+    claims = decode_token(raw_token)
+    if claims is None or api_settings.USER_ID_CLAIM not in claims:
+        return AnonymousUser()
+
+    user_id = claims[api_settings.USER_ID_CLAIM]
+    state = await aget_user_state(user_id, claims)
+    if state is None:
+        return await _lookup_user(claims)
+    if api_settings.CHECK_USER_IS_ACTIVE and not state['is_active']:
+        return AnonymousUser()
+    return user_from_state(user_id, state)
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Populates scope['user'] from a JWT access token instead of the session.
+    Like StatelessJWTAuthentication, the user is rebuilt from the token claims,
+    so a handshake costs no database query.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        raw_token, subprotocol = get_raw_token(scope)
+        scope['user'] = await get_user_for_token(raw_token) if raw_token else AnonymousUser()
+        # Consumers must accept with the subprotocol the token came in, if any
+        scope['auth_subprotocol'] = subprotocol
+        return await super().__call__(scope, receive, send)
+
+
+def JWTAuthMiddlewareStack(inner):
+    return JWTAuthMiddleware(inner)
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-19 01:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_bookingrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serviceproviderprofile',
+            name='heatmap_cell',
+            field=models.CharField(blank=True, default='', max_length=12),
+        ),
+        migrations.CreateModel(
+            name='HeatmapCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell', models.CharField(max_length=12)),
+                ('providers', models.IntegerField(default=0)),
+                ('open_bookings', models.IntegerField(default=0)),
+                ('service', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='heatmap_cells', to='api.service')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cell', 'service'), name='unique_heatmap_cell')],
+            },
+        ),
+    ]
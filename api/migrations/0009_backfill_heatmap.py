@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.db import migrations
+
+from api import geohash
+
+OPEN_STATUSES = ('PENDING', 'ACCEPTED', 'IN_PROGRESS')
+
+
+def backfill_heatmap(apps, schema_editor):
+    """
+    Count the existing providers and open bookings, like heatmap.rebuild() with
+    the models as of this migration.
+    """
+    Booking = apps.get_model('api', 'Booking')
+    HeatmapCell = apps.get_model('api', 'HeatmapCell')
+    ServiceProviderProfile = apps.get_model('api', 'ServiceProviderProfile')
+
+    def cell_for(latitude, longitude):
+        return geohash.encode(latitude, longitude, settings.HEATMAP_PRECISION)
+
+    counts = {}
+    provider_cells = {}
+    profiles = ServiceProviderProfile.objects.filter(
+        on_duty=True, is_verified=True,
+        last_known_latitude__isnull=False, last_known_longitude__isnull=False,
+    ).values_list('pk', 'service_offered_id', 'last_known_latitude', 'last_known_longitude')
+    for pk, service_id, latitude, longitude in profiles.iterator(chunk_size=2000):
+        cell = cell_for(latitude, longitude)
+        counts.setdefault((cell, service_id), [0, 0])[0] += 1
+        provider_cells.setdefault(cell, []).append(pk)
+
+    bookings = Booking.objects.filter(status__in=OPEN_STATUSES).values_list(
+        'service_id', 'booking_latitude', 'booking_longitude'
+    )
+    for service_id, latitude, longitude in bookings.iterator(chunk_size=2000):
+        counts.setdefault((cell_for(latitude, longitude), service_id), [0, 0])[1] += 1
+
+    ServiceProviderProfile.objects.exclude(heatmap_cell='').update(heatmap_cell='')
+    for cell, pks in provider_cells.items():
+        ServiceProviderProfile.objects.filter(pk__in=pks).update(heatmap_cell=cell)
+    HeatmapCell.objects.all().delete()
+    HeatmapCell.objects.bulk_create([
+        HeatmapCell(cell=cell, service_id=service_id, providers=providers, open_bookings=open_bookings)
+        for (cell, service_id), (providers, open_bookings) in counts.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_heatmap'),
+    ]
+
+    operations = [
+        # 0008 drops the cells and heatmap_cell when reversed
+        migrations.RunPython(backfill_heatmap, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.3 on 2026-10-19 03:01
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def recount_duplicate_rows(apps, schema_editor):
+    """
+    Replace the duplicated rows without a service, whose counts were inflated by
+    every bump that updated all of them, with one row recounted from the bookings.
+    """
+    Booking = apps.get_model('api', 'Booking')
+    BookingRollup = apps.get_model('api', 'BookingRollup')
+    Payment = apps.get_model('api', 'Payment')
+
+    duplicated = BookingRollup.objects.filter(service__isnull=True).values('bucket', 'status').annotate(
+        rows=models.Count('id')
+    ).filter(rows__gt=1).order_by()
+    for key in list(duplicated):
+        bucket, status = key['bucket'], key['status']
+        hour = {'created_at__gte': bucket, 'created_at__lt': bucket + timedelta(hours=1)}
+        bookings = Booking.objects.filter(service__isnull=True, status=status, **hour)
+        revenue = Payment.objects.filter(status='SUCCESS', booking__in=bookings).aggregate(
+            total=models.Sum('amount')
+        )['total']
+        BookingRollup.objects.filter(service__isnull=True, bucket=bucket, status=status).delete()
+        BookingRollup.objects.create(
+            bucket=bucket, service=None, status=status, count=bookings.count(), revenue=revenue or 0,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_backfill_heatmap'),
+    ]
+
+    operations = [
+        migrations.RunPython(recount_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='bookingrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('service__isnull', True)), fields=('bucket', 'status'), name='unique_booking_rollup_no_service'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-19 03:04
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+
+def recount_if_duplicated(apps, schema_editor):
+    """
+    Duplicated cells without a service were all bumped by every change, the
+    counts cannot be repaired in place: recount the whole heatmap.
+    """
+    HeatmapCell = apps.get_model('api', 'HeatmapCell')
+    duplicated = HeatmapCell.objects.filter(service__isnull=True).values('cell').annotate(
+        rows=models.Count('id')
+    ).filter(rows__gt=1)
+    if duplicated.exists():
+        import_module('api.migrations.0009_backfill_heatmap').backfill_heatmap(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_rollup_no_service_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(recount_if_duplicated, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='heatmapcell',
+            constraint=models.UniqueConstraint(condition=models.Q(('service__isnull', True)), fields=('cell',), name='unique_heatmap_cell_no_service'),
+        ),
+    ]
@@ -34,6 +34,10 @@ class ServiceProviderProfile(models.Model):
     
     average_rating = models.FloatField(default=0.0)
 
+    # Geohash cell this provider is currently counted in by the supply/demand
+    # heatmap (api/heatmap.py), empty while not counted (off duty, no location)
+    heatmap_cell = models.CharField(max_length=12, blank=True, default='')
+
     def __str__(self):
         return f"Profile: {self.user.username}"
 
@@ -105,14 +109,6 @@ def create_provider_profile(sender, instance, created, **kwargs):
     if created and instance.user_type == 'PROVIDER':
         ServiceProviderProfile.objects.create(user=instance)
 
-@receiver(post_save, sender=User)
-def save_provider_profile(sender, instance, **kwargs):
-    if instance.user_type == 'PROVIDER':
-        # This handles saving the profile whenever the user object is saved
-        # in case you have logic that depends on it.
-        # For our current setup, the first signal is the most critical one.
-        instance.provider_profile.save()
-
 
 class Payment(models.Model):
     PAYMENT_METHOD_CHOICES = (
@@ -152,4 +148,54 @@ class ChatMessage(models.Model):
         return f'Message from {self.sender} on {self.timestamp.strftime("%Y-%m-%d %H:%M")}'
 
     class Meta:
-        ordering = ['timestamp']
\ No newline at end of file
+        ordering = ['timestamp']
+
+# --- Analytics Rollups ---
+class BookingRollup(models.Model):
+    """
+    Pre-aggregated booking counts and collected revenue per hour (of booking
+    creation), service and current status. Kept up to date by api/rollups.py and
+    rebuilt with `manage.py rebuild_rollups`.
+    """
+    bucket = models.DateTimeField()
+    service = models.ForeignKey(Service, on_delete=models.SET_NULL, null=True, blank=True, related_name='rollups')
+    status = models.CharField(max_length=20, choices=Booking.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'service', 'status'], name='unique_booking_rollup'),
+            # NULLs never collide above, so the rows of bookings without a service get their own key
+            models.UniqueConstraint(
+                fields=['bucket', 'status'], condition=models.Q(service__isnull=True),
+                name='unique_booking_rollup_no_service',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.bucket:%Y-%m-%d %H:00} {self.service_id} {self.status}: {self.count}"
+
+
+class HeatmapCell(models.Model):
+    """
+    Live supply and demand per geohash cell and service: on-duty providers
+    located in the cell and open bookings placed in it. Maintained by
+    api/heatmap.py and rebuilt with `manage.py rebuild_heatmap`.
+    """
+    cell = models.CharField(max_length=12)
+    service = models.ForeignKey(Service, on_delete=models.SET_NULL, null=True, blank=True, related_name='heatmap_cells')
+    providers = models.IntegerField(default=0)
+    open_bookings = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cell', 'service'], name='unique_heatmap_cell'),
+            # NULLs never collide above, so the cells of providers and bookings without a service get their own key
+            models.UniqueConstraint(
+                fields=['cell'], condition=models.Q(service__isnull=True), name='unique_heatmap_cell_no_service',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.cell} {self.service_id}: {self.providers} providers / {self.open_bookings} open"
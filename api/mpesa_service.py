@@ -7,6 +7,8 @@ import os
 
 from django.conf import settings 
 
+from .metrics import mpesa_call
+
 def get_mpesa_access_token():
     """
     Get access token from M-Pesa Daraja API.
@@ -17,16 +19,17 @@ def get_mpesa_access_token():
     if not consumer_key or not consumer_secret:
         raise Exception("M-Pesa credentials not configured.")
         
-    api_url = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
+    api_url = f"{settings.MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
     
     # The credentials need to be Base64 encoded
     credentials = base64.b64encode(f"{consumer_key}:{consumer_secret}".encode()).decode()
     headers = {"Authorization": f"Basic {credentials}"}
     
     try:
-        response = requests.get(api_url, headers=headers)
-        response.raise_for_status() # Raise an exception for bad status codes
-        return response.json().get("access_token")
+        with mpesa_call('oauth'):
+            response = requests.get(api_url, headers=headers)
+            response.raise_for_status() # Raise an exception for bad status codes
+            return response.json().get("access_token")
     except requests.exceptions.RequestException as e:
         # Handle exceptions like connection errors, timeouts, etc.
         raise Exception(f"Failed to get M-Pesa token: {e}")
@@ -39,7 +42,7 @@ def initiate_stk_push(phone_number, amount, account_reference, transaction_desc,
     if not access_token:
         raise Exception("Cannot initiate STK push without access token.")
 
-    api_url = "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
+    api_url = f"{settings.MPESA_BASE_URL}/mpesa/stkpush/v1/processrequest"
     headers = {"Authorization": f"Bearer {access_token}"}
     
     # Format phone number to Safaricom's standard (e.g., 254712345678)
@@ -73,8 +76,9 @@ def initiate_stk_push(phone_number, amount, account_reference, transaction_desc,
     }
     
     try:
-        response = requests.post(api_url, json=payload, headers=headers)
-        response.raise_for_status()
-        return response.json()
+        with mpesa_call('stk_push'):
+            response = requests.post(api_url, json=payload, headers=headers)
+            response.raise_for_status()
+            return response.json()
     except requests.exceptions.RequestException as e:
         raise Exception(f"Failed to initiate STK push: {e}")
\ No newline at end of file
@@ -0,0 +1,393 @@
+# In api/profiling.py
+"""
+On-demand profiling of single requests and socket messages in production.
+
+A request is profiled when it carries a valid X-Profile header (a signed token
+an admin gets from POST /api/admin/profiles/token/), or at random with
+probability PROFILING_SAMPLE_RATE. Socket messages are profiled the same way:
+every message of a connection whose handshake carried the header, or a random
+sample of the others.
+
+Each profile holds the SQL executed with timings, plus either:
+- 'sampling' (the default): the stacks of the handling thread, sampled every
+  PROFILING_INTERVAL_MS by a background thread, in collapsed (flame graph)
+  form. Cheap enough for live traffic. For sockets the thread is the event
+  loop, so other connections' work can show up in the stacks.
+- 'cprofile': cProfile's function statistics. Exact, but slows the profiled
+  request down several times.
+
+Profiles are kept in a per-process ring buffer of PROFILING_BUFFER_SIZE entries
+served by the admin-only /api/admin/profiles/ endpoints.
+"""
+import cProfile
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core import signing
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+from .metrics import request_view_labels
+
+PROFILE_HEADER = 'X-Profile'
+MODES = ('sampling', 'cprofile')
+
+# Per profile, to bound the memory of the ring buffer
+MAX_QUERIES = 500
+MAX_STACKS = 100
+MAX_FUNCTIONS = 50
+MAX_STACK_DEPTH = 64
+
+_TOKEN_SALT = 'api.profiling'
+
+# A mutable slot shared by the tasks and threads serving one request or
+# connection (contexts are copied into them), holding the capture in progress
+_current = ContextVar('profile_slot', default=None)
+
+# Threads with an enabled cProfile profiler, only one can run per thread
+_cprofile_threads = set()
+_cprofile_lock = threading.Lock()
+
+
+class _Slot:
+    __slots__ = ('capture',)
+
+    def __init__(self, capture=None):
+        self.capture = capture
+
+
+# --- Tokens ---
+
+def issue_token(mode=None):
+    """
+    A signed X-Profile header value, valid for PROFILING_TOKEN_MAX_AGE seconds.
+    """
+    return signing.dumps({'mode': mode or settings.PROFILING_MODE}, salt=_TOKEN_SALT)
+
+
+def requested_mode(token):
+    """
+    The mode a signed X-Profile token asks for, None when it is missing,
+    expired or tampered with.
+    """
+    if not token:
+        return None
+    try:
+        payload = signing.loads(token, salt=_TOKEN_SALT, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    mode = payload.get('mode') if isinstance(payload, dict) else None
+    return mode if mode in MODES else None
+
+
+def sampled_mode():
+    rate = settings.PROFILING_SAMPLE_RATE
+    if rate and random.random() < rate:
+        return settings.PROFILING_MODE
+    return None
+
+
+# --- Ring buffer ---
+
+class ProfileStore:
+    def __init__(self, size):
+        self._profiles = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def get(self, profile_id):
+        with self._lock:
+            return next((profile for profile in self._profiles if profile['id'] == profile_id), None)
+
+    def summaries(self):
+        """
+        Newest first, without the stacks and the SQL.
+        """
+        with self._lock:
+            profiles = list(self._profiles)
+        return [
+            {key: value for key, value in profile.items() if key not in ('stacks', 'functions', 'queries')}
+            for profile in reversed(profiles)
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = ProfileStore(settings.PROFILING_BUFFER_SIZE)
+    return _store
+
+
+# --- SQL ---
+
+def _record_query(execute, sql, params, many, context):
+    slot = _current.get()
+    capture = slot.capture if slot is not None else None
+    if capture is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        capture.add_query(context['connection'].alias, sql, time.perf_counter() - started)
+
+
+def _install_query_hook(sender, connection, **kwargs):
+    # Permanent, and a single ContextVar lookup per query outside of a capture
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+connection_created.connect(_install_query_hook, dispatch_uid='api.profiling')
+
+
+# --- Stacks ---
+
+def _collapse(frame):
+    parts = []
+    while frame is not None and len(parts) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        parts.append(f'{code.co_filename}:{code.co_name}:{frame.f_lineno}')
+        frame = frame.f_back
+    return ';'.join(reversed(parts))
+
+
+class _StackSampler(threading.Thread):
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class Capture:
+    """
+    One profile in progress. start() and stop() must run on the thread doing
+    the work; stop() stores the profile and returns it.
+    """
+
+    def __init__(self, mode, kind, target, method=''):
+        self.mode = mode
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.target = target
+        self.method = method
+        self.view = ''
+        self.action = ''
+        self.status = None
+        self.queries = []
+        self.queries_dropped = 0
+        self._profiler = None
+        self._sampler = None
+
+    def start(self):
+        self.started_at = timezone.now()
+        thread_id = threading.get_ident()
+        if self.mode == 'cprofile':
+            with _cprofile_lock:
+                # Another capture is profiling this thread (concurrent socket messages)
+                if thread_id in _cprofile_threads:
+                    self.mode = 'sampling'
+                else:
+                    _cprofile_threads.add(thread_id)
+        if self.mode == 'cprofile':
+            self._thread_id = thread_id
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._sampler = _StackSampler(thread_id, settings.PROFILING_INTERVAL_MS / 1000)
+            self._sampler.start()
+        self._started = time.perf_counter()
+        return self
+
+    def add_query(self, alias, sql, seconds):
+        if len(self.queries) >= MAX_QUERIES:
+            self.queries_dropped += 1
+            return
+        self.queries.append({'alias': alias, 'sql': sql, 'ms': round(seconds * 1000, 3)})
+
+    def stop(self):
+        duration = time.perf_counter() - self._started
+        profile = {
+            'id': self.id,
+            'kind': self.kind,
+            'target': self.target,
+            'method': self.method,
+            'view': self.view,
+            'action': self.action,
+            'status': self.status,
+            'mode': self.mode,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round(duration * 1000, 3),
+            'query_count': len(self.queries) + self.queries_dropped,
+            'query_ms': round(sum(query['ms'] for query in self.queries), 3),
+            'queries': self.queries,
+        }
+        if self._profiler is not None:
+            self._profiler.disable()
+            with _cprofile_lock:
+                _cprofile_threads.discard(self._thread_id)
+            profile['functions'] = self._function_stats()
+        else:
+            self._sampler.stop()
+            profile['samples'] = sum(self._sampler.stacks.values())
+            profile['stacks'] = [
+                {'stack': stack, 'count': count} for stack, count in self._sampler.stacks.most_common(MAX_STACKS)
+            ]
+        get_store().add(profile)
+        return profile
+
+    def _function_stats(self):
+        stats = pstats.Stats(self._profiler).stats
+        rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:MAX_FUNCTIONS]
+        return [
+            {
+                'function': f'{filename}:{line}({name})',
+                'calls': calls,
+                'total_ms': round(total * 1000, 3),
+                'cumulative_ms': round(cumulative * 1000, 3),
+            }
+            for (filename, line, name), (_, calls, total, cumulative, _) in rows
+        ]
+
+
+# --- HTTP ---
+
+class ProfilingMiddleware:
+    """
+    Profiles sampled and X-Profile requests, and returns the profile id in the
+    X-Profile-Id response header. Streaming bodies are produced after the
+    profile ends and are not part of it. Works in both sync and async mode; the
+    sampler follows the thread the middleware runs on, so in async mode work
+    handed to other threads shows up in the SQL but not in the stacks.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        capture = self._capture(request)
+        if capture is None:
+            return self.get_response(request)
+
+        reset = _current.set(_Slot(capture))
+        response = None
+        try:
+            capture.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                self._finish(capture, request, response)
+        finally:
+            _current.reset(reset)
+        response['X-Profile-Id'] = capture.id
+        return response
+
+    async def __acall__(self, request):
+        capture = self._capture(request)
+        if capture is None:
+            return await self.get_response(request)
+
+        reset = _current.set(_Slot(capture))
+        response = None
+        try:
+            capture.start()
+            try:
+                response = await self.get_response(request)
+            finally:
+                self._finish(capture, request, response)
+        finally:
+            _current.reset(reset)
+        response['X-Profile-Id'] = capture.id
+        return response
+
+    @staticmethod
+    def _capture(request):
+        mode = requested_mode(request.headers.get(PROFILE_HEADER)) or sampled_mode()
+        if mode is None:
+            return None
+        return Capture(mode, 'http', request.path, request.method)
+
+    @staticmethod
+    def _finish(capture, request, response):
+        capture.status = response.status_code if response is not None else None
+        if getattr(request, 'resolver_match', None) is not None:
+            capture.view, capture.action = request_view_labels(request)
+        capture.stop()
+
+
+# --- Sockets ---
+
+class SocketProfiler:
+    """
+    ASGI wrapper for a websocket consumer application. A message is profiled
+    from the moment the consumer receives it until it asks for the next one.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        consumer_class = getattr(inner, 'consumer_class', None)
+        self.view = consumer_class.__name__ if consumer_class else type(inner).__name__
+
+    async def __call__(self, scope, receive, send):
+        headers = {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope.get('headers', [])}
+        connection_mode = requested_mode(headers.get(PROFILE_HEADER.lower()))
+        slot = _Slot()
+        _current.set(slot)
+
+        def finish():
+            if slot.capture is not None:
+                capture, slot.capture = slot.capture, None
+                capture.stop()
+
+        async def profiled_receive():
+            finish()
+            message = await receive()
+            if message['type'] == 'websocket.receive':
+                mode = connection_mode or sampled_mode()
+                if mode is not None:
+                    capture = Capture(mode, 'websocket', scope.get('path', ''), 'receive')
+                    capture.view, capture.action = self.view, 'receive'
+                    slot.capture = capture.start()
+            return message
+
+        try:
+            return await self.inner(scope, profiled_receive, send)
+        finally:
+            finish()
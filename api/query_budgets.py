@@ -0,0 +1,126 @@
+# In api/query_budgets.py
+"""
+Query and wall-time budgets per endpoint and socket route.
+
+ENDPOINT_BUDGETS maps each URL name of api/urls.py to a budget per HTTP
+method, SOCKET_BUDGETS each socket route of api/routing.py to the budget of a
+connect, one message and a disconnect. The regression suite in api/tests.py
+exercises all of them with datasets of two sizes and fails when a budget is
+exceeded, when a route has no budget, or when the number of queries grows with
+the number of rows.
+
+Budgets are the measured counts, not targets: raise one only together with the
+change that needs the extra query.
+"""
+import time
+from contextlib import ExitStack
+from typing import NamedTuple
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+# Wall time allowed by default, generous enough for a loaded CI machine
+DEFAULT_MILLISECONDS = 500
+
+
+class Budget(NamedTuple):
+    queries: int
+    milliseconds: float = DEFAULT_MILLISECONDS
+
+
+ENDPOINT_BUDGETS = {
+    # Auth and users
+    'token_obtain_pair': {'POST': Budget(1)},
+    'token_refresh': {'POST': Budget(1)},
+    'user-register': {'POST': Budget(3)},
+    'user-profile': {'GET': Budget(1)},
+    'current-provider-profile': {'GET': Budget(1), 'PATCH': Budget(1)},
+
+    # Catalog
+    'service-category-list': {'GET': Budget(2)},
+    'service-list': {'GET': Budget(1)},
+
+    # Providers
+    'provider-status': {'PATCH': Budget(6)},
+    'provider-location': {'POST': Budget(10)},
+    'provider-profile-list': {'GET': Budget(3)},
+    'provider-profile-detail': {'GET': Budget(3)},
+
+    # Bookings
+    'booking-list': {'GET': Budget(2), 'POST': Budget(12)},
+    'booking-detail': {'GET': Budget(2)},
+    'booking-accept-booking': {'POST': Budget(6)},
+    'booking-decline-booking': {'POST': Budget(10)},
+    'booking-start-job': {'PATCH': Budget(6)},
+    'booking-complete-job': {'PATCH': Budget(7)},
+    'booking-eta': {'GET': Budget(2)},
+    'booking-rate-job': {'POST': Budget(6)},
+    'booking-pay-for-job': {'POST': Budget(7)},
+    'mpesa-callback': {'POST': Budget(4)},
+
+    # Admin
+    'api-root': {'GET': Budget(0)},
+    'admin-stats': {'GET': Budget(10)},
+    'admin-recent-bookings': {'GET': Budget(1)},
+    'admin-booking-series': {'GET': Budget(1)},
+    'admin-heatmap': {'GET': Budget(1)},
+    'admin-export': {'GET': Budget(1)},
+    'admin-profiles': {'GET': Budget(0)},
+    'admin-profile-detail': {'GET': Budget(0)},
+    'admin-profile-token': {'POST': Budget(0)},
+    'admin-users-list': {'GET': Budget(1)},
+    'admin-users-detail': {'GET': Budget(1), 'PATCH': Budget(2)},
+    'admin-users-suspend': {'POST': Budget(8)},
+    'admin-users-activate': {'POST': Budget(2)},
+    'admin-users-verify-provider': {'POST': Budget(3)},
+    'admin-users-bulk-suspend': {'POST': Budget(10)},
+    'admin-users-bulk-activate': {'POST': Budget(4)},
+    'admin-users-bulk-verify-provider': {'POST': Budget(5)},
+    'admin-categories-list': {'GET': Budget(1)},
+    'admin-categories-detail': {'GET': Budget(1)},
+    'admin-services-list': {'GET': Budget(1)},
+    'admin-services-detail': {'GET': Budget(1)},
+}
+
+SOCKET_BUDGETS = {
+    'chat': Budget(3),
+    'location': Budget(3),
+    # Connect, subscribe both users to one chat, one message
+    'stream': Budget(3),
+}
+
+
+class QueryMeter:
+    """
+    Context manager counting the queries run on every database connection of
+    the current thread, and the wall time, e.g.
+
+        with QueryMeter() as meter:
+            client.get(url)
+        meter.queries, meter.milliseconds, meter.statements
+    """
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        self._contexts = [self._stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.milliseconds = (time.perf_counter() - self._start) * 1000
+        self._stack.__exit__(*exc_info)
+        self.statements = [query['sql'] for context in self._contexts for query in context.captured_queries]
+        self.queries = len(self.statements)
+        return False
+
+
+def violations(budget, meter):
+    """
+    Human-readable reasons `meter` went over `budget` (empty when within it).
+    """
+    problems = []
+    if meter.queries > budget.queries:
+        problems.append(f'{meter.queries} queries (budget {budget.queries})')
+    if meter.milliseconds > budget.milliseconds:
+        problems.append(f'{meter.milliseconds:.0f} ms (budget {budget.milliseconds:.0f} ms)')
+    return problems
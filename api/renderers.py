@@ -0,0 +1,33 @@
+# In api/renderers.py
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from . import fastjson
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by api.fastjson (orjson when available).
+    Falls back to DRF's renderer when indentation is requested.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return fastjson.dumps(data)
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser backed by api.fastjson (orjson when available).
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return fastjson.loads(stream.read())
+        except (ValueError, fastjson.JSONDecodeError) as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,106 @@
+# In api/rollups.py
+"""
+Incremental maintenance of BookingRollup.
+
+A booking is counted in the hour it was created, under its service and its
+current status; a transition moves it from one status row to another and a
+successful payment adds its amount to the booking's row. Because every row
+can be derived from Booking and Payment, `manage.py rebuild_rollups` can
+recompute any range in batches if the incremental updates ever drift.
+
+Bookings without a service (their service was deleted) share one row per hour
+and status, keyed by unique_booking_rollup_no_service.
+"""
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from .models import Booking, BookingRollup, Payment, Service
+from .utils import increment
+
+
+def bucket_for(moment):
+    """
+    The (UTC) hour bucket of a datetime.
+    """
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def bump(bucket, service_id, status, count=0, revenue=0):
+    """
+    Add to one rollup row, creating it if needed.
+    """
+    increment(BookingRollup, {'bucket': bucket, 'service_id': service_id, 'status': status}, count=count, revenue=revenue)
+
+
+def record_booking_created(booking):
+    bump(bucket_for(booking.created_at), booking.service_id, booking.status, count=1)
+
+
+def record_transition(booking, from_status, to_status):
+    """
+    Move a booking (a dict with created_at and service_id) between status rows.
+    Call it in the transaction that applied the transition.
+    """
+    bucket = bucket_for(booking['created_at'])
+    bump(bucket, booking['service_id'], from_status, count=-1)
+    bump(bucket, booking['service_id'], to_status, count=1)
+
+
+def record_payment(booking, amount):
+    """
+    Add a successful payment to its booking's row.
+    """
+    bump(bucket_for(booking.created_at), booking.service_id, booking.status, revenue=amount)
+
+
+@receiver(pre_delete, sender=Service)
+def fold_deleted_service(sender, instance, **kwargs):
+    """
+    Move the rows of a service being deleted to the rows without a service, as
+    its bookings are. Left to SET_NULL they would sit next to those rows, and
+    every later bump would count twice.
+    """
+    rows = BookingRollup.objects.filter(service_id=instance.pk)
+    for bucket, status, count, revenue in rows.values_list('bucket', 'status', 'count', 'revenue').iterator():
+        bump(bucket, None, status, count=count, revenue=revenue)
+    rows.delete()
+
+
+def rebuild(start, end):
+    """
+    Recompute the rollup rows for bookings created in [start, end), widened to
+    whole hours, in one transaction. Returns the number of rows written.
+    """
+    start = bucket_for(start)
+    if bucket_for(end) != end:
+        end = bucket_for(end) + timedelta(hours=1)
+    bookings = Booking.objects.filter(created_at__gte=start, created_at__lt=end)
+    rows = {}
+    with transaction.atomic():
+        counts = bookings.annotate(
+            bucket=TruncHour('created_at', tzinfo=dt_timezone.utc)
+        ).values('bucket', 'service_id', 'status').annotate(total=Count('id')).order_by()
+        for row in counts:
+            rows[(row['bucket'], row['service_id'], row['status'])] = [row['total'], Decimal('0')]
+
+        payments = Payment.objects.filter(
+            status='SUCCESS', booking__created_at__gte=start, booking__created_at__lt=end,
+        ).annotate(
+            bucket=TruncHour('booking__created_at', tzinfo=dt_timezone.utc)
+        ).values('bucket', 'booking__service_id', 'booking__status').annotate(total=Sum('amount')).order_by()
+        for row in payments:
+            key = (row['bucket'], row['booking__service_id'], row['booking__status'])
+            rows.setdefault(key, [0, Decimal('0')])[1] = row['total']
+
+        BookingRollup.objects.filter(bucket__gte=start, bucket__lt=end).delete()
+        BookingRollup.objects.bulk_create([
+            BookingRollup(bucket=bucket, service_id=service_id, status=status, count=count, revenue=revenue)
+            for (bucket, service_id, status), (count, revenue) in rows.items()
+        ], batch_size=1000)
+    return len(rows)
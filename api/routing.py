@@ -2,10 +2,13 @@
 from django.urls import re_path 
 
 from . import consumers
+from .profiling import SocketProfiler
 
 websocket_urlpatterns = [
-    re_path(r'ws/chat/(?P<booking_id>[\w-]+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/chat/(?P<booking_id>[\w-]+)/$', SocketProfiler(consumers.ChatConsumer.as_asgi())),
     # Add the new route for location tracking
-    re_path(r'ws/location/(?P<booking_id>[\w-]+)/$', consumers.LocationConsumer.as_asgi()),
+    re_path(r'ws/location/(?P<booking_id>[\w-]+)/$', SocketProfiler(consumers.LocationConsumer.as_asgi())),
+    # One socket per user multiplexing the chat and location streams of many bookings
+    re_path(r'ws/stream/$', SocketProfiler(consumers.StreamConsumer.as_asgi())),
 ]
 
@@ -1,14 +1,31 @@
+import logging
+import time
+
 from rest_framework import serializers 
 from .models import User, Service, ServiceCategory, ServiceProviderProfile, Booking, Rating
-from .utils import haversine
+from .utils import bounding_box
 from django.db import transaction 
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .user_state import build_user_state
+from .logs import log_event
+from . import eta, heatmap, metrics, rollups
+
+logger = logging.getLogger(__name__)
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     """
     Custom token serializer that allows suspended users to log in.
     This enables suspended providers to see a "suspended account" page.
     """
+    @classmethod
+    def get_token(cls, user):
+        # Embed the authorization state so StatelessJWTAuthentication can rebuild
+        # request.user without a database lookup
+        token = super().get_token(user)
+        for claim, value in build_user_state(user).items():
+            token[claim] = value
+        return token
+
     def validate(self, attrs):
         # Use the custom authentication backend
         data = super().validate(attrs)
@@ -74,8 +91,10 @@ class ProviderStatusSerializer(serializers.Serializer):
     is_on_duty = serializers.BooleanField(source='on_duty')
 
     def update(self, instance, validated_data):
-        instance.on_duty = validated_data.get('on_duty', instance.on_duty)
-        instance.save()
+        if 'on_duty' in validated_data:
+            instance.on_duty = validated_data['on_duty']
+            instance.save(update_fields=['on_duty'])
+            heatmap.sync_provider(instance.pk)
         return instance
 
 class ProviderLocationSerializer(serializers.Serializer):
@@ -88,7 +107,8 @@ class ProviderLocationSerializer(serializers.Serializer):
     def update(self, instance, validated_data):
         instance.last_known_latitude = validated_data.get('latitude')
         instance.last_known_longitude = validated_data.get('longitude')
-        instance.save()
+        # Still one UPDATE while the provider stays in the same heatmap cell
+        heatmap.update_provider_location(instance.pk, instance.last_known_latitude, instance.last_known_longitude)
         return instance
     
 class BookingSerializer(serializers.ModelSerializer):
@@ -131,33 +151,48 @@ class BookingSerializer(serializers.ModelSerializer):
         # 1. They offer the exact requested service
         # 2. They are verified by admin
         # 3. They are currently on duty
+        # With MATCH_RADIUS_KM set, candidates must also be within the search radius,
+        # which widens where the heatmap shows more open bookings than on-duty
+        # providers (api/heatmap.py)
+        matching_started = time.perf_counter()
+        radius_km = heatmap.search_radius_km(customer_lat, customer_lon, service.id)
         available_providers = ServiceProviderProfile.objects.filter(
             service_offered=service,           # Rule 1: They offer the exact service
             is_verified=True,                  # Rule 2: They have been approved by an admin
             on_duty=True,                      # Rule 3: They are actively on duty right now
             last_known_latitude__isnull=False, # Additional: They have location data
-            last_known_longitude__isnull=False
+            last_known_longitude__isnull=False,
         ).select_related('user')  # Optimize: pre-fetch user data to avoid N+1 queries
+        if radius_km is not None:
+            min_lat, max_lat, min_lon, max_lon = bounding_box(customer_lat, customer_lon, radius_km)
+            available_providers = available_providers.filter(
+                last_known_latitude__range=(min_lat, max_lat),
+                last_known_longitude__range=(min_lon, max_lon),
+            )
         
-        if not available_providers.exists():
-            raise serializers.ValidationError("No verified providers offering this service are currently available. Please try again later.")
+        # Estimate the travel time of every candidate in one batch (api/eta.py)
+        candidates = list(available_providers)
+        metrics.MATCHING_CANDIDATES.labels().observe(len(candidates))
+        estimates = eta.get_model().estimate(
+            [(profile.last_known_latitude, profile.last_known_longitude) for profile in candidates],
+            (customer_lat, customer_lon),
+        )
+        provider_etas = [
+            (estimate.seconds, estimate, provider_profile)
+            for estimate, provider_profile in zip(estimates, candidates)
+            if radius_km is None or estimate.distance_km <= radius_km
+        ]
 
-        # Calculate distance for each provider
-        provider_distances = []
-        for provider_profile in available_providers:
-            distance = haversine(
-                customer_lat, 
-                customer_lon, 
-                provider_profile.last_known_latitude, 
-                provider_profile.last_known_longitude
-            )
-            # We store the user object of the provider, not the profile
-            provider_distances.append((distance, provider_profile.user)) 
+        if not provider_etas:
+            metrics.MATCHING_DURATION.labels('no_provider').observe(time.perf_counter() - matching_started)
+            raise serializers.ValidationError("No verified providers offering this service are currently available. Please try again later.")
 
-        # Sort by distance (the first element of our tuple) to find the nearest
-        provider_distances.sort(key=lambda x: x[0])
+        # The provider who can get there first, rather than the nearest as the crow flies
+        provider_etas.sort(key=lambda x: x[0])
+        _, best_estimate, best_profile = provider_etas[0]
+        metrics.MATCHING_DURATION.labels('matched').observe(time.perf_counter() - matching_started)
         
-        nearest_provider_user = provider_distances[0][1] # Get the User object of the nearest provider
+        nearest_provider_user = best_profile.user # Get the User object of the fastest provider
         
         # 4. Create the booking instance
         booking = Booking.objects.create(
@@ -169,12 +204,20 @@ class BookingSerializer(serializers.ModelSerializer):
             provider=nearest_provider_user,
             status='PENDING' # Changed from auto-accept to pending
         )
+        rollups.record_booking_created(booking)
+        heatmap.record_booking_created(booking)
+        eta.store_booking_eta(
+            booking.id, (best_profile.last_known_latitude, best_profile.last_known_longitude), best_estimate
+        )
         
         # Remove auto-accept timestamp setting
         # booking.accepted_at will be set when provider accepts
         
         # TODO: Send a real-time notification to the provider here using WebSockets
-        print(f"Booking {booking.id} created and assigned to {nearest_provider_user.username} with PENDING status")
+        log_event(
+            logger, 'booking.created', booking_id=booking.id, service_id=service.id,
+            provider_id=nearest_provider_user.pk, candidates=len(candidates), eta_seconds=best_estimate.seconds,
+        )
         
         return booking
     
@@ -209,7 +252,7 @@ class ProviderProfileSerializer(serializers.ModelSerializer):
         # We explicitly handle the update to ensure only allowed fields are changed.
         # In this case, only 'bio' can be updated by the user.
         instance.bio = validated_data.get('bio', instance.bio)
-        instance.save()
+        instance.save(update_fields=['bio'])
         return instance
 
 class AdminUserSerializer(serializers.ModelSerializer):
@@ -246,9 +289,14 @@ class AdminUserSerializer(serializers.ModelSerializer):
         """
         Get total bookings for this user (as customer or provider)
         """
+        # AdminUserViewSet annotates the totals (None when the user has no bookings)
         if obj.user_type == 'CUSTOMER':
+            if hasattr(obj, 'customer_bookings_total'):
+                return obj.customer_bookings_total or 0
             return obj.customer_bookings.count()
         elif obj.user_type == 'PROVIDER':
+            if hasattr(obj, 'provider_bookings_total'):
+                return obj.provider_bookings_total or 0
             return obj.provider_bookings.count()
         return 0
     
@@ -270,7 +318,9 @@ class AdminServiceCategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'icon_name', 'services_count']
     
     def get_services_count(self, obj):
-        return obj.services.count()
+        # Annotated by ServiceCategoryViewSet, counted here for other callers
+        total = getattr(obj, 'services_total', None)
+        return obj.services.count() if total is None else total
 
 
 class AdminServiceSerializer(serializers.ModelSerializer):
@@ -1,3 +1,1906 @@
-from django.test import TestCase
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from importlib import import_module
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import InMemoryChannelLayer
+from channels.routing import URLRouter
+from django.apps import apps as django_apps
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Avg, Count, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import URLResolver, reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import (
+    backpressure, benchmarks, channel_layers, db_router, eta, exports, fastjson, heatmap, loadtest, middleware, profiling, rollups, urls,
+)
+from .booking_transitions import apply_transition
+from .location_codec import BINARY_SUBPROTOCOL, LocationDecoder, LocationEncoder
+from .logs import CORRELATION_HEADER, REDACTED, JsonFormatter, log_event
+from .metrics import REGISTRY
+from .models import (
+    Booking, BookingRollup, ChatMessage, HeatmapCell, Payment, Rating, Service, ServiceCategory, ServiceProviderProfile, User,
+)
+from .query_budgets import ENDPOINT_BUDGETS, SOCKET_BUDGETS, QueryMeter, violations
+from .renderers import FastJSONParser, FastJSONRenderer
+from .routing import websocket_urlpatterns
+from .serializers import CustomTokenObtainPairSerializer
+from .user_state import get_user_state, user_from_state
+
+# Rows per dataset: every list an endpoint returns grows with this
+SIZES = (3, 12)
+CENTER = (-6.7924, 39.2083)
+PASSWORD = 'budget-password'
+
+
+def build_dataset(size):
+    """
+    An admin, a customer and a provider (the users making the requests) plus
+    `size` of everything they can list: categories, services, other providers
+    with ratings, bookings with messages, payments and ratings.
+    """
+    data = SimpleNamespace(size=size)
+    data.admin = User.objects.create_user(
+        username='admin', password=PASSWORD, user_type='ADMIN', is_staff=True, is_superuser=True,
+    )
+    data.categories = [ServiceCategory.objects.create(name=f'Category {i}') for i in range(size)]
+    data.services = [
+        Service.objects.create(category=category, name=f'Service {i}', description='d', estimated_base_price=Decimal('1500'))
+        for i, category in enumerate(data.categories)
+    ]
+    service = data.services[0]
+
+    def provider(username, latitude, longitude, service=service):
+        user = User.objects.create_user(username=username, password=PASSWORD, user_type='PROVIDER')
+        ServiceProviderProfile.objects.filter(user=user).update(
+            service_offered=service, is_verified=True, on_duty=True,
+            last_known_latitude=latitude, last_known_longitude=longitude,
+        )
+        return user
+
+    def booking(customer, provider, status, **fields):
+        return Booking.objects.create(
+            customer=customer, provider=provider, service=service, status=status,
+            booking_latitude=CENTER[0], booking_longitude=CENTER[1], **fields,
+        )
+
+    data.customer = User.objects.create_user(
+        username='customer', password=PASSWORD, user_type='CUSTOMER', phone_number='255700000000',
+    )
+    data.provider = provider('provider', CENTER[0] + 0.01, CENTER[1] + 0.01)
+    data.customers = [
+        User.objects.create_user(username=f'customer-{i}', password=PASSWORD, user_type='CUSTOMER')
+        for i in range(size)
+    ]
+    data.providers = [
+        provider(f'provider-{i}', CENTER[0] + 0.02 * (i + 1), CENTER[1], data.services[i])
+        for i in range(size)
+    ]
+
+    # History: rated, paid and discussed jobs for the main users and for every other provider
+    for i, (customer, other_provider) in enumerate(zip(data.customers, data.providers)):
+        for rater, ratee in ((data.customer, data.provider), (customer, other_provider), (customer, data.provider)):
+            done = booking(rater, ratee, 'COMPLETED', final_price=Decimal('1500'))
+            Rating.objects.create(booking=done, rater=rater, ratee=ratee, score=4, comment='Good')
+            Payment.objects.create(booking=done, amount=Decimal('1500'), payment_method='CASH', status='SUCCESS')
+            for sender in (rater, ratee):
+                ChatMessage.objects.create(booking=done, sender=sender, message='Hello')
+
+    # One booking per step of the job, for the transition endpoints
+    data.pending = booking(data.customer, data.provider, 'PENDING')
+    data.accepted = booking(data.customer, data.provider, 'ACCEPTED')
+    data.in_progress = booking(data.customer, data.provider, 'IN_PROGRESS')
+    data.unpaid = booking(data.customer, data.provider, 'COMPLETED', final_price=Decimal('1500'))
+    data.mpesa_payment = Payment.objects.create(
+        booking=data.unpaid, amount=Decimal('1500'), payment_method='M-PESA', status='PENDING',
+        external_transaction_id='ws_CO_budget',
+    )
+
+    # For the profile endpoints
+    data.profile = profiling.Capture('sampling', 'http', '/api/users/me/', 'GET').start().stop()
+
+    heatmap.rebuild()
+    bookings = Booking.objects.order_by('created_at')
+    rollups.rebuild(bookings.first().created_at, bookings.last().created_at)
+
+    data.tokens = {
+        user.username: CustomTokenObtainPairSerializer.get_token(user)
+        for user in (data.admin, data.customer, data.provider)
+    }
+    return data
+
+
+def booking_url(name, booking):
+    return reverse(name, kwargs={'pk': booking.pk})
+
+
+# URL name -> [(method, user, url(data), body(data))]; user is None for anonymous requests
+SCENARIOS = {
+    'token_obtain_pair': [('POST', None, lambda d: reverse('token_obtain_pair'),
+                           lambda d: {'username': 'customer', 'password': PASSWORD})],
+    'token_refresh': [('POST', None, lambda d: reverse('token_refresh'),
+                       lambda d: {'refresh': str(d.tokens['customer'])})],
+    'user-register': [('POST', None, lambda d: reverse('user-register'),
+                       lambda d: {'username': 'newcomer', 'password': PASSWORD, 'email': 'n@example.com'})],
+    'user-profile': [('GET', 'customer', lambda d: reverse('user-profile'), None)],
+    'current-provider-profile': [
+        ('GET', 'provider', lambda d: reverse('current-provider-profile'), None),
+        ('PATCH', 'provider', lambda d: reverse('current-provider-profile'), lambda d: {'bio': 'Twenty years of pipes'}),
+    ],
+    'service-category-list': [('GET', 'customer', lambda d: reverse('service-category-list'), None)],
+    'service-list': [('GET', 'customer', lambda d: reverse('service-list'), None)],
+    'provider-status': [('PATCH', 'provider', lambda d: reverse('provider-status'), lambda d: {'is_on_duty': False})],
+    'provider-location': [('POST', 'provider', lambda d: reverse('provider-location'),
+                           lambda d: {'latitude': CENTER[0] + 0.3, 'longitude': CENTER[1]})],
+    'provider-profile-list': [('GET', None, lambda d: reverse('provider-profile-list'), None)],
+    'provider-profile-detail': [('GET', None, lambda d: reverse('provider-profile-detail', kwargs={'user_id': d.provider.pk}), None)],
+    'booking-list': [
+        ('GET', 'customer', lambda d: reverse('booking-list'), None),
+        ('GET', 'provider', lambda d: reverse('booking-list'), None),
+        ('POST', 'customer', lambda d: reverse('booking-list'),
+         lambda d: {'service_id': d.services[0].pk, 'latitude': CENTER[0], 'longitude': CENTER[1]}),
+    ],
+    'booking-detail': [('GET', 'customer', lambda d: booking_url('booking-detail', d.in_progress), None)],
+    'booking-accept-booking': [('POST', 'provider', lambda d: booking_url('booking-accept-booking', d.pending), None)],
+    'booking-decline-booking': [('POST', 'provider', lambda d: booking_url('booking-decline-booking', d.pending), None)],
+    'booking-start-job': [('PATCH', 'provider', lambda d: booking_url('booking-start-job', d.accepted), None)],
+    'booking-complete-job': [('PATCH', 'provider', lambda d: booking_url('booking-complete-job', d.in_progress), None)],
+    'booking-eta': [('GET', 'customer', lambda d: booking_url('booking-eta', d.in_progress), None)],
+    'booking-rate-job': [('POST', 'customer', lambda d: booking_url('booking-rate-job', d.unpaid),
+                          lambda d: {'score': 5, 'comment': 'Quick'})],
+    'booking-pay-for-job': [('POST', 'customer', lambda d: booking_url('booking-pay-for-job', d.unpaid),
+                             lambda d: {'payment_method': 'CASH'})],
+    'mpesa-callback': [('POST', None, lambda d: reverse('mpesa-callback'), lambda d: {
+        'Body': {'stkCallback': {'CheckoutRequestID': 'ws_CO_budget', 'ResultCode': 0, 'ResultDesc': 'OK'}},
+    })],
+    'api-root': [('GET', 'customer', lambda d: reverse('api-root'), None)],
+    'admin-stats': [('GET', 'admin', lambda d: reverse('admin-stats'), None)],
+    'admin-recent-bookings': [('GET', 'admin', lambda d: reverse('admin-recent-bookings'), None)],
+    'admin-booking-series': [('GET', 'admin', lambda d: reverse('admin-booking-series') + '?interval=day', None)],
+    'admin-heatmap': [('GET', 'admin', lambda d: reverse('admin-heatmap'), None)],
+    'admin-export': [('GET', 'admin', lambda d: reverse('admin-export', kwargs={'dataset': 'bookings', 'fmt': 'csv'}), None)],
+    'admin-profiles': [('GET', 'admin', lambda d: reverse('admin-profiles'), None)],
+    'admin-profile-detail': [
+        ('GET', 'admin', lambda d: reverse('admin-profile-detail', kwargs={'profile_id': d.profile['id']}), None),
+    ],
+    'admin-profile-token': [('POST', 'admin', lambda d: reverse('admin-profile-token'), lambda d: {'mode': 'cprofile'})],
+    'admin-users-list': [('GET', 'admin', lambda d: reverse('admin-users-list'), None)],
+    'admin-users-detail': [
+        ('GET', 'admin', lambda d: reverse('admin-users-detail', kwargs={'pk': d.provider.pk}), None),
+        ('PATCH', 'admin', lambda d: reverse('admin-users-detail', kwargs={'pk': d.provider.pk}),
+         lambda d: {'first_name': 'Renamed'}),
+    ],
+    'admin-users-suspend': [('POST', 'admin', lambda d: reverse('admin-users-suspend', kwargs={'pk': d.provider.pk}), None)],
+    'admin-users-activate': [('POST', 'admin', lambda d: reverse('admin-users-activate', kwargs={'pk': d.provider.pk}), None)],
+    'admin-users-verify-provider': [
+        ('POST', 'admin', lambda d: reverse('admin-users-verify-provider', kwargs={'pk': d.provider.pk}), None),
+    ],
+    'admin-users-bulk-suspend': [('POST', 'admin', lambda d: reverse('admin-users-bulk-suspend'),
+                                  lambda d: {'ids': [user.pk for user in d.providers]})],
+    'admin-users-bulk-activate': [('POST', 'admin', lambda d: reverse('admin-users-bulk-activate'),
+                                   lambda d: {'ids': [user.pk for user in d.providers]})],
+    'admin-users-bulk-verify-provider': [('POST', 'admin', lambda d: reverse('admin-users-bulk-verify-provider'),
+                                          lambda d: {'ids': [user.pk for user in d.providers]})],
+    'admin-categories-list': [('GET', 'admin', lambda d: reverse('admin-categories-list'), None)],
+    'admin-categories-detail': [
+        ('GET', 'admin', lambda d: reverse('admin-categories-detail', kwargs={'pk': d.categories[0].pk}), None),
+    ],
+    'admin-services-list': [('GET', 'admin', lambda d: reverse('admin-services-list'), None)],
+    'admin-services-detail': [
+        ('GET', 'admin', lambda d: reverse('admin-services-detail', kwargs={'pk': d.services[0].pk}), None),
+    ],
+}
+
+
+def streamed_content(response):
+    """
+    The whole body of a streaming response, async iterators included.
+    """
+    if not response.is_async:
+        return b''.join(response.streaming_content)
+
+    async def drain():
+        return b''.join([chunk async for chunk in response.streaming_content])
+    return async_to_sync(drain)()
+
+
+def api_url_names():
+    from . import urls
+
+    names = set()
+
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns)
+            elif pattern.name:
+                names.add(pattern.name)
+
+    walk(urls.urlpatterns)
+    return names
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+class QueryBudgetTests(TestCase):
+    """
+    Every endpoint and socket route stays within its budget (api/query_budgets.py),
+    and its query count does not depend on the size of the data.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_every_route_has_a_budget_and_a_scenario(self):
+        names = api_url_names()
+        self.assertEqual(names - set(ENDPOINT_BUDGETS), set(), 'URLs without a budget')
+        self.assertEqual(names - set(SCENARIOS), set(), 'URLs that are not exercised')
+        self.assertEqual(set(SCENARIOS) - names, set(), 'Scenarios for URLs that no longer exist')
+
+    def request(self, data, method, username, url, body):
+        client = APIClient()
+        if username:
+            client.credentials(HTTP_AUTHORIZATION=f"Bearer {data.tokens[username].access_token}")
+        with QueryMeter() as meter:
+            response = client.generic(method, url, '' if body is None else json.dumps(body),
+                                      content_type='application/json')
+            if response.streaming:
+                streamed_content(response)
+        return response, meter
+
+    def measure_endpoints(self, size):
+        """
+        {(url name, method, user): (status, meter)}, each request rolled back
+        so they all see the same data.
+        """
+        results = {}
+        with transaction.atomic():
+            data = build_dataset(size)
+            for name, scenarios in SCENARIOS.items():
+                for method, username, url, body in scenarios:
+                    cache.clear()
+                    with transaction.atomic():
+                        response, meter = self.request(data, method, username, url(data), body(data) if body else None)
+                        transaction.set_rollback(True)
+                    results[(name, method, username)] = (response.status_code, meter)
+            transaction.set_rollback(True)
+        return results
+
+    def test_endpoint_budgets(self):
+        small, large = (self.measure_endpoints(size) for size in SIZES)
+        for key, (status, meter) in large.items():
+            name, method, username = key
+            with self.subTest(endpoint=name, method=method, user=username):
+                self.assertLess(status, 400, f'{method} {name} failed with {status}')
+                budget = ENDPOINT_BUDGETS[name][method]
+                self.assertEqual(violations(budget, meter), [], '\n'.join(meter.statements))
+                small_queries = small[key][1].queries
+                self.assertEqual(
+                    meter.queries, small_queries,
+                    f'{meter.queries} queries with {SIZES[1]} rows, {small_queries} with {SIZES[0]}:\n'
+                    + '\n'.join(meter.statements),
+                )
+
+    # --- Sockets ---
+
+    def socket_exchange(self, data, route):
+        """
+        Connect the customer and the provider to a booking's socket, send one
+        message and disconnect, counting the queries of the whole exchange.
+        """
+        application = URLRouter(websocket_urlpatterns)
+        booking = data.in_progress
+        sender, receiver = (data.provider, data.customer) if route == 'location' else (data.customer, data.provider)
+        message = {'message': 'On my way'} if route == 'chat' else {'latitude': CENTER[0], 'longitude': CENTER[1]}
+        path = f'/ws/{route}/{booking.pk}/'
+        if route == 'stream':
+            # The multiplexed socket, following the booking's chat
+            message, path = {'action': 'chat', 'booking': str(booking.pk), 'message': 'On my way'}, '/ws/stream/'
+
+        async def exchange():
+            sockets = {}
+            for user in (sender, receiver):
+                communicator = ApplicationCommunicator(application, {
+                    'type': 'websocket', 'path': path, 'user': user,
+                    'subprotocols': [], 'headers': [], 'query_string': b'',
+                })
+                await communicator.send_input({'type': 'websocket.connect'})
+                accepted = await communicator.receive_output(5)
+                self.assertEqual(accepted['type'], 'websocket.accept')
+                if route == 'stream':
+                    await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(
+                        {'action': 'subscribe', 'stream': 'chat', 'bookings': [str(booking.pk)]}
+                    )})
+                    subscribed = json.loads((await communicator.receive_output(5))['text'])
+                    self.assertEqual(subscribed['bookings'], [str(booking.pk)])
+                sockets[user.pk] = communicator
+            await sockets[sender.pk].send_input({'type': 'websocket.receive', 'text': json.dumps(message)})
+            await sockets[receiver.pk].receive_output(5)
+            for communicator in sockets.values():
+                await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+                await communicator.wait(5)
+
+        with QueryMeter() as meter:
+            async_to_sync(exchange)()
+        return meter
+
+    def test_socket_budgets(self):
+        for route, budget in SOCKET_BUDGETS.items():
+            counts = []
+            for size in SIZES:
+                cache.clear()
+                with transaction.atomic():
+                    data = build_dataset(size)
+                    meter = self.socket_exchange(data, route)
+                    transaction.set_rollback(True)
+                counts.append(meter.queries)
+                with self.subTest(route=route, size=size):
+                    self.assertEqual(violations(budget, meter), [], '\n'.join(meter.statements))
+            with self.subTest(route=route):
+                self.assertEqual(counts[0], counts[1], f'Queries grow with the rows: {counts}')
+
+
+@override_settings(METRICS_TOKEN='scrape-token')
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        REGISTRY.clear()
+
+    def scrape(self, token='scrape-token'):
+        return self.client.get('/metrics', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_requests_are_recorded_per_view_and_action(self):
+        data = build_dataset(1)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {data.tokens['provider'].access_token}")
+        client.post(booking_url('booking-accept-booking', data.pending))
+
+        body = self.scrape().content.decode()
+        labels = 'view="BookingViewSet",action="accept_booking"'
+        self.assertIn(f'quickassist_http_request_duration_seconds_count{{{labels}}} 1', body)
+        self.assertIn(f'quickassist_http_request_queries_bucket{{{labels},le="+Inf"}} 1', body)
+        self.assertIn(f'quickassist_http_requests_total{{{labels},status="200"}} 1', body)
+
+    def test_scrape_requires_the_token(self):
+        self.assertEqual(self.scrape('wrong').status_code, 403)
+        self.assertEqual(self.scrape().status_code, 200)
+
+    def test_prod_settings_require_a_token(self):
+        env = {key: value for key, value in os.environ.items() if key not in ('METRICS_TOKEN', 'METRICS_ENABLED')}
+        env.update(SECRET_KEY='x', CACHE_URL='locmem://')
+        load = [sys.executable, '-c', 'import quickassist_project.settings.prod']
+        refused = subprocess.run(load, env=env, cwd=settings.BASE_DIR, capture_output=True, text=True)
+        self.assertNotEqual(refused.returncode, 0)
+        self.assertIn('METRICS_TOKEN must be set', refused.stderr)
+        accepted = subprocess.run(load, env={**env, 'METRICS_TOKEN': 'scrape-token'}, cwd=settings.BASE_DIR)
+        self.assertEqual(accepted.returncode, 0)
+
+
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        self.data = build_dataset(1)
+        profiling.get_store().clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.data.tokens['admin'].access_token}")
+
+    def profile_header(self, mode):
+        response = self.client.post(reverse('admin-profile-token'), {'mode': mode}, format='json')
+        return {f"HTTP_{response.data['header'].upper().replace('-', '_')}": response.data['token']}
+
+    def test_requests_with_a_token_are_profiled(self):
+        for mode, detail in (('sampling', 'stacks'), ('cprofile', 'functions')):
+            with self.subTest(mode=mode):
+                response = self.client.get(reverse('admin-users-list'), **self.profile_header(mode))
+                profile = self.client.get(reverse('admin-profile-detail', kwargs={'profile_id': response['X-Profile-Id']})).data
+                self.assertEqual((profile['view'], profile['action'], profile['status']), ('AdminUserViewSet', 'list', 200))
+                self.assertEqual(profile['mode'], mode)
+                self.assertIn(detail, profile)
+                self.assertTrue(any('FROM "api_user"' in query['sql'] for query in profile['queries']))
+
+    def test_forged_tokens_and_unsampled_requests_are_not_profiled(self):
+        response = self.client.get(reverse('admin-heatmap'), HTTP_X_PROFILE='forged')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(self.client.get(reverse('admin-profiles')).data['profiles'], [])
+
+    @override_settings(
+        PROFILING_SAMPLE_RATE=1.0,
+        CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    )
+    def test_sampled_socket_messages_are_profiled(self):
+        booking = self.data.in_progress
+
+        async def chat():
+            communicator = ApplicationCommunicator(URLRouter(websocket_urlpatterns), {
+                'type': 'websocket', 'path': f'/ws/chat/{booking.pk}/', 'user': self.data.customer,
+                'subprotocols': [], 'headers': [], 'query_string': b'',
+            })
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output(5)
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'message': 'Hi'})})
+            await communicator.receive_output(5)
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+
+        async_to_sync(chat)()
+        [summary] = profiling.get_store().summaries()
+        self.assertEqual((summary['kind'], summary['view'], summary['action']), ('websocket', 'ChatConsumer', 'receive'))
+        profile = profiling.get_store().get(summary['id'])
+        self.assertTrue(any('INSERT INTO "api_chatmessage"' in query['sql'] for query in profile['queries']))
+
+
+class StructuredLoggingTests(TestCase):
+
+    def format(self, event, **fields):
+        record = logging.LogRecord('api.views', logging.INFO, __file__, 0, event, None, None)
+        record.event_fields, record.correlation_id = fields, 'abc'
+        return json.loads(JsonFormatter().format(record))
+
+    def test_payment_payloads_are_redacted(self):
+        body = {'Body': {'stkCallback': {'CallbackMetadata': {'Item': [
+            {'Name': 'Amount', 'Value': 1500},
+            {'Name': 'MpesaReceiptNumber', 'Value': 'NLJ7RT61SV'},
+            {'Name': 'PhoneNumber', 'Value': 255700000000},
+        ]}}}}
+        entry = self.format('mpesa.callback.body', body=body, phone_number='255700000000')
+        items = entry['body']['Body']['stkCallback']['CallbackMetadata']['Item']
+        self.assertEqual([item['Value'] for item in items], [1500, REDACTED, REDACTED])
+        self.assertEqual((entry['phone_number'], entry['correlation_id']), (REDACTED, 'abc'))
+
+    def test_correlation_id_is_echoed_or_generated(self):
+        response = self.client.get(reverse('service-category-list'), HTTP_X_CORRELATION_ID='client-42')
+        self.assertEqual(response[CORRELATION_HEADER], 'client-42')
+        response = self.client.get(reverse('service-category-list'), HTTP_X_CORRELATION_ID='not an id!')
+        self.assertRegex(response[CORRELATION_HEADER], r'^[0-9a-f]{32}$')
+
+    def test_high_volume_events_are_sampled(self):
+        logger = logging.getLogger('api.sampled')
+        with self.assertLogs(logger) as logs:
+            with override_settings(LOG_SAMPLE_RATES={'location.ping': 0}):
+                log_event(logger, 'location.ping', provider_id=1)
+            with override_settings(LOG_SAMPLE_RATES={'location.ping': 1}):
+                log_event(logger, 'location.ping', provider_id=2)
+        [record] = logs.records
+        self.assertEqual(record.event_fields, {'provider_id': 2, 'sample_rate': 1})
+
+
+# The hot paths served by api/async_views.py, with requests they answer the same way as the sync views
+ASYNC_SCENARIOS = [
+    # Creating a booking stays sync, and gets a new id every time
+    *((name, *scenario) for name in ('provider-status', 'provider-location', 'booking-list', 'booking-detail',
+                                     'mpesa-callback') for scenario in SCENARIOS[name] if scenario[0] != 'POST'
+      or name != 'booking-list'),
+    ('provider-location', 'POST', None, lambda d: reverse('provider-location'), None),
+    ('provider-location', 'POST', 'customer', lambda d: reverse('provider-location'), None),
+    ('provider-location', 'POST', 'provider', lambda d: reverse('provider-location'), lambda d: {'latitude': 'north'}),
+    ('provider-status', 'PATCH', 'provider', lambda d: reverse('provider-status'), lambda d: {'is_on_duty': 'maybe'}),
+    ('booking-detail', 'GET', 'customer', lambda d: reverse('booking-detail', kwargs={'pk': 'not-a-uuid'}), None),
+    ('booking-detail', 'PATCH', 'customer', lambda d: booking_url('booking-detail', d.in_progress),
+     lambda d: {'status': 'CANCELLED'}),
+    ('mpesa-callback', 'POST', None, lambda d: reverse('mpesa-callback'), lambda d: {
+        'Body': {'stkCallback': {'CheckoutRequestID': 'ws_CO_unknown', 'ResultCode': 0, 'ResultDesc': 'OK'}},
+    }),
+]
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class AsyncViewTests(TestCase):
+    """
+    The async views answer like the sync views they take over.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.data = build_dataset(3)
+
+    def exchange(self, patterns, method, username, url, body):
+        with override_settings(ROOT_URLCONF=benchmarks.api_urlconf(patterns)), transaction.atomic():
+            client = APIClient()
+            if username:
+                client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.data.tokens[username].access_token}")
+            response = client.generic(method, url(self.data), '' if body is None else json.dumps(body(self.data)),
+                                      content_type='application/json')
+            transaction.set_rollback(True)
+        cache.clear()
+        return response.status_code, response.json() if response.content else None
+
+    def test_async_views_answer_like_the_sync_views(self):
+        with self.assertLogs('api', logging.WARNING) as logs:
+            for name, method, username, url, body in ASYNC_SCENARIOS:
+                with self.subTest(endpoint=name, method=method, user=username, body=body and body(self.data)):
+                    self.assertEqual(
+                        self.exchange(urls.async_urlpatterns + urls.sync_urlpatterns, method, username, url, body),
+                        self.exchange(urls.sync_urlpatterns, method, username, url, body),
+                    )
+        # And log the same warnings
+        self.assertEqual(
+            [(record.name, record.getMessage()) for record in logs.records],
+            [('api.async_views', 'mpesa.callback.unknown'), ('api.views', 'mpesa.callback.unknown')],
+        )
+
+    def test_bodies_are_json_objects_or_forms(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.data.tokens['provider'].access_token}")
+        for body in ('[1, 2]', '"north"', '3', 'null'):
+            with self.subTest(body=body):
+                response = client.post(reverse('provider-location'), body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'detail': 'Expected a JSON object.'})
+        response = self.client.post(reverse('mpesa-callback'), '[]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        # Forms, for every method
+        location = {'latitude': CENTER[0] + 0.2, 'longitude': CENTER[1]}
+        self.assertEqual(client.post(reverse('provider-location'), location, format='multipart').status_code, 204)
+        self.assertEqual(ServiceProviderProfile.objects.get(pk=self.data.provider.pk).last_known_latitude, CENTER[0] + 0.2)
+        responses = []
+        for patterns in (urls.async_urlpatterns + urls.sync_urlpatterns, urls.sync_urlpatterns):
+            with override_settings(ROOT_URLCONF=benchmarks.api_urlconf(patterns)):
+                response = client.patch(reverse('provider-status'), 'is_on_duty=false',
+                                        content_type='application/x-www-form-urlencoded')
+            responses.append((response.status_code, response.json()))
+        self.assertEqual(responses[0], responses[1])
+
+    def test_location_pings_update_the_heatmap(self):
+        provider_id = self.data.provider.pk
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.data.tokens['provider'].access_token}")
+        response = client.post(reverse('provider-location'), {'latitude': CENTER[0] + 0.5, 'longitude': CENTER[1]},
+                               format='json')
+        self.assertEqual(response.status_code, 204)
+        profile = ServiceProviderProfile.objects.get(pk=provider_id)
+        self.assertEqual(profile.heatmap_cell, heatmap.cell_for(CENTER[0] + 0.5, CENTER[1]))
+        self.assertEqual(profile.last_known_latitude, CENTER[0] + 0.5)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ConnectionContextTests(TestCase):
+    """
+    Consumers handle messages from the context loaded at connect, refreshed
+    when the booking changes state.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.data = build_dataset(1)
+        self.application = URLRouter(websocket_urlpatterns)
+
+    async def connect(self, route, user):
+        communicator = ApplicationCommunicator(self.application, {
+            'type': 'websocket', 'path': f'/ws/{route}/{self.data.in_progress.pk}/', 'user': user,
+            'subprotocols': [], 'headers': [], 'query_string': b'',
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output(5))['type'], 'websocket.accept')
+        return communicator
+
+    async def close(self, *communicators):
+        for communicator in communicators:
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+
+    def test_chat_messages_only_insert_the_message(self):
+        async def exchange():
+            customer = await self.connect('chat', self.data.customer)
+            provider = await self.connect('chat', self.data.provider)
+            await customer.send_input({'type': 'websocket.receive', 'text': json.dumps({'message': 'Hi'})})
+            received = json.loads((await provider.receive_output(5))['text'])
+            await self.close(customer, provider)
+            return received
+
+        with QueryMeter() as meter:
+            received = async_to_sync(exchange)()
+        self.assertEqual(received['sender'], 'customer')
+        # One context query per connection, then only the message itself
+        self.assertEqual(len(meter.statements), 3, '\n'.join(meter.statements))
+        self.assertIn('INSERT INTO "api_chatmessage"', meter.statements[-1])
+        self.assertFalse([sql for sql in meter.statements if 'FROM "api_user"' in sql])
+
+    def test_completed_bookings_stop_relaying_locations(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.data.tokens['provider'].access_token}")
+
+        def complete():
+            with self.captureOnCommitCallbacks(execute=True):
+                return client.patch(booking_url('booking-complete-job', self.data.in_progress)).status_code
+
+        ping = {'type': 'websocket.receive', 'text': json.dumps({'latitude': CENTER[0], 'longitude': CENTER[1]})}
+
+        async def exchange():
+            customer = await self.connect('location', self.data.customer)
+            provider = await self.connect('location', self.data.provider)
+            await provider.send_input(ping)
+            relayed = await customer.receive_output(5)
+            status = await sync_to_async(complete)()
+            await provider.send_input(ping)
+            stopped = await customer.receive_nothing(0.2)
+            await self.close(customer, provider)
+            return relayed, status, stopped
+
+        relayed, status, stopped = async_to_sync(exchange)()
+        self.assertEqual(relayed['type'], 'websocket.send')
+        self.assertEqual(status, 200)
+        self.assertTrue(stopped)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class StreamSocketTests(TestCase):
+    """
+    The multiplexed socket follows many bookings over one connection.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.data = build_dataset(1)
+        self.application = URLRouter(websocket_urlpatterns)
+        self.others = str(Booking.objects.filter(provider=self.data.providers[0]).values_list('pk', flat=True).first())
+
+    async def connect(self, user):
+        communicator = ApplicationCommunicator(self.application, {
+            'type': 'websocket', 'path': '/ws/stream/', 'user': user,
+            'subprotocols': [], 'headers': [], 'query_string': b'',
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output(5))['type'], 'websocket.accept')
+        return communicator
+
+    @staticmethod
+    async def exchange(communicator, frame):
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(frame)})
+        return json.loads((await communicator.receive_output(5))['text'])
+
+    @staticmethod
+    async def close(*communicators):
+        for communicator in communicators:
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+
+    def test_membership_is_checked_in_one_query(self):
+        data = self.data
+        requested = [str(booking.pk) for booking in (data.pending, data.accepted, data.in_progress)]
+
+        async def subscribe():
+            provider = await self.connect(data.provider)
+            reply = await self.exchange(provider, {
+                'action': 'subscribe', 'stream': 'location', 'bookings': requested + [self.others, 'not-a-booking'],
+            })
+            await self.close(provider)
+            return reply
+
+        with QueryMeter() as meter:
+            reply = async_to_sync(subscribe)()
+        self.assertEqual(reply['bookings'], sorted(requested))
+        self.assertEqual(reply['denied'], [self.others, 'not-a-booking'])
+        self.assertEqual(meter.queries, 1, '\n'.join(meter.statements))
+
+    def test_one_ping_reaches_every_followed_booking(self):
+        data = self.data
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {data.tokens['provider'].access_token}")
+        bookings = sorted(str(booking.pk) for booking in (data.accepted, data.in_progress))
+
+        def complete():
+            with self.captureOnCommitCallbacks(execute=True):
+                client.patch(booking_url('booking-complete-job', data.in_progress))
+
+        async def follow():
+            provider, customer = await self.connect(data.provider), await self.connect(data.customer)
+            for communicator in (provider, customer):
+                await self.exchange(communicator, {'action': 'subscribe', 'stream': 'location', 'bookings': bookings})
+            await provider.send_input({'type': 'websocket.receive', 'text': json.dumps(
+                {'action': 'location', 'latitude': CENTER[0], 'longitude': CENTER[1]}
+            )})
+            fixes = [json.loads((await customer.receive_output(5))['text']) for _ in bookings]
+            await sync_to_async(complete)()
+            status = json.loads((await customer.receive_output(5))['text'])
+            unsubscribed = await self.exchange(customer, {'action': 'unsubscribe', 'stream': 'location', 'bookings': bookings})
+            await self.close(provider, customer)
+            return fixes, status, unsubscribed
+
+        fixes, status, unsubscribed = async_to_sync(follow)()
+        self.assertEqual(sorted(fix['booking'] for fix in fixes), bookings)
+        self.assertEqual({fix['type'] for fix in fixes}, {'location'})
+        self.assertEqual(status, {'type': 'status', 'booking': str(data.in_progress.pk), 'status': 'COMPLETED'})
+        self.assertEqual(unsubscribed, {'type': 'unsubscribed', 'stream': 'location', 'bookings': []})
+
+    def test_chat_needs_a_subscription(self):
+        async def chat():
+            customer = await self.connect(self.data.customer)
+            reply = await self.exchange(customer, {
+                'action': 'chat', 'booking': str(self.data.in_progress.pk), 'message': 'Hello',
+            })
+            await self.close(customer)
+            return reply
+
+        self.assertEqual(async_to_sync(chat)()['type'], 'error')
+
+
+class ExportTests(TestCase):
+    """
+    Exports stream from async generators, a bounded number of rows at a time.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username='admin', user_type='ADMIN', is_staff=True)
+        User.objects.bulk_create([
+            User(username=f'export-{i:04}', user_type='CUSTOMER', email=f'e{i}@example.com') for i in range(450)
+        ])
+
+    def test_exports_are_async_streams(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {CustomTokenObtainPairSerializer.get_token(self.admin).access_token}')
+        response = client.get(reverse('admin-export', kwargs={'dataset': 'users', 'fmt': 'csv'}) + '?user_type=CUSTOMER')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        lines = streamed_content(response).decode().strip().split('\r\n')
+        self.assertEqual(lines[0].split(',')[:2], ['id', 'username'])
+        self.assertEqual(len(lines), 451)
+
+        response = client.get(reverse('admin-export', kwargs={'dataset': 'users', 'fmt': 'ndjson'}))
+        self.assertTrue(response.is_async)
+        rows = [json.loads(line) for line in streamed_content(response).splitlines()]
+        self.assertEqual(len(rows), 451)
+
+    def test_exports_hold_a_bounded_number_of_rows(self):
+        queryset = exports.export_queryset('users', filters={'user_type': 'CUSTOMER'})
+
+        async def consume(streamer):
+            stream = streamer('users', queryset)
+            self.assertTrue(hasattr(stream, '__aiter__'))
+            # The header (CSV) or the first row (NDJSON) goes out before the rest is read
+            chunks = [await stream.__anext__()]
+            chunks += [chunk async for chunk in stream]
+            return chunks
+
+        with mock.patch.object(exports, 'CHUNK_SIZE', 100), mock.patch.object(exports, 'ROWS_PER_WRITE', 40):
+            csv_chunks = async_to_sync(consume)(exports.stream_csv)
+            ndjson_chunks = async_to_sync(consume)(exports.stream_ndjson)
+
+        self.assertEqual(csv_chunks[0].count(b'\n'), 1)
+        self.assertLessEqual(max(chunk.count(b'\n') for chunk in csv_chunks), 40)
+        self.assertEqual(sum(chunk.count(b'\n') for chunk in csv_chunks), 451)
+        self.assertEqual(ndjson_chunks[0].count(b'\n'), 1)
+        self.assertLessEqual(max(chunk.count(b'\n') for chunk in ndjson_chunks), 40)
+        self.assertEqual(sum(chunk.count(b'\n') for chunk in ndjson_chunks), 450)
+
+    def test_malformed_filters_are_rejected(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {CustomTokenObtainPairSerializer.get_token(self.admin).access_token}')
+
+        def export(dataset, query):
+            return client.get(reverse('admin-export', kwargs={'dataset': dataset, 'fmt': 'csv'}) + query)
+
+        for dataset, query, error in (
+            ('bookings', '?service=abc', 'service must be a valid service'),
+            ('users', '?is_active=yes', 'is_active must be true or false'),
+        ):
+            with self.subTest(query=query):
+                response = export(dataset, query)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': error})
+        self.assertEqual(export('users', '?is_active=FALSE').status_code, 200)
+        self.assertEqual(export('bookings', '?service=7').status_code, 200)
+
+
+class BulkAdminTests(TestCase):
+    """
+    Bulk user actions refuse empty filters and report what a filter left out.
+    """
+
+    def setUp(self):
+        cache.clear()
+        admin = User.objects.create_user(username='admin', user_type='ADMIN', is_staff=True)
+        User.objects.bulk_create([User(username=f'bulk-{i}', user_type='CUSTOMER') for i in range(8)])
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {CustomTokenObtainPairSerializer.get_token(admin).access_token}')
+
+    def test_empty_filters_are_refused(self):
+        for filters in (
+            {'search': ''}, {'search': '  '}, {'search': None}, {'user_type': ''}, {'user_type': None},
+            {'user_type': 'ROBOT'}, {'is_active': None}, {'is_active': ''}, {'is_active': 'yes'},
+            {'user_type': 'CUSTOMER', 'search': ''},
+        ):
+            with self.subTest(filters=filters):
+                response = self.client.post(reverse('admin-users-bulk-suspend'), {'filter': filters}, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.data)
+        self.assertFalse(User.objects.filter(is_active=False).exists())
+
+    def test_filter_reports_matched_and_truncated(self):
+        url = reverse('admin-users-bulk-suspend')
+        body = {'filter': {'user_type': 'CUSTOMER', 'is_active': 'true'}}
+        with mock.patch('api.bulk_admin.MAX_BULK_USERS', 5), mock.patch('api.views.MAX_BULK_USERS', 5):
+            response = self.client.post(url, body, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual((response.data['matched'], response.data['truncated'], response.data['updated']), (8, 3, 5))
+
+            # The rest is picked up by the same request again
+            response = self.client.post(url, body, format='json')
+            self.assertEqual((response.data['matched'], response.data['truncated'], response.data['updated']), (3, 0, 3))
+        self.assertEqual(User.objects.filter(user_type='CUSTOMER', is_active=True).count(), 0)
+
+        response = self.client.post(url, {'ids': [User.objects.get(username='admin').pk, 10 ** 6]}, format='json')
+        self.assertEqual((response.data['matched'], response.data['truncated'], response.data['skipped']), (1, 0, 1))
+
+
+class UserStateTests(TestCase):
+    """
+    Suspensions and deletions reach the tokens already issued, whatever saved
+    the user.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username='admin', user_type='ADMIN', is_staff=True)
+        self.customer = User.objects.create_user(username='customer', user_type='CUSTOMER', email='c@example.com')
+        self.admin_client = self.client_for(self.admin)
+        self.customer_client = self.client_for(self.customer)
+
+    @staticmethod
+    def client_for(user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {CustomTokenObtainPairSerializer.get_token(user).access_token}')
+        return client
+
+    def statuses(self):
+        # A sync view and an async one, both authenticating from the token
+        return (
+            self.customer_client.get(reverse('service-category-list')).status_code,
+            self.customer_client.get(reverse('booking-list')).status_code,
+        )
+
+    def test_suspend_and_activate_reach_outstanding_tokens(self):
+        self.assertEqual(self.statuses(), (200, 200))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin_client.post(reverse('admin-users-suspend', kwargs={'pk': self.customer.pk}))
+        self.assertEqual(self.statuses(), (401, 401))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin_client.post(reverse('admin-users-activate', kwargs={'pk': self.customer.pk}))
+        self.assertEqual(self.statuses(), (200, 200))
+
+    def test_saves_outside_the_api_are_published(self):
+        user = User.objects.get(pk=self.customer.pk)
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save(update_fields=['is_active'])
+        self.assertEqual(self.statuses(), (401, 401))
+
+        # Saves that leave the claims alone publish nothing
+        cache.clear()
+        with self.captureOnCommitCallbacks() as callbacks:
+            User.objects.get(pk=self.customer.pk).save(update_fields=['last_login'])
+        self.assertEqual(callbacks, [])
+
+    def test_deleted_users_tokens_are_revoked(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.admin_client.delete(reverse('admin-users-detail', kwargs={'pk': self.customer.pk}))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.statuses(), (401, 401))
+
+    def test_deferred_fields_load_together(self):
+        token = CustomTokenObtainPairSerializer.get_token(self.customer)
+        user = user_from_state(self.customer.pk, get_user_state(self.customer.pk, token))
+        with self.assertNumQueries(1):
+            self.assertEqual((user.email, user.first_name, user.date_joined), (
+                self.customer.email, self.customer.first_name, self.customer.date_joined,
+            ))
+
+
+class HeatmapTests(TestCase):
+    """
+    The matching cutoff is opt-in, the backfill migration agrees with
+    rebuild() and the admin heatmap validates its filters.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.data = build_dataset(3)
+
+    def client_for(self, username):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.data.tokens[username].access_token}')
+        return client
+
+    def test_profile_writes_leave_the_location_alone(self):
+        # The location and the cell are only written by the location path, with
+        # a conditional UPDATE, and the heatmap; a full save of a stale profile
+        # would undo a ping
+        writes = [
+            (name, *scenario) for name in ('booking-rate-job', 'admin-users-detail', 'admin-users-suspend',
+                                           'admin-users-activate', 'admin-users-verify-provider')
+            for scenario in SCENARIOS[name] if scenario[0] != 'GET'
+        ] + [
+            ('provider-profile-detail', 'PATCH', 'provider',
+             lambda d: reverse('provider-profile-detail', kwargs={'user_id': d.provider.pk}), lambda d: {'bio': 'Plumber'}),
+        ]
+        for name, method, username, url, body in writes:
+            with self.subTest(endpoint=name), transaction.atomic():
+                with QueryMeter() as meter:
+                    response = self.client_for(username).generic(
+                        method, url(self.data), json.dumps(body(self.data)) if body else '', content_type='application/json',
+                    )
+                self.assertLess(response.status_code, 400)
+                # heatmap.sync_provider may still move the provider out of its cell
+                self.assertFalse([sql for sql in meter.statements if sql.startswith('UPDATE "api_serviceproviderprofile"')
+                                  and '"last_known_latitude" =' in sql])
+                transaction.set_rollback(True)
+
+    def test_matching_is_unbounded_unless_a_radius_is_set(self):
+        # About 330 km north of every provider
+        body = {'service_id': self.data.services[0].pk, 'latitude': CENTER[0] + 3, 'longitude': CENTER[1]}
+        client = self.client_for('customer')
+        with override_settings(MATCH_RADIUS_KM=25):
+            self.assertEqual(client.post(reverse('booking-list'), body, format='json').status_code, 400)
+        response = client.post(reverse('booking-list'), body, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_backfill_migration_matches_rebuild(self):
+        backfill = import_module('api.migrations.0009_backfill_heatmap').backfill_heatmap
+
+        def snapshot():
+            return (
+                sorted(HeatmapCell.objects.values_list('cell', 'service_id', 'providers', 'open_bookings')),
+                sorted(ServiceProviderProfile.objects.values_list('pk', 'heatmap_cell')),
+            )
+
+        heatmap.rebuild()
+        rebuilt = snapshot()
+        HeatmapCell.objects.all().delete()
+        ServiceProviderProfile.objects.update(heatmap_cell='')
+        backfill(django_apps, None)
+        self.assertEqual(snapshot(), rebuilt)
+        self.assertTrue(rebuilt[0])
+
+    def test_deleting_a_service_folds_its_cells(self):
+        # A provider without a service in the cell of a provider of services[1]
+        other = self.data.providers[1]
+        location = ServiceProviderProfile.objects.values_list('last_known_latitude', 'last_known_longitude').get(pk=other.pk)
+        ServiceProviderProfile.objects.filter(pk=self.data.providers[0].pk).update(
+            service_offered=None, last_known_latitude=location[0], last_known_longitude=location[1],
+        )
+        heatmap.rebuild()
+        cell = heatmap.cell_for(*location)
+
+        self.data.services[1].delete()
+        self.assertEqual(list(HeatmapCell.objects.filter(service=None, cell=cell).values_list('providers', flat=True)), [2])
+        counted = set(HeatmapCell.objects.exclude(providers=0, open_bookings=0).values_list(
+            'cell', 'service_id', 'providers', 'open_bookings'
+        ))
+        heatmap.rebuild()
+        self.assertEqual(counted, set(HeatmapCell.objects.values_list('cell', 'service_id', 'providers', 'open_bookings')))
+
+    def test_service_filter_must_be_an_id(self):
+        client = self.client_for('admin')
+        self.assertEqual(client.get(reverse('admin-heatmap'), {'service': 'abc'}).status_code, 400)
+        response = client.get(reverse('admin-heatmap'), {'service': self.data.services[0].pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({cell['service'] for cell in response.data['cells']}, {self.data.services[0].pk})
+
+
+class EtaTests(TestCase):
+    """
+    Road graphs are validated when loaded.
+    """
+
+    def graph_model(self, graph):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as graph_file:
+            json.dump(graph, graph_file)
+        self.addCleanup(os.unlink, graph_file.name)
+        return eta.RoadGraphModel(graph_file.name)
+
+    def test_invalid_graphs_are_refused_at_load(self):
+        nodes = {'a': [-6.79, 39.20], 'b': [-6.80, 39.21]}
+        for edges, message in (
+            ([['a', 'c', 60]], "unknown node 'c'"),
+            ([['a', 'b']], 'must be [from, to, seconds]'),
+            ([['a', 'b', -5]], 'invalid travel time'),
+            ([['a', 'b', 'slow']], 'invalid travel time'),
+        ):
+            with self.subTest(edges=edges), self.assertRaisesMessage(ValueError, message):
+                self.graph_model({'nodes': nodes, 'edges': edges})
+        with self.assertRaisesMessage(ValueError, '"nodes" must map node ids'):
+            self.graph_model({'nodes': {'a': [-6.79]}, 'edges': []})
+
+    def test_road_graph_estimates(self):
+        model = self.graph_model({
+            'nodes': {'a': [-6.79, 39.20], 'b': [-6.80, 39.20], 'c': [-6.81, 39.20], 'far': [-7.5, 39.9]},
+            'edges': [['a', 'b', 60], ['b', 'c', 90, True]],
+        })
+        to_c, unreachable = model.estimate([(-6.79, 39.20), (-7.5, 39.9)], (-6.81, 39.20))
+        self.assertAlmostEqual(to_c.seconds, 150)
+        # Not connected to the destination: the haversine fallback
+        self.assertEqual(unreachable, model.fallback.estimate([(-7.5, 39.9)], (-6.81, 39.20))[0])
+        # The one-way edge cannot be driven back
+        self.assertEqual(
+            model.estimate([(-6.81, 39.20)], (-6.79, 39.20))[0],
+            model.fallback.estimate([(-6.81, 39.20)], (-6.79, 39.20))[0],
+        )
+
+
+class RollupTests(TestCase):
+    """
+    The incrementally maintained rollups agree with rollups.rebuild(),
+    including bookings left without a service.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.data = build_dataset(3)
+
+    def client_for(self, username):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.data.tokens[username].access_token}')
+        return client
+
+    @staticmethod
+    def snapshot():
+        # Rows emptied by transitions are left in place, rebuild() does not write them
+        return sorted(
+            (row.bucket, row.service_id, row.status, row.count, row.revenue)
+            for row in BookingRollup.objects.exclude(count=0, revenue=0)
+        )
+
+    def test_incremental_rollups_match_rebuild(self):
+        customer, provider = self.client_for('customer'), self.client_for('provider')
+        created = customer.post(reverse('booking-list'), {
+            'service_id': self.data.services[0].pk, 'latitude': CENTER[0], 'longitude': CENTER[1],
+        }, format='json')
+        self.assertEqual(created.status_code, 201, created.content)
+        provider.post(booking_url('booking-accept-booking', self.data.pending))
+        provider.patch(booking_url('booking-start-job', self.data.accepted))
+        provider.patch(booking_url('booking-complete-job', self.data.in_progress))
+        self.client.post(reverse('mpesa-callback'), {
+            'Body': {'stkCallback': {'CheckoutRequestID': 'ws_CO_budget', 'ResultCode': 0, 'ResultDesc': 'OK'}},
+        }, content_type='application/json')
+
+        # A booking already without a service, in the same hour and status as the created one
+        orphan = Booking.objects.create(
+            customer=self.data.customer, provider=self.data.provider, service=None, status='PENDING',
+            booking_latitude=CENTER[0], booking_longitude=CENTER[1],
+        )
+        rollups.record_booking_created(orphan)
+
+        # The service's bookings and rows join it, and keep changing afterwards
+        self.data.services[0].delete()
+        provider.post(reverse('booking-decline-booking', kwargs={'pk': created.data['id']}))
+        provider.post(booking_url('booking-accept-booking', orphan))
+        self.assertEqual(
+            BookingRollup.objects.filter(service=None).values('bucket', 'status').annotate(rows=Count('id'))
+            .filter(rows__gt=1).count(), 0,
+        )
+
+        incremental = self.snapshot()
+        bookings = Booking.objects.order_by('created_at')
+        rollups.rebuild(bookings.first().created_at, bookings.last().created_at)
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_service_filter_must_be_an_id(self):
+        client = self.client_for('admin')
+        self.assertEqual(client.get(reverse('admin-booking-series'), {'service': 'abc'}).status_code, 400)
+        response = client.get(reverse('admin-booking-series'), {'service': self.data.services[0].pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['series'])
+
+
+class BackpressureTests(TestCase):
+    """
+    Outbound queues stay bounded, and a failed writer closes its connection.
+    """
+
+    class Consumer(backpressure.BoundedSendMixin):
+        # A consumer without a socket: records what it sends and how it closes
+        def __init__(self, maxsize, policy, fail=False):
+            self.outbound_maxsize = maxsize
+            self.outbound_policy = policy
+            self.fail = fail
+            self.sent = []
+            self.closed = None
+            self.unblocked = asyncio.Event()
+
+        async def send_outbound(self, item):
+            if self.fail:
+                raise ConnectionResetError('peer went away')
+            await self.unblocked.wait()
+            self.sent.append(item)
+
+        async def close(self, code=None):
+            self.closed = code
+
+    def test_drop_oldest_keeps_the_newest_items(self):
+        queue = backpressure.OutboundQueue(2, backpressure.DROP_OLDEST, name='DropTest')
+        self.assertTrue(all(queue.put(item) for item in (1, 2, 3)))
+        self.assertEqual(list(queue._items), [2, 3])
+        self.assertEqual(backpressure.outbound_stats()['DropTest']['dropped'], 1)
+
+    def test_overflow_closes_the_connection(self):
+        consumer = self.Consumer(2, backpressure.DISCONNECT)
+
+        async def run():
+            consumer.start_outbound()
+            for item in range(4):
+                await consumer.enqueue(item)
+            # Nothing is queued or sent once the connection is closed
+            consumer.unblocked.set()
+            await asyncio.sleep(0)
+            await consumer.enqueue('late')
+
+        async_to_sync(run)()
+        self.assertEqual(consumer.closed, backpressure.OVERFLOW_CLOSE_CODE)
+        self.assertIsNone(consumer._outbound_writer)
+        self.assertEqual(consumer.sent, [])
+
+    def test_slow_writer_sends_in_order(self):
+        consumer = self.Consumer(8, backpressure.DISCONNECT)
+
+        async def run():
+            consumer.start_outbound()
+            for item in range(5):
+                await consumer.enqueue(item)
+            consumer.unblocked.set()
+            while len(consumer.sent) < 5:
+                await asyncio.sleep(0)
+            await consumer.stop_outbound()
+
+        async_to_sync(run)()
+        self.assertEqual(consumer.sent, [0, 1, 2, 3, 4])
+        self.assertIsNone(consumer.closed)
+
+    def test_dead_writer_closes_the_connection(self):
+        consumer = self.Consumer(8, backpressure.DROP_OLDEST, fail=True)
+
+        async def run():
+            consumer.start_outbound()
+            await consumer.enqueue('first')
+            writer = consumer._outbound_writer
+            await writer
+            # Later events are ignored instead of piling up
+            await consumer.enqueue('second')
+
+        with self.assertLogs('api.backpressure', 'ERROR') as logs:
+            async_to_sync(run)()
+        self.assertIn('socket.writer_failed', logs.output[0])
+        self.assertEqual(consumer.closed, backpressure.WRITER_FAILED_CLOSE_CODE)
+        self.assertIsNone(consumer._outbound_writer)
+
+
+class ChannelLayerTests(TestCase):
+    """
+    Hash ring sharding and local-first group delivery.
+    """
+
+    def test_hash_ring_spreads_and_only_moves_keys_to_a_new_node(self):
+        keys = [f'chat_{uuid.UUID(int=i)}' for i in range(3000)]
+        three = channel_layers.HashRing(['redis-a:6379', 'redis-b:6379', 'redis-c:6379'])
+        four = channel_layers.HashRing(['redis-a:6379', 'redis-b:6379', 'redis-c:6379', 'redis-d:6379'])
+        before = [three.get(key) for key in keys]
+        self.assertEqual(before, [three.get(key) for key in keys])
+        self.assertTrue(all(before.count(node) > 600 for node in range(3)))
+
+        moved = [(old, four.get(key)) for old, key in zip(before, keys) if four.get(key) != old]
+        self.assertEqual({new for _, new in moved}, {3})
+        self.assertLess(len(moved), len(keys) * 0.35)
+
+        layer = channel_layers.ShardedRedisChannelLayer(hosts=[('redis-a', 6379), ('redis-b', 6379), ('redis-c', 6379)])
+        self.assertEqual([layer.consistent_hash(key) for key in keys[:100]], before[:100])
+
+    def test_local_first_delivery(self):
+        async def run():
+            inner = InMemoryChannelLayer()
+            first = channel_layers.LocalFirstChannelLayer(inner=inner)
+            second = channel_layers.LocalFirstChannelLayer(inner=inner)
+            first_member = await first.new_channel()
+            await first.group_add('chat_1', first_member)
+            first._grace_until.clear()
+
+            # No other node has members: delivered in-process, nothing published
+            with mock.patch.object(inner, 'group_send', wraps=inner.group_send) as published:
+                await first.group_send('chat_1', {'type': 'chat.message', 'text': 'local'})
+            self.assertEqual(published.call_count, 0)
+            self.assertEqual((await first.receive(first_member))['text'], 'local')
+
+            second_member = await second.new_channel()
+            await second.group_add('chat_1', second_member)
+            for _ in range(100):
+                if first.remote_nodes.get('chat_1'):
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(set(first.remote_nodes['chat_1']), {second.node_channel})
+
+            await first.group_send('chat_1', {'type': 'chat.message', 'text': 'both'})
+            self.assertEqual((await first.receive(first_member))['text'], 'both')
+            self.assertEqual((await asyncio.wait_for(second.receive(second_member), 1))['text'], 'both')
+
+            # A direct send to a channel of the other node goes through its reader
+            await second.send(first_member, {'type': 'chat.message', 'text': 'direct'})
+            self.assertEqual((await asyncio.wait_for(first.receive(first_member), 1))['text'], 'direct')
+            await first.close()
+            await second.close()
+
+        async_to_sync(run)()
+
+    def test_senders_outside_the_group_publish(self):
+        async def run():
+            inner = InMemoryChannelLayer()
+            socket_node = channel_layers.LocalFirstChannelLayer(inner=inner)
+            # e.g. an HTTP worker publishing a booking's new status, never in the group
+            http_node = channel_layers.LocalFirstChannelLayer(inner=inner)
+            member = await socket_node.new_channel()
+            await socket_node.group_add('chat_1', member)
+            socket_node._grace_until.clear()
+
+            await http_node.group_send('chat_1', {'type': 'context.refresh', 'status': 'COMPLETED'})
+            received = await asyncio.wait_for(socket_node.receive(member), 1)
+            await socket_node.close()
+            await http_node.close()
+            return received
+
+        self.assertEqual(async_to_sync(run)()['status'], 'COMPLETED')
+
+
+class TransitionTests(TestCase):
+    """
+    Provider transitions: the allowed steps, refused ones, and a request that
+    lost the race to a concurrent change.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.data = build_dataset(3)
+        self.provider = APIClient()
+        self.provider.credentials(HTTP_AUTHORIZATION=f"Bearer {self.data.tokens['provider'].access_token}")
+
+    def transition(self, name, booking):
+        method = self.provider.post if name in ('booking-accept-booking', 'booking-decline-booking') else self.provider.patch
+        return method(booking_url(name, booking))
+
+    def rollup_count(self, status):
+        return BookingRollup.objects.filter(status=status).aggregate(total=Sum('count'))['total'] or 0
+
+    def test_allowed_transitions(self):
+        declined = Booking.objects.create(
+            customer=self.data.customer, provider=self.data.provider, service=self.data.services[0],
+            status='PENDING', booking_latitude=CENTER[0], booking_longitude=CENTER[1],
+        )
+        for name, booking, to_status, timestamp in (
+            ('booking-accept-booking', self.data.pending, 'ACCEPTED', 'accepted_at'),
+            ('booking-decline-booking', declined, 'REJECTED', None),
+            ('booking-start-job', self.data.accepted, 'IN_PROGRESS', None),
+            ('booking-complete-job', self.data.in_progress, 'COMPLETED', 'completed_at'),
+        ):
+            with self.subTest(name):
+                with self.captureOnCommitCallbacks() as callbacks:
+                    response = self.transition(name, booking)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual((response.data['status'], response.data['applied']), (to_status, True))
+                booking.refresh_from_db()
+                self.assertEqual(booking.status, to_status)
+                if timestamp:
+                    self.assertIsNotNone(getattr(booking, timestamp))
+                # The status push to the booking's sockets
+                self.assertEqual(len(callbacks), 1)
+
+    def test_illegal_transitions_are_refused(self):
+        for name, booking in (
+            ('booking-start-job', self.data.pending),
+            ('booking-complete-job', self.data.accepted),
+            ('booking-accept-booking', self.data.in_progress),
+            ('booking-decline-booking', self.data.unpaid),
+        ):
+            with self.subTest(name):
+                before = Booking.objects.get(pk=booking.pk).status
+                response = self.transition(name, booking)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(f'status {before}', response.data['error'])
+                self.assertEqual(Booking.objects.get(pk=booking.pk).status, before)
+
+        # Someone else's booking and a malformed id look the same: not found
+        other = Booking.objects.create(
+            customer=self.data.customer, provider=self.data.providers[0], service=self.data.services[0],
+            status='PENDING', booking_latitude=CENTER[0], booking_longitude=CENTER[1],
+        )
+        self.assertEqual(self.transition('booking-accept-booking', other).status_code, 404)
+        self.assertEqual(self.provider.post('/api/bookings/not-a-uuid/accept_booking/').status_code, 404)
+
+    def test_lost_race_updates_nothing(self):
+        pending, accepted = self.rollup_count('PENDING'), self.rollup_count('ACCEPTED')
+        real_now = timezone.now
+
+        def declined_meanwhile():
+            # A concurrent decline lands between the request and its UPDATE
+            Booking.objects.filter(pk=self.data.pending.pk).update(status='REJECTED')
+            return real_now()
+
+        with mock.patch('api.booking_transitions.timezone.now', side_effect=declined_meanwhile), \
+                self.captureOnCommitCallbacks() as callbacks:
+            result = apply_transition(self.data.pending.pk, self.data.provider, 'accept')
+        self.assertEqual((result.applied, result.error, result.status), (False, 'invalid_status', 'REJECTED'))
+        self.assertEqual(callbacks, [])
+        self.assertEqual((self.rollup_count('PENDING'), self.rollup_count('ACCEPTED')), (pending, accepted))
+
+        # A double tap: the second UPDATE matches no row and is reported, not applied twice
+        booking = self.data.accepted
+        self.assertEqual(self.transition('booking-start-job', booking).status_code, 200)
+        self.assertEqual(self.transition('booking-start-job', booking).status_code, 400)
+        self.assertEqual(self.rollup_count('ACCEPTED'), accepted - 1)
+
+
+class SocketAuthTests(TestCase):
+    """
+    The websocket JWT middleware: where the token comes from, the claims
+    cache, and users rebuilt without a query.
+    """
+
+    def setUp(self):
+        cache.clear()
+        middleware._claims_cache.clear()
+        self.customer = User.objects.create_user(username='customer', user_type='CUSTOMER')
+        self.token = str(CustomTokenObtainPairSerializer.get_token(self.customer).access_token)
+
+    def handshake(self, query_string=b'', subprotocols=()):
+        seen = {}
+
+        async def inner(scope, receive, send):
+            seen.update(scope)
+
+        app = middleware.JWTAuthMiddleware(inner)
+        async_to_sync(app)({'type': 'websocket', 'query_string': query_string, 'subprotocols': list(subprotocols)},
+                           None, None)
+        return seen['user'], seen['auth_subprotocol']
+
+    def test_token_from_query_string_or_subprotocol(self):
+        with self.assertNumQueries(0):
+            user, subprotocol = self.handshake(query_string=f'token={self.token}'.encode())
+        self.assertEqual((user.pk, user.username, subprotocol), (self.customer.pk, 'customer', None))
+
+        user, subprotocol = self.handshake(subprotocols=['access_token', self.token])
+        self.assertEqual((user.pk, subprotocol), (self.customer.pk, 'access_token'))
+
+        for anonymous in (self.handshake(), self.handshake(query_string=b'token=garbage'),
+                          self.handshake(subprotocols=['access_token'])):
+            self.assertFalse(anonymous[0].is_authenticated)
+
+    def test_claims_are_verified_once_per_token(self):
+        with mock.patch.object(middleware, 'AccessToken', wraps=middleware.AccessToken) as verify:
+            for _ in range(3):
+                self.assertEqual(middleware.decode_token(self.token)['user_id'], self.customer.pk)
+            self.assertIsNone(middleware.decode_token('garbage'))
+            self.assertIsNone(middleware.decode_token('garbage'))
+        # Invalid tokens are not cached, they are rejected by the verification itself
+        self.assertEqual(verify.call_count, 3)
+
+        expired = CustomTokenObtainPairSerializer.get_token(self.customer).access_token
+        expired.set_exp(lifetime=-timedelta(seconds=1))
+        self.assertIsNone(middleware.decode_token(str(expired)))
+
+    def test_suspended_and_legacy_tokens(self):
+        user = User.objects.get(pk=self.customer.pk)
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save(update_fields=['is_active'])
+        # The claims are cached, the published suspension still wins
+        self.assertFalse(self.handshake(query_string=f'token={self.token}'.encode())[0].is_authenticated)
+
+        cache.clear()
+        User.objects.filter(pk=self.customer.pk).update(is_active=True)
+        # A token issued before the state claims existed is looked up
+        legacy = str(AccessToken.for_user(self.customer))
+        with self.assertNumQueries(1):
+            user, _ = self.handshake(query_string=f'token={legacy}'.encode())
+        self.assertEqual(user.pk, self.customer.pk)
+
+
+class DatabaseProfileTests(TestCase):
+    """
+    The DB_ENGINE profiles, and persistent connections on an SQLite file like
+    the development database.
+    """
+
+    def databases_for(self, **environ):
+        env = {key: value for key, value in os.environ.items() if not key.startswith('DB_')}
+        env.update(SECRET_KEY='x', **environ)
+        code = 'import json; from quickassist_project.settings import base; print(json.dumps(base.DATABASES, default=str))'
+        loaded = subprocess.run([sys.executable, '-c', code], env=env, cwd=settings.BASE_DIR,
+                                capture_output=True, text=True, check=True)
+        return json.loads(loaded.stdout)
+
+    def file_connection(self, directory, **overrides):
+        settings_dict = {**connections.settings['default'], 'NAME': os.path.join(directory, 'db.sqlite3'), **overrides}
+        return connections['default'].__class__(settings_dict, alias='profile')
+
+    def test_profiles(self):
+        sqlite = self.databases_for()['default']
+        self.assertEqual(sqlite['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual((sqlite['CONN_MAX_AGE'], sqlite['CONN_HEALTH_CHECKS']), (60, True))
+        self.assertEqual(sqlite['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+
+        postgres = self.databases_for(DB_ENGINE='postgres', DB_CONN_MAX_AGE='300')['default']
+        self.assertEqual(postgres['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((postgres['CONN_MAX_AGE'], postgres['OPTIONS']), (300, {}))
+
+        # The pool replaces persistent connections
+        pooled = self.databases_for(DB_ENGINE='postgres', DB_POOL='True', DB_POOL_MAX_SIZE='8')['default']
+        self.assertEqual(pooled['CONN_MAX_AGE'], 0)
+        self.assertEqual(pooled['OPTIONS']['pool'], {'min_size': 2, 'max_size': 8, 'timeout': 10})
+
+    def test_connection_is_kept_across_requests(self):
+        with tempfile.TemporaryDirectory() as directory:
+            persistent = self.file_connection(directory)
+            with persistent.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], 'wal')
+            opened = persistent.connection
+            # What close_old_connections does at the end of each request
+            persistent.close_if_unusable_or_obsolete()
+            self.assertIs(persistent.connection, opened)
+            persistent.close()
+
+            per_request = self.file_connection(directory, CONN_MAX_AGE=0)
+            per_request.ensure_connection()
+            per_request.close_if_unusable_or_obsolete()
+            self.assertIsNone(per_request.connection)
+
+    def test_concurrent_writers_wait_for_the_lock(self):
+        with tempfile.TemporaryDirectory() as directory:
+            locked = threading.Event()
+
+            def hold_the_lock():
+                # atomic() looks the alias up in this thread's connections
+                connections['profile'] = writer = self.file_connection(directory)
+                with writer.cursor() as cursor:
+                    cursor.execute('CREATE TABLE pings (id INTEGER PRIMARY KEY)')
+                with transaction.atomic(using='profile'), writer.cursor() as cursor:
+                    cursor.execute('INSERT INTO pings DEFAULT VALUES')
+                    locked.set()
+                    time.sleep(0.2)
+                writer.close()
+                del connections['profile']
+
+            holder = threading.Thread(target=hold_the_lock)
+            holder.start()
+            locked.wait(5)
+            second = self.file_connection(directory)
+            # Blocks on the busy timeout instead of failing with "database is locked"
+            with second.cursor() as cursor:
+                cursor.execute('INSERT INTO pings DEFAULT VALUES')
+                cursor.execute('SELECT COUNT(*) FROM pings')
+                self.assertEqual(cursor.fetchone()[0], 2)
+            holder.join()
+            second.close()
+
+
+class ReplicaRouterTests(TestCase):
+    """
+    Which reads @read_from_replica sends to the replica. The test database has
+    no replica, so reads are recorded where the router sends them and then run
+    on the primary.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.data = build_dataset(1)
+        self.routed = []
+        db_for_read = db_router.PrimaryReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            self.routed.append(db_for_read(router, model, **hints))
+            return 'default'
+
+        configured = SimpleNamespace(databases={'default': {}, db_router.REPLICA_DB: {}})
+        for patch in (mock.patch.object(db_router, 'connections', configured),
+                      mock.patch.object(db_router.PrimaryReplicaRouter, 'db_for_read', record)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def reads_of(self, client, method, path, **data):
+        self.routed.clear()
+        response = getattr(client, method)(path, data, format='json')
+        return response.status_code, set(self.routed)
+
+    def test_router(self):
+        router = db_router.PrimaryReplicaRouter()
+        router.db_for_read(User)
+        token = db_router._replica_reads.set(True)
+        try:
+            router.db_for_read(User)
+            self.assertEqual(router.db_for_write(User), 'default')
+            with mock.patch.object(db_router, 'connections', SimpleNamespace(databases={'default': {}})):
+                router.db_for_read(User)
+        finally:
+            db_router._replica_reads.reset(token)
+        self.assertEqual(self.routed, ['default', db_router.REPLICA_DB, 'default'])
+
+    def test_reads_stay_on_the_primary_after_a_write(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.data.tokens['provider'].access_token}")
+        profile = f'/api/providers/{self.data.provider.pk}/'
+        self.assertEqual(self.reads_of(APIClient(), 'get', '/api/providers/'), (200, {db_router.REPLICA_DB}))
+        self.assertEqual(self.reads_of(client, 'get', profile), (200, {db_router.REPLICA_DB}))
+        # Outside the view, reads are back on the primary
+        self.assertFalse(db_router._replica_reads.get())
+
+        # A rejected write does not pin
+        self.assertEqual(self.reads_of(client, 'patch', profile, bio=None)[0], 400)
+        self.assertEqual(self.reads_of(client, 'get', profile), (200, {db_router.REPLICA_DB}))
+
+        self.assertEqual(self.reads_of(client, 'patch', profile, bio='Plumber')[0], 200)
+        self.assertEqual(self.reads_of(client, 'get', profile), (200, {'default'}))
+        # Only the writer is pinned
+        self.assertEqual(self.reads_of(APIClient(), 'get', '/api/providers/'), (200, {db_router.REPLICA_DB}))
+
+        # Until the window ends
+        cache.delete(db_router.PRIMARY_PIN_KEY.format(self.data.provider.pk))
+        self.assertEqual(self.reads_of(client, 'get', profile), (200, {db_router.REPLICA_DB}))
+
+
+class FastJSONTests(TestCase):
+    """
+    The orjson renderer and parser are drop-in replacements for DRF's.
+    """
+    payload = {
+        'id': uuid.UUID(int=7), 'price': Decimal('12.50'), 'label': gettext_lazy('Plumbing'),
+        'by_hour': {3: [1, 2.5, None]}, 'name': 'Añasi', 'done': True,
+        'at': datetime(2026, 10, 19, 3, 1, 2, 345678, tzinfo=dt_timezone.utc),
+        'local': datetime(2026, 10, 19, 6, 1, 2, tzinfo=dt_timezone(timedelta(hours=3))),
+        'naive': datetime(2026, 10, 19, 3, 1, 2, 5), 'day': date(2026, 10, 19), 'opens': dt_time(8, 30, 0, 123456),
+    }
+
+    def test_endpoints_render_like_drf(self):
+        data = build_dataset(1)
+        for name, scenarios in SCENARIOS.items():
+            for method, username, url, body in scenarios:
+                if method != 'GET':
+                    continue
+                client = APIClient()
+                if username:
+                    client.credentials(HTTP_AUTHORIZATION=f"Bearer {data.tokens[username].access_token}")
+                response = client.get(url(data))
+                # The async views and the exports render their own bodies
+                if getattr(response, 'data', None) is None:
+                    continue
+                with self.subTest(endpoint=name, user=username):
+                    self.assertEqual(json.loads(FastJSONRenderer().render(response.data)),
+                                     json.loads(JSONRenderer().render(response.data)))
+
+    def test_renderer(self):
+        rendered = json.loads(FastJSONRenderer().render(self.payload))
+        self.assertEqual(rendered, json.loads(JSONRenderer().render(self.payload)))
+        # DRF's datetime format: 'Z' for UTC
+        self.assertEqual((rendered['at'], rendered['local']), ('2026-10-19T03:01:02.345678Z', '2026-10-19T06:01:02+03:00'))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+        # Indented output for the browsable API and ?indent requests is DRF's own
+        indented = 'application/json; indent=2'
+        self.assertEqual(FastJSONRenderer().render(self.payload, indented), JSONRenderer().render(self.payload, indented))
+
+    def test_parser(self):
+        body = json.dumps({'bio': 'Añasi', 'rating': 4.5}).encode()
+        self.assertEqual(FastJSONParser().parse(BytesIO(body)), {'bio': 'Añasi', 'rating': 4.5})
+        with self.assertRaisesMessage(ParseError, 'JSON parse error - '):
+            FastJSONParser().parse(BytesIO(b'{"bio": '))
+
+        data = build_dataset(1)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {data.tokens['provider'].access_token}")
+        response = client.patch(f'/api/providers/{data.provider.pk}/', '{"bio": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.json()['detail'].startswith('JSON parse error - '))
+
+    def test_standard_library_fallback(self):
+        code = (
+            'import sys, uuid; from decimal import Decimal; import django; django.setup()\n'
+            'from api import fastjson; print(fastjson.orjson is None, fastjson.dumps_str({"id": uuid.UUID(int=7), '
+            '"price": Decimal("12.50"), 3: [1, 2.5, None], "name": "Añasi"}), fastjson.loads(b\'{"a": 1}\'))'
+        )
+        outputs = []
+        for block in ('', 'sys.modules["orjson"] = None; '):
+            ran = subprocess.run(
+                [sys.executable, '-c', 'import sys; ' + block + code], cwd=settings.BASE_DIR, capture_output=True,
+                text=True, check=True, env={**os.environ, 'SECRET_KEY': 'x', 'PYTHONIOENCODING': 'utf-8'},
+            )
+            outputs.append(ran.stdout.split(' ', 1))
+        self.assertEqual([fallback for fallback, _ in outputs], ['False', 'True'])
+        self.assertEqual(outputs[0][1], outputs[1][1])
+
+
+class LocationCodecTests(TestCase):
+    """
+    The binary location frames, and the location socket speaking them to
+    clients that offer the subprotocol.
+    """
+
+    def test_round_trip(self):
+        encoder, decoder = LocationEncoder(keyframe_interval=3), LocationDecoder()
+        trace = [(CENTER[0] + i * 0.0001, CENTER[1] - i * 0.00005) for i in range(6)] + [(-1.2921, 36.8219)]
+        frames = [encoder.encode(latitude, longitude) for latitude, longitude in trace]
+        # A key frame first, every 3 deltas and for a jump beyond 16 bits
+        self.assertEqual([len(frame) for frame in frames], [11, 7, 7, 7, 11, 7, 11])
+        for seq, ((latitude, longitude), frame) in enumerate(zip(trace, frames)):
+            decoded = decoder.decode(frame)
+            self.assertEqual(decoded[0], seq)
+            self.assertAlmostEqual(decoded[1], latitude, places=6)
+            self.assertAlmostEqual(decoded[2], longitude, places=6)
+
+    def test_sequence_wraps_and_bad_frames_are_dropped(self):
+        encoder = LocationEncoder()
+        encoder.seq = 0xFFFF
+        self.assertEqual([LocationDecoder().decode(encoder.encode(*CENTER))[0], encoder.seq], [0xFFFF, 0])
+
+        delta = encoder.encode(CENTER[0] + 0.001, CENTER[1])
+        self.assertIsNone(LocationDecoder().decode(delta), 'delta before any key frame')
+        self.assertIsNone(LocationDecoder().decode(b'\x01\x00'))
+        self.assertIsNone(LocationDecoder().decode(b'\x03' + bytes(10)))
+
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+    def test_socket_sends_binary_frames_to_binary_clients(self):
+        data = build_dataset(1)
+        application = URLRouter(websocket_urlpatterns)
+
+        async def connect(user, subprotocols):
+            communicator = ApplicationCommunicator(application, {
+                'type': 'websocket', 'path': f'/ws/location/{data.in_progress.pk}/', 'user': user,
+                'subprotocols': subprotocols, 'headers': [], 'query_string': b'',
+            })
+            await communicator.send_input({'type': 'websocket.connect'})
+            return communicator, await communicator.receive_output(5)
+
+        trace = [(CENTER[0] + 0.0002, CENTER[1]), (CENTER[0] + 0.0003, CENTER[1] - 0.0001)]
+
+        async def exchange():
+            binary, accepted = await connect(data.customer, [BINARY_SUBPROTOCOL])
+            text, _ = await connect(data.customer, [])
+            provider, _ = await connect(data.provider, [BINARY_SUBPROTOCOL])
+            encoder, decoder, received = LocationEncoder(), LocationDecoder(), []
+            for latitude, longitude in trace:
+                await provider.send_input({'type': 'websocket.receive', 'bytes': encoder.encode(latitude, longitude)})
+                frame = await binary.receive_output(5)
+                received.append((decoder.decode(frame['bytes']), json.loads((await text.receive_output(5))['text'])))
+            # Malformed frames are ignored
+            await provider.send_input({'type': 'websocket.receive', 'bytes': b'\x02\x00'})
+            nothing = await binary.receive_nothing(0.2)
+            for communicator in (binary, text, provider):
+                await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+                await communicator.wait(5)
+            return accepted, received, nothing
+
+        accepted, received, nothing = async_to_sync(exchange)()
+        self.assertEqual(accepted['subprotocol'], BINARY_SUBPROTOCOL)
+        for seq, ((latitude, longitude), (decoded, text)) in enumerate(zip(trace, received)):
+            self.assertEqual(decoded[0], seq)
+            self.assertAlmostEqual(decoded[1], latitude, places=6)
+            self.assertAlmostEqual(text['longitude'], longitude, places=6)
+        self.assertEqual(len(received), 2)
+        self.assertTrue(nothing)
+
+
+class LoadHarnessTests(TransactionTestCase):
+    """
+    The in-process load harness (api/loadtest.py). A TransactionTestCase: the
+    ASGI handler runs each request in a thread of its own, which does not see
+    a test transaction.
+    """
+
+    def test_recorder_summary(self):
+        recorder = loadtest.LatencyRecorder()
+        for milliseconds in range(1, 101):
+            recorder.record('GET /api/services/', milliseconds / 1000, ok=milliseconds != 50)
+        recorder.stop()
+        row, = recorder.summary()
+        self.assertEqual((row['route'], row['count'], row['errors']), ('GET /api/services/', 100, 1))
+        self.assertEqual([round(row[key]) for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms')], [50, 95, 99, 100])
+        self.assertIsNone(loadtest.percentile([], 0.5))
+
+    def test_client_and_stub_mpesa(self):
+        cache.clear()
+        data = build_dataset(1)
+        done = Booking.objects.create(
+            customer=data.customer, provider=data.provider, service=data.services[0], status='COMPLETED',
+            booking_latitude=CENTER[0], booking_longitude=CENTER[1],
+        )
+        customer = str(data.tokens['customer'].access_token)
+        other = Booking.objects.exclude(customer=data.customer).first()
+        mpesa = loadtest.StubMpesaServer(callback_delay=0).start()
+        self.addCleanup(mpesa.stop)
+        credentials = {'MPESA_CONSUMER_KEY': 'stub', 'MPESA_CONSUMER_SECRET': 'stub',
+                       'MPESA_SHORTCODE': '174379', 'MPESA_PASSKEY': 'stub'}
+
+        async def run(client):
+            paid = await client.request('pay', 'POST', f'/api/bookings/{done.pk}/pay_for_job/', customer,
+                                        {'payment_method': 'M-PESA'})
+            stop = asyncio.Event()
+            stop.set()
+            await mpesa.deliver_callbacks(client, stop, interval=0)
+            refused = await client.websocket('socket', f'/ws/location/{other.pk}/', customer)
+            missing = await client.request('missing', 'GET', f'/api/bookings/{uuid.UUID(int=1)}/', customer)
+            return paid, refused, missing
+
+        with override_settings(MPESA_BASE_URL=mpesa.url,
+                               CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}), \
+                mock.patch.dict(os.environ, credentials):
+            from quickassist_project.asgi import application
+            recorder = loadtest.LatencyRecorder()
+            (paid_status, _), refused, (missing_status, _) = asyncio.run(run(loadtest.AsgiClient(application, recorder)))
+
+        self.assertEqual(paid_status, 200)
+        self.assertEqual(Payment.objects.get(booking=done).status, 'SUCCESS')
+        self.assertIsNone(refused)
+        self.assertEqual(missing_status, 404)
+        errors = {row['route']: row['errors'] for row in recorder.summary()}
+        self.assertEqual(errors, {'pay': 0, 'POST /api/payments/callback/': 0, 'socket': 1, 'missing': 1})
+
+    def test_command(self):
+        report = os.path.join(tempfile.mkdtemp(), 'report.json')
+        self.addCleanup(os.remove, report)
+        call_command(
+            'loadtest', providers=2, customers=2, duration=2, ramp_up=0.1, ping_interval=0.2, poll_every=1,
+            job_pings=1, job_timeout=1, think_time=0.3, mpesa_latency=0, mpesa_callback_delay=0.1,
+            json_path=report, stdout=StringIO(),
+        )
+        with open(report) as report_file:
+            routes = {row['route']: row for row in json.load(report_file)['routes']}
+        for route in ('PATCH /api/provider/status/', 'POST /api/provider/location/', 'GET /api/categories/',
+                      'POST /api/bookings/'):
+            self.assertGreater(routes[route]['count'], 0, route)
+        # The simulated users, and everything they did, are removed
+        self.assertFalse(User.objects.filter(username__startswith='load-').exists())
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(BookingRollup.objects.filter(count__gt=0).count(), 0)
+
+
+class SeedScaleTests(TestCase):
+    """
+    The seed_scale command generates a consistent, reproducible dataset.
+    """
+    options = {'customers': 30, 'providers': 12, 'bookings': 300, 'days': 10, 'batch_size': 64}
+
+    def seed(self, **options):
+        call_command('seed_scale', **{**self.options, **options}, stdout=StringIO())
+
+    def snapshot(self):
+        # Without the timestamps, which are relative to now
+        return list(Booking.objects.order_by('id').values_list(
+            'id', 'status', 'service_id', 'booking_latitude', 'customer__username', 'provider__username',
+        ))
+
+    def test_dataset(self):
+        self.seed()
+        now = timezone.now()
+        bookings = Booking.objects.select_related('provider__provider_profile')
+        self.assertEqual(User.objects.filter(username__startswith='seed-c').count(), 30)
+        self.assertEqual(ServiceProviderProfile.objects.filter(user__username__startswith='seed-p').count(), 12)
+        self.assertEqual(bookings.count(), 300)
+        for booking in bookings:
+            profile = booking.provider.provider_profile
+            self.assertTrue(profile.is_verified)
+            self.assertEqual(profile.service_offered_id, booking.service_id)
+            self.assertEqual(booking.final_price is not None, booking.status == 'COMPLETED')
+        # The generated timestamps are stored, open bookings are recent
+        created = [booking.created_at for booking in bookings]
+        self.assertGreater(max(created) - min(created), timedelta(days=5))
+        self.assertTrue(all(now - timedelta(days=11) < moment < now for moment in created))
+        self.assertFalse(bookings.filter(status__in=heatmap.OPEN_STATUSES, created_at__lt=now - timedelta(hours=3)).exists())
+        self.assertTrue(Booking._meta.get_field('created_at').auto_now_add)
+
+        completed = bookings.filter(status='COMPLETED')
+        self.assertEqual(Payment.objects.filter(status='SUCCESS').count(), completed.count())
+        self.assertFalse(Payment.objects.exclude(booking__status='COMPLETED').exists())
+        self.assertFalse(Rating.objects.exclude(booking__status='COMPLETED').exists())
+        rated = ServiceProviderProfile.objects.filter(user__received_ratings__isnull=False).annotate(
+            average=Avg('user__received_ratings__score')
+        ).distinct()
+        for profile in rated:
+            self.assertAlmostEqual(profile.average_rating, profile.average)
+
+        # The derived tables are rebuilt
+        self.assertEqual(BookingRollup.objects.aggregate(total=Sum('count'))['total'], 300)
+        self.assertEqual(HeatmapCell.objects.aggregate(total=Sum('open_bookings'))['total'],
+                         bookings.filter(status__in=heatmap.OPEN_STATUSES).count())
+
+    def test_same_seed_same_dataset(self):
+        self.seed(skip_derived=True)
+        first = self.snapshot()
+        with self.assertRaisesMessage(CommandError, "use --reset or another --prefix"):
+            self.seed(skip_derived=True)
+        self.seed(skip_derived=True, reset=True)
+        self.assertEqual(self.snapshot(), first)
+        self.seed(skip_derived=True, prefix='other-', seed=2)
+        others = Booking.objects.filter(customer__username__startswith='other-')
+        self.assertEqual(others.count(), 300)
+        self.assertFalse(others.filter(id__in=[row[0] for row in first]).exists())
+
+    def test_needs_users(self):
+        with self.assertRaisesMessage(CommandError, 'At least one customer and one provider'):
+            self.seed(providers=0)
+
+
+class BenchmarkTests(TransactionTestCase):
+    """
+    The micro-benchmarks and run_benchmarks. A TransactionTestCase: the consumer
+    and view benchmarks commit their fixtures for other threads to read.
+    """
+
+    def test_every_benchmark_runs_and_cleans_up(self):
+        # One request at a time: the in-memory test database locks whole tables
+        # for concurrent writers, where the SQLite file waits (see settings)
+        with mock.patch.object(benchmarks, 'CONCURRENCY', 1):
+            for name, bench in benchmarks.BENCHMARKS.items():
+                with self.subTest(benchmark=name):
+                    result = bench.run(rounds=1)
+                    self.assertEqual(result['rounds'], 1)
+                    self.assertLessEqual(result['min'], result['median'])
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(ServiceCategory.objects.exists())
+        self.assertFalse(Booking.objects.exists())
+
+    def test_warm_up_and_teardown(self):
+        calls, torn_down = [], []
+        bench = benchmarks.Benchmark('counted', calls.append, setup=lambda: 'state', teardown=torn_down.append, rounds=3)
+        self.assertEqual(bench.run()['rounds'], 3)
+        self.assertEqual((calls, torn_down), (['state'] * 4, ['state']))
+
+        def fail(state):
+            raise RuntimeError('broken')
+
+        with self.assertRaisesMessage(RuntimeError, 'broken'):
+            benchmarks.Benchmark('failing', fail, setup=lambda: 'state', teardown=torn_down.append).run()
+        self.assertEqual(torn_down, ['state', 'state'])
+
+    def test_baseline(self):
+        history = [{'machine': 'a', 'results': {'geo': {'median': median}}} for median in (9, 1, 2, 3)]
+        history.insert(2, {'machine': 'b', 'results': {'geo': {'median': 100}}})
+        self.assertEqual(benchmarks.baseline(history, 'geo', 'a', window=3), 2)
+        self.assertEqual(benchmarks.baseline(history, 'geo', 'a', window=10), 2.5)
+        self.assertIsNone(benchmarks.baseline(history, 'serialize', 'a', window=3))
+
+    def test_command(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'history.json')
+        out = StringIO()
+        call_command('run_benchmarks', 'geo.*', list=True, stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), ['geo.haversine[10000 calls]', 'geo.eta_batch[10000 origins]'])
+        with self.assertRaisesMessage(CommandError, 'No benchmark matches'):
+            call_command('run_benchmarks', 'nothing.*', history=path, stdout=StringIO())
+
+        call_command('run_benchmarks', 'geo.*', rounds=2, history=path, stdout=StringIO())
+        history = benchmarks.load_history(path)
+        self.assertEqual(len(history), 1)
+        self.assertEqual(history[0]['machine'], benchmarks.machine_id())
+        self.assertEqual({name: result['rounds'] for name, result in history[0]['results'].items()},
+                         {'geo.haversine[10000 calls]': 2, 'geo.eta_batch[10000 origins]': 2})
+
+        # A run slower than the recorded baseline by more than the threshold is a
+        # regression; timings are stubbed so the outcome does not depend on the machine
+        history[0]['results']['geo.haversine[10000 calls]']['median'] = 0.5
+        history[0]['results']['geo.eta_batch[10000 origins]']['median'] = 0.9
+        benchmarks.save_history(path, history)
+        timed = {'rounds': 2, 'min': 1.0, 'median': 1.0, 'mean': 1.0}
+        with mock.patch.object(benchmarks.Benchmark, 'run', return_value=timed), \
+                self.assertRaisesMessage(CommandError, '1 benchmark(s) slower than the baseline by more than 25%: '
+                                                       'geo.haversine[10000 calls]'):
+            call_command('run_benchmarks', 'geo.*', history=path, no_save=True, check=True, stdout=StringIO())
+        self.assertEqual(len(benchmarks.load_history(path)), 1)
@@ -4,9 +4,12 @@ from .views import (
     ProviderStatusView, ProviderLocationView, BookingViewSet, 
     ProviderProfileViewSet, MpesaCallbackView, AdminStatsView, AdminUserViewSet,
     AdminRecentBookingsView, CurrentProviderProfileView, ServiceListView, CustomTokenObtainPairView,
-    ServiceCategoryViewSet, ServiceViewSet
+    ServiceCategoryViewSet, ServiceViewSet, AdminBookingSeriesView, AdminExportView,
+    AdminHeatmapView, AdminProfileListView, AdminProfileDetailView, AdminProfileTokenView
 )
+from django.conf import settings
 from rest_framework.routers import DefaultRouter 
+from . import async_views
 
 # Import the pre-built views from simplejwt
 from rest_framework_simplejwt.views  import (  
@@ -45,8 +48,30 @@ urlpatterns = [
     # Admin Endpoints
     path('admin/stats/', AdminStatsView.as_view(), name='admin-stats'),
     path('admin/recent-bookings/', AdminRecentBookingsView.as_view(), name='admin-recent-bookings'),
+    path('admin/analytics/bookings/', AdminBookingSeriesView.as_view(), name='admin-booking-series'),
+    path('admin/heatmap/', AdminHeatmapView.as_view(), name='admin-heatmap'),
+    path('admin/export/<str:dataset>.<str:fmt>', AdminExportView.as_view(), name='admin-export'),
+    path('admin/profiles/', AdminProfileListView.as_view(), name='admin-profiles'),
+    path('admin/profiles/token/', AdminProfileTokenView.as_view(), name='admin-profile-token'),
+    path('admin/profiles/<str:profile_id>/', AdminProfileDetailView.as_view(), name='admin-profile-detail'),
 ]
 
 urlpatterns += [
     path('payments/callback/', MpesaCallbackView.as_view(), name='mpesa-callback'),
-]
\ No newline at end of file
+]
+
+# The routes served by the sync views only, kept to compare both (api/benchmarks.py)
+sync_urlpatterns = urlpatterns
+
+# Native async handlers for the hot paths (api/async_views.py), ahead of the
+# sync routes they take over
+async_urlpatterns = [
+    path('bookings/', async_views.BookingListView.as_view(), name='booking-list'),
+    path('bookings/<str:pk>/', async_views.BookingDetailView.as_view(), name='booking-detail'),
+    path('provider/status/', async_views.ProviderStatusView.as_view(), name='provider-status'),
+    path('provider/location/', async_views.ProviderLocationView.as_view(), name='provider-location'),
+    path('payments/callback/', async_views.MpesaCallbackView.as_view(), name='mpesa-callback'),
+]
+
+if settings.ASYNC_VIEWS:
+    urlpatterns = async_urlpatterns + sync_urlpatterns
@@ -0,0 +1,178 @@
+# In api/user_state.py
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import User, ServiceProviderProfile
+
+# Keys under which the authorization state of a user is published to the cache.
+# The cache must be shared by every process (CACHE_URL, required by the prod
+# settings), or a suspension only reaches the process that made it.
+USER_STATE_KEY = 'user_state:{}'
+
+# The claims embedded in every token issued by CustomTokenObtainPairSerializer
+STATE_CLAIMS = ('username', 'user_type', 'is_active', 'is_verified', 'profile_id')
+
+# The fields of each model the claims are built from
+USER_STATE_FIELDS = {'username', 'user_type', 'is_active'}
+PROFILE_STATE_FIELDS = {'is_verified'}
+
+
+def _state_timeout():
+    """
+    A published state must outlive every token that may still carry the old claims.
+    Access tokens are minted from refresh tokens by copying their claims, so the
+    refresh lifetime is the upper bound.
+    """
+    return int(settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME'].total_seconds())
+
+
+def build_user_state(user):
+    """
+    Build the compact authorization state of a user (and its provider profile).
+    """
+    profile = None
+    if user.user_type == 'PROVIDER':
+        profile = getattr(user, 'provider_profile', None)
+    return {
+        'username': user.username,
+        'user_type': user.user_type,
+        'is_active': user.is_active,
+        'is_verified': profile.is_verified if profile is not None else False,
+        'profile_id': profile.pk if profile is not None else None,
+    }
+
+
+def publish_user_state(user):
+    """
+    Publish the current state of a user after it changed (suspend, activate,
+    verify...). Tokens issued before the change still carry the old claims, so
+    authentication prefers the published state until they expire.
+
+    Every save of a User or a provider profile publishes through the signal
+    receivers below; only queryset updates, which send no signals, call this
+    (or publish_user_states) themselves.
+    """
+    cache.set(USER_STATE_KEY.format(user.pk), build_user_state(user), _state_timeout())
+
+
+def publish_user_states(users):
+    """
+    Bulk variant of publish_user_state.
+    """
+    cache.set_many(
+        {USER_STATE_KEY.format(user.pk): build_user_state(user) for user in users},
+        _state_timeout()
+    )
+
+
+@receiver(post_save, sender=User)
+def publish_saved_user(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Publish the state of a saved user, whatever saved it (the API, the Django
+    admin, a shell), once the transaction commits. New users have no tokens
+    yet and partial saves of other fields (last_login) change nothing.
+    """
+    if created or (update_fields is not None and not USER_STATE_FIELDS & set(update_fields)):
+        return
+    transaction.on_commit(lambda: publish_user_state(instance))
+
+
+@receiver(post_save, sender=ServiceProviderProfile)
+def publish_saved_profile(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Publish the state of a provider whose profile was saved (is_verified).
+    """
+    if created or (update_fields is not None and not PROFILE_STATE_FIELDS & set(update_fields)):
+        return
+    transaction.on_commit(lambda: publish_user_state(instance.user))
+
+
+@receiver(post_delete, sender=User)
+def publish_deleted_user(sender, instance, **kwargs):
+    """
+    Revoke the outstanding tokens of a deleted user.
+    """
+    # Read now, the primary key is cleared once the delete completes
+    key = USER_STATE_KEY.format(instance.pk)
+    state = {**build_user_state(instance), 'is_active': False}
+    transaction.on_commit(lambda: cache.set(key, state, _state_timeout()))
+
+
+def _state_from_claims(claims):
+    if not all(claim in claims for claim in STATE_CLAIMS):
+        return None
+    return {claim: claims[claim] for claim in STATE_CLAIMS}
+
+
+def get_user_state(user_id, claims):
+    """
+    Return the authorization state of a user: the published state if an admin
+    changed it recently, the token claims otherwise. Returns None when the token
+    predates the state claims.
+    """
+    state = cache.get(USER_STATE_KEY.format(user_id))
+    if state is not None:
+        return state
+    return _state_from_claims(claims)
+
+
+async def aget_user_state(user_id, claims):
+    """
+    Async variant of get_user_state, for the websocket middleware.
+    """
+    state = await cache.aget(USER_STATE_KEY.format(user_id))
+    if state is not None:
+        return state
+    return _state_from_claims(claims)
+
+
+def _refresh_deferred_together(instance, using=None, fields=None, **kwargs):
+    """
+    refresh_from_db of the instances built by _from_db: loading a deferred
+    field loads all the deferred fields, one query instead of one per field.
+    """
+    if fields is not None:
+        fields = set(fields) | instance.get_deferred_fields()
+    return type(instance).refresh_from_db(instance, using=using, fields=fields, **kwargs)
+
+
+def _from_db(model, loaded):
+    """
+    Instantiate a model the way a deferred queryset would, from a dict of the
+    loaded attnames. Model.from_db expects the values in field declaration order.
+    """
+    field_names = [f.attname for f in model._meta.concrete_fields if f.attname in loaded]
+    instance = model.from_db(DEFAULT_DB_ALIAS, field_names, [loaded[name] for name in field_names])
+    # Deferred fields load through refresh_from_db(fields=[name])
+    instance.refresh_from_db = partial(_refresh_deferred_together, instance)
+    return instance
+
+
+def user_from_state(user_id, state):
+    """
+    Build a User (and its provider profile) from a state without touching the database.
+
+    The instances are built like deferred querysets do, so the fields not carried
+    by the state are loaded lazily, all of them on the first access to any, and
+    save() only writes the fields that were actually loaded or assigned.
+    """
+    user = _from_db(User, {
+        'id': user_id,
+        'username': state['username'],
+        'user_type': state['user_type'],
+        'is_active': state['is_active'],
+    })
+    if state['profile_id'] is not None:
+        profile = _from_db(ServiceProviderProfile, {
+            'user_id': state['profile_id'],
+            'is_verified': state['is_verified'],
+        })
+        # Wire both sides of the one-to-one so neither access hits the database
+        User.provider_profile.related.set_cached_value(user, profile)
+        ServiceProviderProfile.user.field.set_cached_value(profile, user)
+    return user
@@ -1,4 +1,12 @@
-from math import radians, sin, cos, sqrt, atan2
+import time
+from collections import OrderedDict
+from datetime import datetime, time as dt_time, timezone as dt_timezone
+from math import radians, sin, cos, sqrt, atan2, degrees
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 def haversine(lat1, lon1, lat2, lon2):
     """
@@ -18,4 +26,94 @@ def haversine(lat1, lon1, lat2, lon2):
     c = 2 * atan2(sqrt(a), sqrt(1 - a))
 
     distance = R * c
-    return distance
\ No newline at end of file
+    return distance
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    (min_lat, max_lat, min_lon, max_lon) of a box containing the circle of
+    `radius_km` around a point, for a cheap pre-filter before haversine.
+    """
+    R = 6371.0
+    dlat = degrees(radius_km / R)
+    # Longitude degrees shrink towards the poles
+    cos_lat = cos(radians(lat))
+    dlon = 180.0 if cos_lat < 1e-6 else min(degrees(radius_km / (R * cos_lat)), 180.0)
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+def parse_moment(value):
+    """
+    Parse an ISO date or datetime query parameter into an aware datetime
+    (dates are midnight UTC). Returns None for an empty value and raises
+    ValueError for anything else it cannot parse.
+    """
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        moment = datetime.combine(day, dt_time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, dt_timezone.utc)
+    return moment
+
+
+def increment(model, lookup, **deltas):
+    """
+    Add `deltas` to the counter columns of the row matching `lookup` (which
+    should be a unique key), creating the row when it does not exist yet.
+    """
+    rows = model.objects.filter(**lookup)
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if rows.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Created concurrently in the meantime
+        rows.update(**changes)
+
+
+class TTLCache:
+    """
+    A small in-process cache whose entries expire after a timeout.
+    The oldest entries are evicted once max_entries is reached.
+    """
+
+    def __init__(self, max_entries=10000, timeout=60):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._data.pop(key, None)
+            return default
+        return value
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        if timeout <= 0:
+            return
+        self._data.pop(key, None)
+        self._data[key] = (time.monotonic() + timeout, value)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
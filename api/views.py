@@ -1,17 +1,33 @@
+import logging
+
 from .permissions import IsProviderUser, IsCustomerUser, IsProfileOwner, IsAdminUser
 from rest_framework import generics, permissions
 from rest_framework.exceptions import PermissionDenied
-from .models import ServiceCategory, User, Booking, Rating, ServiceProviderProfile, Payment, Service
+from .models import ServiceCategory, User, Booking, Rating, ServiceProviderProfile, Payment, Service, BookingRollup, HeatmapCell
 from .serializers import ServiceCategorySerializer, UserRegisterSerializer, UserProfileSerializer, ProviderStatusSerializer, ProviderLocationSerializer, BookingSerializer, RatingSerializer, ProviderProfileSerializer, AdminUserSerializer, ServiceSerializer, CustomTokenObtainPairSerializer, AdminServiceCategorySerializer, AdminServiceSerializer
 from rest_framework import status, viewsets
 from rest_framework.views import APIView  
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.db.models import Q, Avg, Count
+from datetime import timedelta, timezone as dt_timezone
+from django.db import router
+from django.conf import settings
+from django.db.models import Q, F, Avg, Count, OuterRef, Subquery, Sum
+from django.http import StreamingHttpResponse
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth, TruncWeek
 from django.utils import timezone
 from .mpesa_service import initiate_stk_push
+from .db_router import read_from_replica
+from .booking_transitions import apply_transition
+from .bulk_admin import apply_bulk_action, MAX_BULK_USERS
+from .utils import parse_moment
+from .logs import log_event
+from . import exports
+from . import eta, geohash, heatmap, profiling, rollups
 from rest_framework_simplejwt.views import TokenObtainPairView
 
+logger = logging.getLogger(__name__)
+
 class CustomTokenObtainPairView(TokenObtainPairView):
     """
     Custom token view that allows suspended users to log in.
@@ -19,6 +35,7 @@ class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
 # We'll use ListAPIView for a read-only endpoint that lists all items.
+@read_from_replica
 class ServiceCategoryListView(generics.ListAPIView):
     """
     API endpoint that lists all service categories along with the services under them.
@@ -87,11 +104,31 @@ class ProviderLocationView(APIView):
 
         if serializer.is_valid():
             serializer.save()
+            log_event(logger, 'location.ping', provider_id=request.user.pk, source='rest')
             # 204 No Content is suitable for a successful update with no body to return
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+def bookings_for(user):
+    """
+    The bookings of a user, newest first: the ones they created for customers,
+    the ones they were assigned for providers. Shared by BookingViewSet and the
+    async booking views (api/async_views.py).
+    """
+    if user.user_type == 'CUSTOMER':
+        bookings = Booking.objects.filter(customer=user)
+    elif user.user_type == 'PROVIDER':
+        bookings = Booking.objects.filter(provider=user)
+    else:
+        return Booking.objects.none() # Should not happen if user_type is enforced
+    return bookings.select_related(
+        'customer', 'provider', 'service', 'service__category'
+    ).prefetch_related(
+        'provider__provider_profile'
+    ).order_by('-created_at')
+
+
 class BookingViewSet(viewsets.ModelViewSet):
     """
     API endpoint for creating, listing, and retrieving bookings.
@@ -103,122 +140,81 @@ class BookingViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        """
-        This view should return a list of all the bookings
-        for the currently authenticated user.
-        Customers see bookings they created.
-        Providers see bookings they were assigned.
-        """
-        user = self.request.user
-        if user.user_type == 'CUSTOMER':
-            return Booking.objects.filter(customer=user).select_related(
-                'customer', 'provider', 'service', 'service__category'
-            ).prefetch_related(
-                'provider__provider_profile'
-            ).order_by('-created_at')
-        elif user.user_type == 'PROVIDER':
-            return Booking.objects.filter(provider=user).select_related(
-                'customer', 'provider', 'service', 'service__category'
-            ).prefetch_related(
-                'provider__provider_profile'
-            ).order_by('-created_at')
-        return Booking.objects.none() # Should not happen if user_type is enforced
+        return bookings_for(self.request.user)
 
     def perform_create(self, serializer):
         # When creating a booking, we pass the request context to the serializer
         # so it can access the logged-in user.
         serializer.save(customer=self.request.user)
     
+    def _transition(self, request, pk, name):
+        """
+        Apply a provider transition (see api/booking_transitions.py) and return
+        the compact result instead of re-serializing the whole booking.
+        """
+        result = apply_transition(pk, request.user, name)
+        if result.error == 'not_found':
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        if result.error == 'invalid_status':
+            return Response({'error': result.error_message}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result.as_dict())
+
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated, IsProviderUser])
     def accept_booking(self, request, pk=None):
         """
         Action for a provider to accept a pending booking.
-        URL: POST /api/bookings/{id}/accept/
+        URL: POST /api/bookings/{id}/accept_booking/
         """
-        booking = self.get_object()
-
-        # Check if the current user is the assigned provider
-        if booking.provider != request.user:
-            return Response({'error': 'You are not authorized to accept this booking.'}, status=status.HTTP_403_FORBIDDEN)
-        
-        # Check if the booking is in the correct state
-        if booking.status != 'PENDING':
-            return Response({'error': f'Cannot accept a booking with status {booking.status}.'}, status=status.HTTP_400_BAD_REQUEST)
-            
-        booking.status = 'ACCEPTED'
-        booking.accepted_at = timezone.now()
-        booking.save()
-        
-        serializer = self.get_serializer(booking)
-        return Response(serializer.data)
+        return self._transition(request, pk, 'accept')
 
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated, IsProviderUser])
     def decline_booking(self, request, pk=None):
         """
         Action for a provider to decline a pending booking.
-        URL: POST /api/bookings/{id}/decline/
+        URL: POST /api/bookings/{id}/decline_booking/
         """
-        booking = self.get_object()
-
-        # Check if the current user is the assigned provider
-        if booking.provider != request.user:
-            return Response({'error': 'You are not authorized to decline this booking.'}, status=status.HTTP_403_FORBIDDEN)
-        
-        # Check if the booking is in the correct state
-        if booking.status != 'PENDING':
-            return Response({'error': f'Cannot decline a booking with status {booking.status}.'}, status=status.HTTP_400_BAD_REQUEST)
-            
-        booking.status = 'REJECTED'
-        booking.save()
-        
-        serializer = self.get_serializer(booking)
-        return Response(serializer.data)
+        return self._transition(request, pk, 'decline')
         
     @action(detail=True, methods=['patch'], permission_classes=[permissions.IsAuthenticated, IsProviderUser])
     def start_job(self, request, pk=None):
         """
         Action for a provider to mark the job as 'IN_PROGRESS'.
         """
-        booking = self.get_object() # This gets the specific booking by its ID (pk)
-
-        # Check if the current user is the assigned provider
-        if booking.provider != request.user:
-            return Response({'error': 'You are not authorized to start this job.'}, status=status.HTTP_403_FORBIDDEN)
-        
-        # Check if the booking is in the correct state
-        if booking.status != 'ACCEPTED':
-            return Response({'error': f'Cannot start a job with status {booking.status}.'}, status=status.HTTP_400_BAD_REQUEST)
-            
-        booking.status = 'IN_PROGRESS'
-        booking.save()
-        
-        serializer = self.get_serializer(booking)
-        return Response(serializer.data)
+        return self._transition(request, pk, 'start')
 
     @action(detail=True, methods=['patch'], permission_classes=[permissions.IsAuthenticated, IsProviderUser])
     def complete_job(self, request, pk=None):
         """
         Action for a provider to mark the job as 'COMPLETED'.
         """
-        booking = self.get_object() # This gets the specific booking
-
-        # Authorization and state checks
-        if booking.provider != request.user:
-            return Response({'error': 'You are not authorized to complete this job.'}, status=status.HTTP_403_FORBIDDEN)
-
-        if booking.status != 'IN_PROGRESS':
-            return Response({'error': f'Cannot complete a job with status {booking.status}.'}, status=status.HTTP_400_BAD_REQUEST)
+        response = self._transition(request, pk, 'complete')
+        if response.status_code == status.HTTP_200_OK:
+            # TODO: Trigger the payment flow or notify customer to pay/rate
+            log_event(logger, 'booking.completed', booking_id=pk, provider_id=request.user.pk)
+        return response
+    
+    @action(detail=True, methods=['get'])
+    def eta(self, request, pk=None):
+        """
+        Current ETA of the provider to the booking location.
+        URL: GET /api/bookings/{id}/eta/
+        """
+        booking = self.get_object()
+        if booking.status not in ('PENDING', 'ACCEPTED', 'IN_PROGRESS'):
+            return Response({'eta_seconds': None}, status=status.HTTP_200_OK)
 
-        booking.status = 'COMPLETED'
-        booking.completed_at = timezone.now() # Record the completion time
-        booking.save()
+        current = eta.get_booking_eta(booking.id)
+        if current is None:
+            profile = getattr(booking.provider, 'provider_profile', None) if booking.provider else None
+            if profile is None or profile.last_known_latitude is None or profile.last_known_longitude is None:
+                return Response({'eta_seconds': None}, status=status.HTTP_200_OK)
+            current = eta.refresh_booking_eta(
+                booking.id,
+                (profile.last_known_latitude, profile.last_known_longitude),
+                (booking.booking_latitude, booking.booking_longitude),
+            )
+        return Response(current, status=status.HTTP_200_OK)
 
-        # TODO: Trigger the payment flow or notify customer to pay/rate
-        print(f"Booking {booking.id} completed. Ready for payment and rating.")
-        
-        serializer = self.get_serializer(booking)
-        return Response(serializer.data)
-    
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated, IsCustomerUser])
     def rate_job(self, request, pk=None):
         """
@@ -254,7 +250,7 @@ class BookingViewSet(viewsets.ModelViewSet):
             # Calculate the new average from all ratings received by the provider
             new_avg = Rating.objects.filter(ratee=booking.provider).aggregate(Avg('score'))['score__avg']
             provider_profile.average_rating = round(new_avg, 2)
-            provider_profile.save()
+            provider_profile.save(update_fields=['average_rating'])
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
@@ -301,6 +297,7 @@ class BookingViewSet(viewsets.ModelViewSet):
             # A provider would have to confirm receipt in a real app
             payment.status = 'SUCCESS'
             payment.save()
+            rollups.record_payment(booking, amount)
             return Response({'message': 'Cash payment recorded. Please pay the provider directly.'}, status=status.HTTP_200_OK)
 
         elif payment_method == 'M-PESA':
@@ -310,7 +307,7 @@ class BookingViewSet(viewsets.ModelViewSet):
             
             try:
                 # The callback URL must be publicly accessible (e.g., using ngrok for local dev)
-                callback_url = "https://414c-196-249-92-99.ngrok-free.app/api/payments/callback/"
+                callback_url = settings.MPESA_CALLBACK_URL
                 response = initiate_stk_push(
                     phone_number=phone_number,
                     amount=amount,
@@ -330,7 +327,7 @@ class BookingViewSet(viewsets.ModelViewSet):
             except Exception as e:
                 payment.status = 'FAILED'
                 payment.save()
-                return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVICE_ERROR)
+                return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
         else:
             return Response({'error': 'Invalid payment method.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -388,24 +385,30 @@ class CurrentProviderProfileView(APIView):
             
             # Update user fields
             user_fields = ['username', 'email', 'first_name', 'last_name', 'phone_number']
-            for field in user_fields:
-                if field in request.data:
-                    setattr(user, field, request.data[field])
+            changed_user_fields = [field for field in user_fields if field in request.data]
+            for field in changed_user_fields:
+                setattr(user, field, request.data[field])
             
             # Update provider profile fields
+            changed_profile_fields = []
             if 'bio' in request.data:
                 provider_profile.bio = request.data['bio']
+                changed_profile_fields.append('bio')
             
             if 'latitude' in request.data and 'longitude' in request.data:
                 provider_profile.last_known_latitude = request.data['latitude']
                 provider_profile.last_known_longitude = request.data['longitude']
+                changed_profile_fields += ['last_known_latitude', 'last_known_longitude']
             
             # Handle service selection
+            previous_service_id = None
             if 'service_id' in request.data and request.data['service_id']:
                 try:
                     from .models import Service
                     service = Service.objects.get(id=request.data['service_id'])
+                    previous_service_id = provider_profile.service_offered_id
                     provider_profile.service_offered = service
+                    changed_profile_fields.append('service_offered')
                 except Service.DoesNotExist:
                     return Response(
                         {'error': 'Invalid service selected'}, 
@@ -415,9 +418,17 @@ class CurrentProviderProfileView(APIView):
             # Handle service price (we'll add this field)
             if 'service_price' in request.data:
                 provider_profile.service_price = request.data['service_price']
+                changed_profile_fields.append('service_price')
             
-            user.save()
-            provider_profile.save()
+            # request.user is rebuilt from the token, so only write what actually changed
+            if changed_user_fields:
+                user.save(update_fields=changed_user_fields)
+            if changed_profile_fields:
+                provider_profile.save(update_fields=changed_profile_fields)
+                if 'service_offered' in changed_profile_fields:
+                    heatmap.sync_provider(provider_profile.pk, previous_service_id=previous_service_id)
+                elif 'last_known_latitude' in changed_profile_fields:
+                    heatmap.sync_provider(provider_profile.pk)
             
             return Response({'message': 'Profile updated successfully'})
             
@@ -428,6 +439,7 @@ class CurrentProviderProfileView(APIView):
             )
 
 
+@read_from_replica
 class ProviderProfileViewSet(viewsets.ModelViewSet): # <-- Change from ReadOnlyModelViewSet
     """
     API endpoint to:
@@ -439,9 +451,9 @@ class ProviderProfileViewSet(viewsets.ModelViewSet): # <-- Change from ReadOnlyM
     - PATCH /api/providers/{user_id}/
     """
     queryset = ServiceProviderProfile.objects.filter(is_verified=True).select_related(
-        'user'
+        'user', 'service_offered'
     ).prefetch_related(
-        'user__received_ratings'
+        'user__received_ratings__rater'
     )
     serializer_class = ProviderProfileSerializer
     lookup_field = 'user_id'
@@ -469,40 +481,53 @@ class MpesaCallbackView(APIView):
     permission_classes = [permissions.AllowAny] # No auth needed
 
     def post(self, request, *args, **kwargs):
-        print("M-Pesa Callback received!")
         data = request.data
-        print(data) # Log the entire callback data for debugging
-
         stk_callback = data.get('Body', {}).get('stkCallback', {})
         result_code = stk_callback.get('ResultCode')
         checkout_request_id = stk_callback.get('CheckoutRequestID')
+        log_event(
+            logger, 'mpesa.callback.received', checkout_request_id=checkout_request_id,
+            result_code=result_code, result_desc=stk_callback.get('ResultDesc'),
+        )
+        # The whole body only at DEBUG, with the phone number and receipt redacted
+        log_event(logger, 'mpesa.callback.body', level=logging.DEBUG, body=data)
 
         try:
             payment = Payment.objects.get(external_transaction_id=checkout_request_id)
         except Payment.DoesNotExist:
             # M-Pesa might send a callback for a transaction we don't know about.
             # We can just ignore it.
+            log_event(logger, 'mpesa.callback.unknown', level=logging.WARNING, checkout_request_id=checkout_request_id)
             return Response(status=status.HTTP_404_NOT_FOUND)
 
+        # M-Pesa retries callbacks, only count the payment towards revenue once
+        newly_paid = result_code == 0 and payment.status != 'SUCCESS'
+
         if result_code == 0:
             # Payment was successful
             payment.status = 'SUCCESS'
             # M-Pesa provides additional details in `CallbackMetadata` we could save
             # For example, the MpesaReceiptNumber
-            print(f"Payment {payment.id} for booking {payment.booking.id} was successful.")
+            log_event(logger, 'payment.succeeded', payment_id=payment.id, booking_id=payment.booking_id, retry=not newly_paid)
         else:
             # Payment failed or was cancelled
             payment.status = 'FAILED'
             # `ResultDesc` gives the reason for failure
-            print(f"Payment {payment.id} failed with code {result_code}: {stk_callback.get('ResultDesc')}")
+            log_event(
+                logger, 'payment.failed', level=logging.WARNING, payment_id=payment.id, booking_id=payment.booking_id,
+                result_code=result_code, result_desc=stk_callback.get('ResultDesc'),
+            )
         
         payment.save()
+        if newly_paid:
+            rollups.record_payment(payment.booking, payment.amount)
         
         # We must return a success response to M-Pesa's server
         return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'}, status=status.HTTP_200_OK)
 
 # --- Admin Views ---
 
+@read_from_replica
 class AdminStatsView(APIView):
     """
     API endpoint for admin dashboard statistics.
@@ -571,8 +596,16 @@ class AdminUserViewSet(viewsets.ModelViewSet):
     ViewSet for Admin to manage all users, with actions for activation,
     suspension, and provider verification.
     """
-    queryset = User.objects.all().select_related('provider_profile').prefetch_related(
-        'customer_bookings', 'provider_bookings'
+    queryset = User.objects.all().select_related('provider_profile__service_offered').annotate(
+        # One subquery per role rather than prefetching every booking of every user
+        customer_bookings_total=Subquery(
+            Booking.objects.filter(customer=OuterRef('pk')).order_by().values('customer')
+            .annotate(total=Count('pk')).values('total')
+        ),
+        provider_bookings_total=Subquery(
+            Booking.objects.filter(provider=OuterRef('pk')).order_by().values('provider')
+            .annotate(total=Count('pk')).values('total')
+        ),
     ).order_by('-date_joined')
     serializer_class = AdminUserSerializer
     permission_classes = [IsAdminUser]
@@ -581,10 +614,15 @@ class AdminUserViewSet(viewsets.ModelViewSet):
         """
         Optionally filter users based on query parameters.
         """
-        queryset = super().get_queryset()
-        
+        return self._filter_users(super().get_queryset(), self.request.query_params)
+
+    @staticmethod
+    def _filter_users(queryset, params):
+        """
+        Apply the search / user_type / is_active filters of the user list.
+        """
         # Search functionality
-        search = self.request.query_params.get('search', None)
+        search = params.get('search', None)
         if search:
             queryset = queryset.filter(
                 Q(username__icontains=search) |
@@ -594,18 +632,23 @@ class AdminUserViewSet(viewsets.ModelViewSet):
             )
         
         # Filter by user type
-        user_type = self.request.query_params.get('user_type', None)
+        user_type = params.get('user_type', None)
         if user_type:
             queryset = queryset.filter(user_type=user_type)
         
         # Filter by active status
-        is_active = self.request.query_params.get('is_active', None)
+        is_active = params.get('is_active', None)
         if is_active is not None:
-            active_bool = is_active.lower() == 'true'
+            active_bool = str(is_active).lower() == 'true'
             queryset = queryset.filter(is_active=active_bool)
         
         return queryset
 
+    def perform_destroy(self, instance):
+        # Outstanding tokens are revoked by api.user_state.publish_deleted_user
+        heatmap.remove_providers([instance.pk])
+        instance.delete()
+
     @action(detail=True, methods=['post'], url_path='suspend')
     def suspend(self, request, pk=None):
         """Suspends (deactivates) a user's account."""
@@ -618,12 +661,13 @@ class AdminUserViewSet(viewsets.ModelViewSet):
             )
         
         user.is_active = False
-        user.save()
+        user.save(update_fields=['is_active'])
         
         # If it's a provider, also set them off duty
         if user.user_type == 'PROVIDER' and hasattr(user, 'provider_profile'):
             user.provider_profile.on_duty = False
-            user.provider_profile.save()
+            user.provider_profile.save(update_fields=['on_duty'])
+            heatmap.sync_provider(user.pk)
         
         serializer = self.get_serializer(user)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -633,7 +677,7 @@ class AdminUserViewSet(viewsets.ModelViewSet):
         """Activates a suspended user's account."""
         user = self.get_object()
         user.is_active = True
-        user.save()
+        user.save(update_fields=['is_active'])
         
         serializer = self.get_serializer(user)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -648,17 +692,88 @@ class AdminUserViewSet(viewsets.ModelViewSet):
         try:
             # Activate the main user account as well
             user.is_active = True
-            user.save()
+            user.save(update_fields=['is_active'])
             
             profile = user.provider_profile
             profile.is_verified = True
-            profile.save()
+            profile.save(update_fields=['is_verified'])
             
             serializer = self.get_serializer(user)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except AttributeError:
             return Response({'error': 'Provider profile not found'}, status=status.HTTP_404_NOT_FOUND)
     
+    @staticmethod
+    def _bulk_filter_error(filters):
+        """
+        Why a bulk filter is refused, or None. The list view ignores empty
+        filters, a bulk action must not turn them into "every user".
+        """
+        for key in ('search', 'user_type', 'is_active'):
+            if key in filters and (filters[key] is None or str(filters[key]).strip() == ''):
+                return f'filter.{key} must not be empty'
+        user_types = {choice for choice, _ in User.USER_TYPE_CHOICES}
+        if 'user_type' in filters and filters['user_type'] not in user_types:
+            return f"filter.user_type must be one of {', '.join(sorted(user_types))}"
+        if 'is_active' in filters and str(filters['is_active']).lower() not in ('true', 'false'):
+            return 'filter.is_active must be true or false'
+        return None
+
+    def _bulk_action(self, request, name):
+        """
+        Apply `name` (see api/bulk_admin.py) to the users given either as
+        {"ids": [1, 2, ...]} or as {"filter": {"user_type": ..., "is_active": ..., "search": ...}}.
+        At most MAX_BULK_USERS users are changed per request; `matched` and
+        `truncated` tell how many users a filter matched and were left out.
+        """
+        ids = request.data.get('ids')
+        filters = request.data.get('filter')
+        if ids is not None:
+            if not isinstance(ids, list):
+                return Response({'error': 'ids must be a list of user ids'}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                ids = [int(user_id) for user_id in ids]
+            except (TypeError, ValueError):
+                return Response({'error': 'ids must be a list of user ids'}, status=status.HTTP_400_BAD_REQUEST)
+            if len(ids) > MAX_BULK_USERS:
+                return Response({'error': f'At most {MAX_BULK_USERS} users per request'}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = User.objects.filter(pk__in=ids)
+        elif isinstance(filters, dict) and {'search', 'user_type', 'is_active'} & set(filters):
+            error = self._bulk_filter_error(filters)
+            if error is not None:
+                return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = self._filter_users(User.objects.all(), filters)
+        else:
+            return Response({'error': 'Provide either ids or a filter'}, status=status.HTTP_400_BAD_REQUEST)
+
+        results, matched = apply_bulk_action(name, queryset, ids)
+        updated = sum(1 for result in results.values() if result == 'ok')
+        return Response({
+            'action': name,
+            'matched': matched,
+            # Users left for another request, past the MAX_BULK_USERS lowest ids
+            'truncated': max(matched - MAX_BULK_USERS, 0),
+            'updated': updated,
+            'skipped': len(results) - updated,
+            'results': {str(user_id): result for user_id, result in results.items()},
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='bulk-suspend')
+    def bulk_suspend(self, request):
+        """Suspends many users at once (superusers are skipped)."""
+        return self._bulk_action(request, 'suspend')
+
+    @action(detail=False, methods=['post'], url_path='bulk-activate')
+    def bulk_activate(self, request):
+        """Activates many suspended users at once."""
+        return self._bulk_action(request, 'activate')
+
+    @action(detail=False, methods=['post'], url_path='bulk-verify-provider')
+    def bulk_verify_provider(self, request):
+        """Verifies many providers at once, which also activates them."""
+        return self._bulk_action(request, 'verify')
+    
+@read_from_replica
 class AdminRecentBookingsView(APIView):
     """
     API endpoint for recent bookings data for admin dashboard.
@@ -709,6 +824,192 @@ class AdminRecentBookingsView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+@read_from_replica
+class AdminBookingSeriesView(APIView):
+    """
+    Booking and revenue time series for the admin dashboard, read from the
+    BookingRollup table so the cost depends on the requested range only.
+
+    GET /api/admin/analytics/bookings/?interval=day&start=2025-06-01&end=2025-07-01
+    Optional filters: service, status. Optional group_by: service or status.
+    Buckets are by booking creation time (UTC); revenue is successful payments.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsAdminUser]  # Admins only
+
+    INTERVALS = {'hour': TruncHour, 'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth}
+    GROUP_BY = {'service': 'service_id', 'status': 'status'}
+
+    def get(self, request, format=None):
+        params = request.query_params
+        interval = params.get('interval', 'day')
+        if interval not in self.INTERVALS:
+            return Response({'error': f"interval must be one of {', '.join(self.INTERVALS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        group_by = params.get('group_by')
+        if group_by and group_by not in self.GROUP_BY:
+            return Response({'error': 'group_by must be service or status'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            end = parse_moment(params.get('end')) or timezone.now()
+            start = parse_moment(params.get('start')) or end - timedelta(days=30)
+        except ValueError:
+            return Response({'error': 'start and end must be ISO dates or datetimes'}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = BookingRollup.objects.filter(bucket__gte=start, bucket__lt=end)
+        if params.get('service'):
+            try:
+                service_id = int(params['service'])
+            except ValueError:
+                return Response({'error': 'service must be a service id'}, status=status.HTTP_400_BAD_REQUEST)
+            rows = rows.filter(service_id=service_id)
+        if params.get('status'):
+            rows = rows.filter(status=params['status'])
+
+        fields = ['period'] + ([self.GROUP_BY[group_by]] if group_by else [])
+        series = rows.annotate(
+            period=self.INTERVALS[interval]('bucket', tzinfo=dt_timezone.utc)
+        ).values(*fields).annotate(
+            count=Sum('count'), revenue=Sum('revenue')
+        ).order_by(*fields)
+
+        return Response({
+            'interval': interval,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'series': [
+                {
+                    'period': row['period'].isoformat(),
+                    **({group_by: row[self.GROUP_BY[group_by]]} if group_by else {}),
+                    'count': row['count'],
+                    'revenue': str(row['revenue']),
+                }
+                for row in series
+            ],
+        }, status=status.HTTP_200_OK)
+
+@read_from_replica
+class AdminHeatmapView(APIView):
+    """
+    Supply/demand per geohash cell for the admin dashboard (see api/heatmap.py).
+
+    GET /api/admin/heatmap/?service=3&undersupplied=true
+    Cells are sorted by shortage (open bookings minus on-duty providers).
+    """
+    permission_classes = [permissions.IsAuthenticated, IsAdminUser]  # Admins only
+
+    def get(self, request, format=None):
+        cells = HeatmapCell.objects.filter(Q(providers__gt=0) | Q(open_bookings__gt=0))
+        if request.query_params.get('service'):
+            try:
+                service_id = int(request.query_params['service'])
+            except ValueError:
+                return Response({'error': 'service must be a service id'}, status=status.HTTP_400_BAD_REQUEST)
+            cells = cells.filter(service_id=service_id)
+        if request.query_params.get('undersupplied', '').lower() == 'true':
+            cells = cells.filter(open_bookings__gt=F('providers'))
+        cells = cells.annotate(shortage=F('open_bookings') - F('providers')).order_by('-shortage', 'cell')
+
+        data = []
+        for cell in cells.values('cell', 'service_id', 'providers', 'open_bookings', 'shortage'):
+            latitude, longitude = geohash.center(cell['cell'])
+            data.append({
+                'cell': cell['cell'],
+                'service': cell['service_id'],
+                'providers': cell['providers'],
+                'open_bookings': cell['open_bookings'],
+                'shortage': cell['shortage'],
+                'latitude': latitude,
+                'longitude': longitude,
+                'bounds': geohash.bounds(cell['cell']),
+            })
+        return Response({'precision': settings.HEATMAP_PRECISION, 'cells': data}, status=status.HTTP_200_OK)
+
+class AdminProfileListView(APIView):
+    """
+    Request and socket message profiles kept by this process (see api/profiling.py).
+
+    GET /api/admin/profiles/
+    """
+    permission_classes = [permissions.IsAuthenticated, IsAdminUser]  # Admins only
+
+    def get(self, request, format=None):
+        return Response({'profiles': profiling.get_store().summaries()}, status=status.HTTP_200_OK)
+
+
+class AdminProfileDetailView(APIView):
+    """
+    One profile with its SQL and stacks (or cProfile functions).
+
+    GET /api/admin/profiles/{id}/
+    """
+    permission_classes = [permissions.IsAuthenticated, IsAdminUser]  # Admins only
+
+    def get(self, request, profile_id, format=None):
+        profile = profiling.get_store().get(profile_id)
+        if profile is None:
+            return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(profile, status=status.HTTP_200_OK)
+
+
+class AdminProfileTokenView(APIView):
+    """
+    Issue a signed X-Profile header value: requests (or socket handshakes)
+    sending it are profiled.
+
+    POST /api/admin/profiles/token/ {"mode": "sampling" | "cprofile"}
+    """
+    permission_classes = [permissions.IsAuthenticated, IsAdminUser]  # Admins only
+
+    def post(self, request, format=None):
+        mode = request.data.get('mode') or settings.PROFILING_MODE
+        if mode not in profiling.MODES:
+            return Response({'error': f"mode must be one of {', '.join(profiling.MODES)}"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'header': profiling.PROFILE_HEADER,
+            'token': profiling.issue_token(mode),
+            'mode': mode,
+            'expires_in': settings.PROFILING_TOKEN_MAX_AGE,
+        }, status=status.HTTP_200_OK)
+
+@read_from_replica
+class AdminExportView(APIView):
+    """
+    Streaming export of bookings, payments or users for admins.
+
+    GET /api/admin/export/bookings.csv?start=2025-06-01&end=2025-07-01&status=COMPLETED
+    GET /api/admin/export/payments.ndjson?status=SUCCESS
+    GET /api/admin/export/users.csv?user_type=PROVIDER&is_active=true
+
+    Runs in constant memory however many rows match (see api/exports.py).
+    """
+    permission_classes = [permissions.IsAuthenticated, IsAdminUser]  # Admins only
+
+    def get(self, request, dataset, fmt, format=None):
+        if dataset not in exports.EXPORTS or fmt not in exports.FORMATS:
+            return Response({'error': 'Unknown export'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            start = parse_moment(request.query_params.get('start'))
+            end = parse_moment(request.query_params.get('end'))
+        except ValueError:
+            return Response({'error': 'start and end must be ISO dates or datetimes'}, status=status.HTTP_400_BAD_REQUEST)
+
+        filters = {
+            param: request.query_params[param]
+            for param in exports.EXPORTS[dataset]['filters'] if request.query_params.get(param)
+        }
+        # The rows are read after this view returned, so pick the database now
+        using = router.db_for_read(exports.EXPORTS[dataset]['model'])
+        try:
+            queryset = exports.export_queryset(dataset, start, end, filters, using=using)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(
+            exports.STREAMERS[fmt](dataset, queryset), content_type=exports.FORMATS[fmt]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{dataset}-{timezone.now():%Y%m%d-%H%M%S}.{fmt}"'
+        return response
+
+@read_from_replica
 class ServiceListView(generics.ListAPIView):
     """
     API endpoint that lists services, optionally filtered by category.
@@ -728,7 +1029,7 @@ class ServiceCategoryViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing service categories (admin only).
     """
-    queryset = ServiceCategory.objects.all()
+    queryset = ServiceCategory.objects.annotate(services_total=Count('services'))
     serializer_class = AdminServiceCategorySerializer
     permission_classes = [IsAdminUser]
 
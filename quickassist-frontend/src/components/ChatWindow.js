@@ -9,6 +9,7 @@ const ChatWindow = ({ bookingId, currentUser }) => {
     const chatSocketUrl = `ws://127.0.0.1:8000/ws/chat/${bookingId}/`;
 
     const { sendMessage, lastMessage, readyState } = useWebSocket(chatSocketUrl, {
+        queryParams: { token: localStorage.getItem('access_token') },
         shouldReconnect: (closeEvent) => true,
     });
     
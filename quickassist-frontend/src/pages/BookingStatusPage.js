@@ -21,6 +21,7 @@ const BookingStatusPage = () => {
     const [error, setError] = useState('');
     
     const [providerLocation, setProviderLocation] = useState(null);
+    const [etaSeconds, setEtaSeconds] = useState(null);
     
     // Payment states
     const [paymentLoading, setPaymentLoading] = useState(false);
@@ -34,6 +35,7 @@ const BookingStatusPage = () => {
     const locationSocketUrl = `ws://127.0.0.1:8000/ws/location/${bookingId}/`;
 
     const { lastJsonMessage: lastLocationMessage, sendMessage: sendLocationMessage } = useWebSocket(locationSocketUrl, {
+        queryParams: { token: localStorage.getItem('access_token') },
         share: true, // Important for sharing connection across components
     });
     
@@ -58,13 +60,27 @@ const BookingStatusPage = () => {
             }
         };
 
+        const fetchEta = async () => {
+            try {
+                const response = await axiosInstance.get(`/bookings/${bookingId}/eta/`);
+                setEtaSeconds(response.data.eta_seconds);
+            } catch (err) {
+                // The ETA is optional, the page works without it
+                console.error('Failed to load ETA', err);
+            }
+        };
+
         fetchBookingDetails();
+        fetchEta();
     }, [bookingId, navigate]);
 
     useEffect(() => {
-        // Update provider location from WebSocket
+        // Update provider location (and the ETA, when sent) from WebSocket
         if (lastLocationMessage) {
             setProviderLocation(lastLocationMessage);
+            if (lastLocationMessage.eta_seconds != null) {
+                setEtaSeconds(lastLocationMessage.eta_seconds);
+            }
         }
     }, [lastLocationMessage]);
 
@@ -88,7 +104,8 @@ const BookingStatusPage = () => {
     const handleUpdateStatus = async (action) => {
         try {
             const response = await axiosInstance.patch(`/bookings/${bookingId}/${action}/`);
-            setBooking(response.data); // Update the booking state with the new status
+            // The API returns only the changed fields (id, status, timestamps)
+            setBooking(prev => ({ ...prev, ...response.data }));
         } catch (err) {
             console.error(`Failed to ${action} job`, err);
             setError(`Could not update job status. Please try again.`);
@@ -274,6 +291,13 @@ const BookingStatusPage = () => {
                 {/* --- MAIN GRID (MAP & CHAT) --- */}
                 <Grid container spacing={3} sx={{ height: '65vh' }}>
                     <Grid item xs={12} md={8}>
+                        {etaSeconds != null && (
+                            <Chip
+                                label={`ETA ~${Math.max(1, Math.round(etaSeconds / 60))} min`}
+                                color="primary"
+                                sx={{ mb: 1 }}
+                            />
+                        )}
                         {/* We just need to pass the locations. The Map component handles the rest. */}
                         {customerLocation && 
                         <MapComponent 
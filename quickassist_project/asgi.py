@@ -1,16 +1,24 @@
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import api.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'quickassist_project.settings')
 
+# Initialize Django before importing anything that touches the models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter
+from api.middleware import JWTAuthMiddlewareStack
+from api.logs import SocketCorrelationMiddleware
+import api.routing
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
-        URLRouter(
-            api.routing.websocket_urlpatterns
+    "http": django_asgi_app,
+    # Sockets authenticate with the same JWT as the REST API (see api/middleware.py)
+    "websocket": SocketCorrelationMiddleware(
+        JWTAuthMiddlewareStack(
+            URLRouter(
+                api.routing.websocket_urlpatterns
+            )
         )
     ),
 })
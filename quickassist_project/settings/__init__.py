@@ -0,0 +1,13 @@
+"""
+Settings profiles for the QUICKASSIST project.
+
+DJANGO_ENV=production selects prod.py, anything else selects dev.py. A profile
+can also be chosen directly with DJANGO_SETTINGS_MODULE, e.g.
+quickassist_project.settings.prod.
+"""
+import os
+
+if os.getenv('DJANGO_ENV') == 'production':
+    from .prod import *  # noqa: F401,F403
+else:
+    from .dev import *  # noqa: F401,F403
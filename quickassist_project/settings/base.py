@@ -0,0 +1,369 @@
+import copy
+import os
+import sys
+from pathlib import Path
+from dotenv import load_dotenv 
+from django.core.exceptions import ImproperlyConfigured
+
+from datetime import timedelta
+
+# Settings shared by every profile. dev.py adds the debug tooling, prod.py strips
+# everything that is not needed on the request path.
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+# Load environment variables from .env file
+load_dotenv(os.path.join(BASE_DIR, '.env'))
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = os.getenv('SECRET_KEY')
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = os.getenv('DEBUG') == 'True'
+
+ALLOWED_HOSTS = ['414c-196-249-92-99.ngrok-free.app', 'localhost', '127.0.0.1']
+
+
+# Application definition
+
+INSTALLED_APPS = [
+    'channels',
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    
+    # 3rd Party Apps
+    'rest_framework',
+    'corsheaders',
+
+    # Local Apps
+    'api', 
+]
+
+MIDDLEWARE = [
+    # First, so its latency includes the other middleware (api/metrics.py)
+    'api.metrics.MetricsMiddleware',
+    'api.profiling.ProfilingMiddleware',
+    'api.logs.CorrelationIdMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.db_router.PrimaryPinMiddleware',
+]
+
+# Allow requests from your React development server
+CORS_ALLOWED_ORIGINS = [
+    "http://localhost:3000", 
+    "http://127.0.0.1:3000",
+]
+
+ROOT_URLCONF = 'quickassist_project.urls'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.debug',
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = 'quickassist_project.wsgi.application'
+
+
+# Database
+# https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+#
+# DB_ENGINE selects the profile: 'sqlite' (default, development) or 'postgres'.
+# Connections are persistent (CONN_MAX_AGE) and health-checked before reuse, so a
+# request or a sync_to_async consumer call does not pay a connection setup.
+# With DB_POOL=True, PostgreSQL uses psycopg 3 connection pooling instead.
+
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME'),
+            'USER': os.getenv('DB_USER'),
+            'PASSWORD': os.getenv('DB_PASSWORD'),
+            'HOST': os.getenv('DB_HOST'),
+            'PORT': os.getenv('DB_PORT'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if os.getenv('DB_POOL') == 'True':
+        # Requires psycopg 3 (psycopg[pool]); pooling replaces persistent connections
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '20')),
+            'timeout': int(os.getenv('DB_POOL_TIMEOUT', '10')),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # WAL lets readers run alongside the writer; writers wait instead of
+                # failing with "database is locked"
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': int(os.getenv('DB_BUSY_TIMEOUT', '20')),
+            },
+        }
+    }
+
+# Optional read replica, used only by views decorated with @read_from_replica
+# (see api/db_router.py). DB_REPLICA_HOST for PostgreSQL, DB_REPLICA_NAME (a second
+# SQLite file) for local testing.
+if DB_ENGINE == 'postgres' and os.getenv('DB_REPLICA_HOST'):
+    DATABASES['replica'] = copy.deepcopy(DATABASES['default'])
+    DATABASES['replica'].update({
+        'HOST': os.getenv('DB_REPLICA_HOST'),
+        'PORT': os.getenv('DB_REPLICA_PORT', os.getenv('DB_PORT')),
+    })
+elif DB_ENGINE != 'postgres' and os.getenv('DB_REPLICA_NAME'):
+    DATABASES['replica'] = copy.deepcopy(DATABASES['default'])
+    DATABASES['replica']['NAME'] = BASE_DIR / os.getenv('DB_REPLICA_NAME')
+
+if 'replica' in DATABASES:
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['api.db_router.PrimaryReplicaRouter']
+
+# Read-your-writes window: after a write, the user's reads stay on the primary
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '5'))
+
+# Supply/demand heatmap and matching (api/heatmap.py)
+HEATMAP_PRECISION = int(os.getenv('HEATMAP_PRECISION', '5'))  # geohash length, 5 is ~4.9 km cells
+# Matching searches the nearest providers anywhere unless MATCH_RADIUS_KM is set,
+# then within it, widened where providers are short (heatmap.search_radius_km)
+MATCH_RADIUS_KM = float(os.getenv('MATCH_RADIUS_KM')) if os.getenv('MATCH_RADIUS_KM') else None
+MATCH_MAX_RADIUS_KM = float(os.getenv('MATCH_MAX_RADIUS_KM', '100'))
+
+# Travel-time model for ETAs (api/eta.py): 'haversine' or 'road_graph'
+ETA_MODEL = os.getenv('ETA_MODEL', 'haversine')
+ETA_GRAPH_PATH = os.getenv('ETA_GRAPH_PATH', '')
+ETA_SPEED_KMH = float(os.getenv('ETA_SPEED_KMH', '30'))
+ETA_DETOUR_FACTOR = float(os.getenv('ETA_DETOUR_FACTOR', '1.3'))
+# Live ETAs are recomputed at most this often, or after the provider moved this far
+ETA_REFRESH_SECONDS = int(os.getenv('ETA_REFRESH_SECONDS', '15'))
+ETA_REFRESH_METERS = int(os.getenv('ETA_REFRESH_METERS', '200'))
+
+# M-Pesa Daraja API (api/mpesa_service.py). MPESA_BASE_URL can point at a stub
+# server, see the loadtest management command.
+MPESA_BASE_URL = os.getenv('MPESA_BASE_URL', 'https://sandbox.safaricom.co.ke').rstrip('/')
+# Must be publicly accessible (e.g. with ngrok for local development)
+MPESA_CALLBACK_URL = os.getenv('MPESA_CALLBACK_URL', 'https://414c-196-249-92-99.ngrok-free.app/api/payments/callback/')
+
+# Serve the location, duty, booking read and M-Pesa callback endpoints with the
+# native async views of api/async_views.py (needs an ASGI server)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'True') == 'True'
+
+# In-process metrics scraped at /metrics (api/metrics.py). With METRICS_TOKEN set,
+# scrapers must send it as a bearer token; the prod settings require it.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# On-demand profiling (api/profiling.py): requests and socket messages sampled at
+# PROFILING_SAMPLE_RATE, or carrying an admin-issued X-Profile header
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_MODE = os.getenv('PROFILING_MODE', 'sampling')  # sampling or cprofile
+PROFILING_INTERVAL_MS = float(os.getenv('PROFILING_INTERVAL_MS', '5'))
+PROFILING_BUFFER_SIZE = int(os.getenv('PROFILING_BUFFER_SIZE', '50'))
+PROFILING_TOKEN_MAX_AGE = int(os.getenv('PROFILING_TOKEN_MAX_AGE', '3600'))
+
+# Structured JSON logs for the 'api' loggers (api/logs.py), written by a
+# background thread from a bounded queue. High-volume events are sampled.
+# `manage.py test` only shows warnings and errors; tests checking events
+# capture them with assertLogs.
+TESTING = sys.argv[1:2] == ['test']
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'WARNING' if TESTING else 'INFO')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_SAMPLE_RATES = {
+    'location.ping': float(os.getenv('LOG_SAMPLE_LOCATION_PINGS', '0.01')),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'api.logs.JsonFormatter'},
+    },
+    'filters': {
+        'correlation_id': {'()': 'api.logs.CorrelationIdFilter'},
+    },
+    'handlers': {
+        'async_json': {
+            'class': 'api.logs.AsyncQueueHandler',
+            'stream': 'ext://sys.stdout',
+            'maxsize': LOG_QUEUE_SIZE,
+            'formatter': 'json',
+            'filters': ['correlation_id'],
+        },
+    },
+    'loggers': {
+        'api': {'handlers': ['async_json'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+}
+
+# Custom authentication backend that allows inactive users to log in
+AUTHENTICATION_BACKENDS = [
+    'api.authentication.AllowInactiveUserBackend',
+    'django.contrib.auth.backends.ModelBackend',  # Keep default as fallback
+]
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        'api.authentication.StatelessJWTAuthentication',
+    ),
+    # orjson-backed JSON (see api/fastjson.py)
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'api.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+}
+
+
+# Short-lived state published on suspend/activate/verify (see api/user_state.py).
+# Every process must see it, so CACHE_URL (redis://...) selects a shared Redis
+# cache. Without it, or with CACHE_URL=locmem://, the cache is local to the
+# process: fine for runserver and the tests, and required to be explicit in prod.
+CACHE_URL = os.getenv('CACHE_URL', '')
+if CACHE_URL and CACHE_URL != 'locmem://':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+SIMPLE_JWT = {
+    "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60), # 1 hour
+    "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
+}
+
+
+# Password validation
+# https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/4.2/topics/i18n/
+
+LANGUAGE_CODE = 'en-us'
+
+TIME_ZONE = 'UTC'
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/4.2/howto/static-files/
+
+STATIC_URL = 'static/'
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+AUTH_USER_MODEL = 'api.User'
+
+ASGI_APPLICATION = 'quickassist_project.asgi.application'
+
+# Channel layer strategy (CHANNEL_LAYER):
+# - redis: channels_redis core layer, sharded over REDIS_HOSTS with a hash ring
+# - pubsub: channels_redis pub/sub layer, sharded the same way
+# - local: in-process only, for a single-process deployment: sockets and the
+#   views that notify them must run in the same process. Refused when
+#   WEB_CONCURRENCY (the worker count of gunicorn/uvicorn) is above 1.
+# - local-first: in-process delivery, with Redis (CHANNEL_LAYER_INNER) unless
+#   the sending process has members in the group and knows of no other node's
+REDIS_HOSTS = [
+    (host.rsplit(':', 1)[0], int(host.rsplit(':', 1)[1])) if ':' in host else (host, 6379)
+    for host in os.getenv('REDIS_HOSTS', '127.0.0.1:6379').split(',') if host.strip()
+]
+CHANNEL_LAYER = os.getenv('CHANNEL_LAYER', 'redis')
+
+_REDIS_LAYERS = {
+    'redis': 'api.channel_layers.ShardedRedisChannelLayer',
+    'pubsub': 'api.channel_layers.ShardedRedisPubSubChannelLayer',
+}
+
+if CHANNEL_LAYER == 'local':
+    if int(os.getenv('WEB_CONCURRENCY', '1')) > 1:
+        raise ImproperlyConfigured(
+            "CHANNEL_LAYER=local only delivers within one process, use local-first or redis with several workers"
+        )
+    _channel_layer = {'BACKEND': 'api.channel_layers.LocalFirstChannelLayer', 'CONFIG': {}}
+elif CHANNEL_LAYER == 'local-first':
+    _channel_layer = {
+        'BACKEND': 'api.channel_layers.LocalFirstChannelLayer',
+        'CONFIG': {
+            'inner': {
+                'BACKEND': _REDIS_LAYERS[os.getenv('CHANNEL_LAYER_INNER', 'pubsub')],
+                'CONFIG': {'hosts': REDIS_HOSTS},
+            },
+        },
+    }
+else:
+    _channel_layer = {'BACKEND': _REDIS_LAYERS[CHANNEL_LAYER], 'CONFIG': {'hosts': REDIS_HOSTS}}
+
+CHANNEL_LAYERS = {'default': _channel_layer}
@@ -0,0 +1,26 @@
+# Development profile: debug toolbar and the OpenAPI schema/docs
+from .base import *  # noqa: F401,F403
+
+INSTALLED_APPS += [
+    'drf_spectacular',
+    'debug_toolbar',
+]
+
+MIDDLEWARE = ['debug_toolbar.middleware.DebugToolbarMiddleware'] + MIDDLEWARE
+
+# Debug Toolbar Configuration
+INTERNAL_IPS = [
+    '127.0.0.1',
+]
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+}
+
+SPECTACULAR_SETTINGS = {
+    'TITLE': 'QUICKASSIST API',
+    'DESCRIPTION': 'API documentation for the QUICKASSIST on-demand services platform.',
+    'VERSION': '1.0.0',
+    'SERVE_INCLUDE_SCHEMA': False, 
+}
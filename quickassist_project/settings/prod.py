@@ -0,0 +1,31 @@
+# Production profile: no debug tooling on the request path
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .base import *  # noqa: F401,F403
+
+DEBUG = False
+
+if os.getenv('ALLOWED_HOSTS'):
+    ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS').split(',')
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    # The frontend only speaks JSON, skip the BrowsableAPIRenderer and its templates
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+    ),
+}
+
+# StatelessJWTAuthentication trusts the token claims unless a suspension was
+# published to the cache, which a per-process cache hides from the other workers.
+# Single-process deployments opt in with CACHE_URL=locmem://.
+if 'api.authentication.StatelessJWTAuthentication' in REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'] and not CACHE_URL:
+    raise ImproperlyConfigured(
+        'CACHE_URL must point to a shared cache (redis://...) in production, suspensions would not reach every worker'
+    )
+
+# /metrics exposes request paths, volumes and timings, it is never public in production
+if METRICS_ENABLED and not METRICS_TOKEN:
+    raise ImproperlyConfigured('METRICS_TOKEN must be set in production, or metrics disabled with METRICS_ENABLED=False')